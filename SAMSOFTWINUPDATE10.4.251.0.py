@@ -4,37 +4,23 @@ Samsoft Update Manager - Windows 11 Style
 Modern Windows 11 Update interface with original backend functionality
 """
 
-import sys
 import os
-import ctypes
-import subprocess
 import threading
 import time
-import json
-import textwrap
 import queue
-from pathlib import Path
+import logging
+import logging.handlers
 from collections import deque
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, font
 
-# ---------- Auto-elevation ----------
-def is_admin():
-    try:
-        return ctypes.windll.shell32.IsUserAnAdmin()
-    except:
-        return False
-
-if not is_admin():
-    params = " ".join([f'"{arg}"' for arg in sys.argv])
-    ctypes.windll.shell32.ShellExecuteW(None, "runas", sys.executable, params, None, 1)
-    sys.exit()
-
-# ---------- Configuration ----------
-REPO_DIR = os.path.join(os.getcwd(), "SamsoftRepo")
-CONFIG_FILE = os.path.join(REPO_DIR, "config.json")
-os.makedirs(REPO_DIR, exist_ok=True)
+from samsoft_update_core import (
+    REPO_DIR, ConfigStore, ensure_elevated, cancel_requested,
+    UpdateEngine, JobScheduler, MaintenanceScheduler, RESOURCE_SERVICING, RESOURCE_REPO,
+    MANIFEST_STATES
+)
 
+# ---------- Theme Colors ----------
 # Windows 11 Color Palette - Light Mode
 W11_COLORS_LIGHT = {
     'bg_primary': '#f3f3f3',
@@ -68,31 +54,419 @@ W11_COLORS_DARK = {
 # Active color scheme (will be updated based on theme)
 W11_COLORS = W11_COLORS_LIGHT.copy()
 
-# Default configuration
-DEFAULT_CONFIG = {
-    "repo_path": REPO_DIR,
-    "update_categories": {
-        "windows": True,
-        "office": True,
-        "dotnet": True,
-        "vcredist": False
-    },
-    "auto_reboot": False,
-    "dark_mode": False
+# Windows 11-style fonts, created the first time a widget uses them
+FONT_SPECS = {
+    'font_title': dict(family="Segoe UI", size=24, weight="normal"),
+    'font_heading': dict(family="Segoe UI", size=16, weight="normal"),
+    'font_body': dict(family="Segoe UI", size=11),
+    'font_body_bold': dict(family="Segoe UI", size=11, weight="bold"),
+    'font_small': dict(family="Segoe UI", size=9)
 }
 
-def load_config():
-    if os.path.exists(CONFIG_FILE):
+# Cards below the fold are built once they come within this many pixels
+# of the viewport, or one at a time while Tk is idle
+CARD_PRELOAD_PX = 200
+CARD_IDLE_START_MS = 250
+CARD_IDLE_STEP_MS = 30
+
+# ---------- Theme Styles ----------
+class StyleRegistry:
+    """Semantic colour roles of themed widgets
+    
+    The create_* helpers register each widget with the palette key behind
+    each of its colour options (bg='bg_secondary', fg='text_primary', ...).
+    A theme switch then configures only those widgets from the new palette,
+    without walking the widget tree or reading colours back with cget().
+    """
+
+    def __init__(self):
+        self._widgets = []
+        self._hooks = []
+
+    def register(self, widget, **roles):
+        """Record widget's colour roles; returns the widget"""
+        self._widgets.append((widget, roles))
+        return widget
+
+    def on_apply(self, hook):
+        """Call hook() after every apply, for colours that are not widget options"""
+        self._hooks.append(hook)
+
+    def apply(self, palette):
+        alive = []
+        for widget, roles in self._widgets:
+            try:
+                widget.configure(**{option: palette[role] for option, role in roles.items()})
+            except tk.TclError:
+                # Widget has been destroyed
+                continue
+            alive.append((widget, roles))
+        self._widgets = alive
+        for hook in self._hooks:
+            hook()
+
+# ---------- UI Dispatcher ----------
+class UIDispatcher:
+    """Runs callbacks posted from any thread on the Tk thread
+    
+    Tk is only woken when the first callback of a burst is posted; the whole
+    burst is then drained in one pass, so it costs a single redraw. A
+    callback posted under a key replaces the one still pending for that key.
+    """
+
+    WAKE_EVENT = "<<UIDispatch>>"
+    # Only used when Tcl is built without thread support
+    POLL_MS = 50
+
+    def __init__(self, root):
+        self.root = root
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._scheduled = False
+        self._closed = False
+        self._seq = 0
+        self._tk_thread = threading.current_thread()
+        self.root.bind(self.WAKE_EVENT, lambda e: self.drain())
         try:
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return DEFAULT_CONFIG
-    return DEFAULT_CONFIG
+            self.threaded = bool(int(self.root.tk.eval("set tcl_platform(threaded)")))
+        except (tk.TclError, ValueError):
+            self.threaded = False
+        if not self.threaded:
+            self.root.after(self.POLL_MS, self._poll)
+        # Picks up callbacks whose wake-up failed before mainloop started
+        self.root.after_idle(self.drain)
+
+    def post(self, callback, key=None):
+        """Queue callback() to run on the Tk thread"""
+        with self._lock:
+            if self._closed:
+                return
+            if key is None:
+                self._seq += 1
+                key = ("job", self._seq)
+            self._pending[key] = callback
+            if self._scheduled:
+                return
+            self._scheduled = True
+        if threading.current_thread() is self._tk_thread:
+            self.root.after_idle(self.drain)
+        elif self.threaded:
+            try:
+                self.root.event_generate(self.WAKE_EVENT, when="tail")
+            except (tk.TclError, RuntimeError):
+                # Tk is not in its main loop yet (or is shutting down); let the
+                # next post try to wake it again instead of waiting forever
+                with self._lock:
+                    self._scheduled = False
+
+    def drain(self):
+        """Run everything posted so far"""
+        with self._lock:
+            jobs = list(self._pending.values())
+            self._pending.clear()
+            self._scheduled = False
+        for job in jobs:
+            try:
+                job()
+            except tk.TclError:
+                # Widget destroyed while the job was pending
+                pass
+
+    def _poll(self):
+        if self._closed:
+            return
+        if self._scheduled:
+            self.drain()
+        self.root.after(self.POLL_MS, self._poll)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._pending.clear()
 
-def save_config(config):
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=4)
+# ---------- Progress Bar ----------
+# Redraws are capped at roughly one per display frame
+PROGRESS_FRAME_MS = 16
+PROGRESS_HIDE_DELAY_MS = 300
+
+
+class ProgressBar:
+    """Progress bar drawn as one canvas rectangle, resized with coords()
+    
+    set() may be called as often as progress events arrive; the rectangle is
+    redrawn at most once per PROGRESS_FRAME_MS and only when its pixel width
+    changes. Tk thread only.
+    """
+
+    def __init__(self, canvas, height=4):
+        self.canvas = canvas
+        self.height = height
+        self.value = 0
+        self._drawn_width = None
+        self._last_draw = 0.0
+        self._redraw_pending = False
+        self.rect = canvas.create_rectangle(0, 0, 0, height, fill=W11_COLORS['accent'], outline="")
+        canvas.bind("<Configure>", lambda e: self._draw(), add="+")
+
+    def set(self, value):
+        self.value = max(0, min(100, value))
+        if self._redraw_pending:
+            return
+        wait_ms = PROGRESS_FRAME_MS - (time.monotonic() - self._last_draw) * 1000
+        if wait_ms <= 0:
+            self._draw()
+        else:
+            self._redraw_pending = True
+            self.canvas.after(int(wait_ms) + 1, self._draw)
+
+    def _draw(self):
+        self._redraw_pending = False
+        self._last_draw = time.monotonic()
+        width = self.canvas.winfo_width()
+        bar_width = int(width * self.value / 100) if width > 1 else 0
+        if bar_width != self._drawn_width:
+            self.canvas.coords(self.rect, 0, 0, bar_width, self.height)
+            self._drawn_width = bar_width
+
+    def recolor(self):
+        self.canvas.itemconfigure(self.rect, fill=W11_COLORS['accent'])
+
+# ---------- Log Buffer ----------
+LOG_BUFFER_LINES = 10000
+LOG_WINDOW_LINES = 500
+LOG_PAGE_LINES = 100
+LOG_FILE_NAME = "update.log"
+LOG_FILE_MAX_BYTES = 1024 * 1024
+LOG_FILE_BACKUPS = 5
+
+
+class LogStore:
+    """Ring buffer of recent log lines, mirrored to a rotating log file
+    
+    Every line gets a sequence number; lines older than the buffer capacity
+    are dropped from memory but stay in the log files on disk.
+    """
+
+    def __init__(self, log_dir, capacity=LOG_BUFFER_LINES):
+        self.lines = deque(maxlen=capacity)
+        self.first_seq = 0
+        self.next_seq = 0
+        self._lock = threading.Lock()
+        self._file_logger = logging.getLogger(f"samsoft.update.{id(self)}")
+        self._file_logger.propagate = False
+        self._file_logger.setLevel(logging.INFO)
+        self.set_log_dir(log_dir)
+
+    def set_log_dir(self, log_dir):
+        """Write the log file in log_dir from now on"""
+        with self._lock:
+            self._close_handlers()
+            try:
+                os.makedirs(log_dir, exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    os.path.join(log_dir, LOG_FILE_NAME),
+                    maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS,
+                    encoding="utf-8"
+                )
+                handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+                self._file_logger.addHandler(handler)
+            except OSError:
+                pass
+
+    def append(self, message, level="info", timestamp=None):
+        """Add a message; multi-line messages become one entry per line"""
+        stamp = time.strftime("%H:%M:%S", time.localtime(timestamp))
+        with self._lock:
+            for line in str(message).splitlines() or [""]:
+                if len(self.lines) == self.lines.maxlen:
+                    self.first_seq += 1
+                self.lines.append((f"[{stamp}] {line}", level))
+                self.next_seq += 1
+                self._file_logger.log(
+                    logging.ERROR if level == "error" else
+                    logging.WARNING if level == "warning" else logging.INFO,
+                    line
+                )
+
+    def range(self, start, end):
+        """Lines with sequence numbers in [start, end), clamped to the buffer"""
+        with self._lock:
+            start = max(start, self.first_seq)
+            end = min(end, self.next_seq)
+            return [self.lines[seq - self.first_seq] for seq in range(start, end)]
+
+    def _close_handlers(self):
+        for handler in list(self._file_logger.handlers):
+            handler.close()
+            self._file_logger.removeHandler(handler)
+
+    def close(self):
+        with self._lock:
+            self._close_handlers()
+
+
+class LogView:
+    """Keeps at most `window` LogStore lines in a Text widget
+    
+    While scrolled to the bottom the view follows new lines and trims the
+    top. Scrolling to the top or bottom edge pages older or newer lines in
+    from the store and trims the opposite end.
+    """
+
+    def __init__(self, text, scrollbar, store, window=LOG_WINDOW_LINES, page=LOG_PAGE_LINES):
+        self.text = text
+        self.scrollbar = scrollbar
+        self.store = store
+        self.window = window
+        self.page = page
+        # A view created after logging started picks up the latest window of lines
+        self.start = self.end = max(store.first_seq, store.next_seq - window)
+        self.follow = True
+        self._paging = False
+        self.text.configure(yscrollcommand=self.on_yscroll)
+
+    def _insert(self, index, lines):
+        for content, level in lines:
+            self.text.insert(index, content + "\n", (level,))
+            if index != "end":
+                index = self.text.index(f"{index} +1 lines")
+
+    def _delete_top(self, count):
+        if count > 0:
+            self.text.delete("1.0", f"{count + 1}.0")
+            self.start += count
+
+    def _delete_bottom(self, count):
+        if count > 0:
+            total = self.end - self.start
+            self.text.delete(f"{total - count + 1}.0", "end")
+            self.end -= count
+
+    def refresh(self):
+        """Show lines added to the store since the last refresh"""
+        if not self.follow:
+            return
+        # Lines that fell out of the ring buffer can no longer be shown
+        if self.end < self.store.first_seq:
+            self.text.config(state="normal")
+            self.text.delete("1.0", "end")
+            self.text.config(state="disabled")
+            self.start = self.end = self.store.first_seq
+        new_lines = self.store.range(self.end, self.store.next_seq)
+        if not new_lines:
+            return
+        new_lines = new_lines[-self.window:]
+        self.text.config(state="normal")
+        skipped = self.store.next_seq - len(new_lines) - self.end
+        if skipped > 0:
+            self.text.delete("1.0", "end")
+            self.start = self.end = self.end + skipped
+        self._insert("end", new_lines)
+        self.end += len(new_lines)
+        self._delete_top(self.end - self.start - self.window)
+        self.text.config(state="disabled")
+        self.text.see("end")
+
+    def on_yscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self._paging:
+            return
+        first, last = float(first), float(last)
+        self._paging = True
+        try:
+            if self.end < self.store.first_seq:
+                # Everything shown has left the ring buffer; jump to the tail
+                self.follow = True
+                self.refresh()
+                return
+            if first <= 0.0 and self.start > self.store.first_seq:
+                self.page_up()
+            elif last >= 1.0 and self.end < self.store.next_seq:
+                self.page_down()
+            self.follow = last >= 1.0 and self.end >= self.store.next_seq
+        finally:
+            self._paging = False
+
+    def page_up(self):
+        lines = self.store.range(self.start - self.page, self.start)
+        if not lines:
+            return
+        self.text.config(state="normal")
+        self._insert("1.0", lines)
+        self.start -= len(lines)
+        self._delete_bottom(self.end - self.start - self.window)
+        self.text.config(state="disabled")
+        self.text.yview(f"{len(lines) + 1}.0")
+
+    def page_down(self):
+        lines = self.store.range(self.end, self.end + self.page)
+        if not lines:
+            return
+        self.text.config(state="normal")
+        self._insert("end", lines)
+        self.end += len(lines)
+        trimmed = self.end - self.start - self.window
+        self._delete_top(trimmed)
+        self.text.config(state="disabled")
+        self.text.yview(f"{max(self.end - self.start - len(lines) - 1, 1)}.0")
+
+# ---------- Performance Summary ----------
+METRICS_COLUMNS = ("Phase", "Runs", "Last", "Mean", "Max", "Spawn", "1st out", "Per pkg", "Data")
+
+
+def format_seconds(value):
+    if value is None:
+        return "-"
+    if value >= 60:
+        return f"{value / 60:.1f}m"
+    return f"{value:.2f}s" if value < 10 else f"{value:.0f}s"
+
+
+def format_bytes(value):
+    if not value:
+        return "-"
+    for unit in ("B", "KB", "MB"):
+        if value < 1024:
+            return f"{value:.0f} {unit}"
+        value /= 1024
+    return f"{value:.1f} GB"
+
+
+def format_metrics(summary):
+    """Fixed-width table of Telemetry.summary(), slowest phases first"""
+    rows = [METRICS_COLUMNS]
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]["total"]):
+        runs = f"{stats['count']}" + (f" ({stats['failed']} failed)" if stats["failed"] else "")
+        rows.append((name, runs, format_seconds(stats["last"]), format_seconds(stats["mean"]),
+                     format_seconds(stats["max"]), format_seconds(stats["spawn"]),
+                     format_seconds(stats["first_output"]), format_seconds(stats["packages"]),
+                     format_bytes(stats["bytes"])))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(METRICS_COLUMNS))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+                     for row in rows)
+
+# ---------- Update History ----------
+HISTORY_COLUMNS = ("Date", "KB", "Status", "Operation", "Time", "Title")
+# Rows shown per page of the history card
+HISTORY_CARD_ROWS = 10
+HISTORY_TITLE_CHARS = 60
+HISTORY_STATUSES = ("All",) + MANIFEST_STATES
+HISTORY_PERIODS = {"All time": None, "Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90}
+
+
+def format_history(rows):
+    """Fixed-width table of UpdateHistory.query() rows; failures show their error"""
+    table = [HISTORY_COLUMNS]
+    for row in rows:
+        title = (row["error"] if row["status"] == "failed" and row["error"] else row["title"]) or ""
+        if len(title) > HISTORY_TITLE_CHARS:
+            title = title[:HISTORY_TITLE_CHARS - 1] + "…"
+        table.append((time.strftime("%Y-%m-%d %H:%M", time.localtime(row["time"])),
+                      row["kb"] or "-", row["status"], row["operation"] or "-",
+                      format_seconds(row["seconds"]), title))
+    widths = [max(len(row[i]) for row in table) for i in range(len(HISTORY_COLUMNS))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+                     for row in table)
 
 # ---------- Windows 11 Style Update Manager ----------
 class Windows11UpdateManager:
@@ -102,12 +476,17 @@ class Windows11UpdateManager:
         self.root.geometry("920x700")
         self.root.configure(bg=W11_COLORS['bg_primary'])
         
+        # Colour roles of every themed widget, for refresh_theme
+        self.style = StyleRegistry()
+        self.style.register(self.root, bg='bg_primary')
+        
         # Remove window decorations for modern look (optional)
         # self.root.overrideredirect(True)
         
-        self.config = load_config()
+        # Settings are read from memory and saved in the background
+        self.config_store = ConfigStore()
+        self.config = self.config_store.data
         self.repo_path = self.config.get("repo_path", REPO_DIR)
-        self.pswindowsupdate_available = False
         
         # Dark mode setup
         self.dark_mode = self.config.get("dark_mode", False)
@@ -121,27 +500,55 @@ class Windows11UpdateManager:
         
         # Thread control
         self.log_queue = queue.Queue()
-        self.ui_update_queue = queue.Queue()
-        self.running_threads = []
+        self.log_store = LogStore(os.path.join(self.repo_path, "logs"))
+        # Every widget change from worker threads goes through the dispatcher
+        self.dispatcher = UIDispatcher(self.root)
         self.stop_event = threading.Event()
+        # Set once their cards are built
+        self.log_view = None
+        self.jobs_frame = None
+        self.metrics_label = None
+        self.history_label = None
+        # Background work runs as cancellable jobs; the activity card mirrors them
+        self.jobs = JobScheduler(
+            on_change=lambda job: self.dispatcher.post(self.render_jobs, key="jobs")
+        )
         
-        # Custom fonts (Windows 11 style)
-        self.setup_fonts()
+        # Scanning, downloading and installing all live in the shared engine
+        self.engine = UpdateEngine(
+            self.config,
+            log=self.log,
+            progress=self.update_progress,
+            progress_text=self.set_progress_text,
+            finish_progress=self.finish_progress,
+            stop_event=self.stop_event
+        )
+        
+        # Sharing can be switched off by a failure before its card is built
+        self.share_repo_var = tk.BooleanVar(value=self.config.get("share_repo", False))
+        # Scans, downloads and installs on the configured windows, as jobs
+        self.maintenance = MaintenanceScheduler(self.engine, self.jobs)
+        self.maintenance_var = tk.BooleanVar(
+            value=self.config.get("scheduled_maintenance", False))
         
         # Create UI
         self.create_ui()
-        self.start_ui_loop()
         
         # Initial check
-        threading.Thread(target=self.check_pswindowsupdate, daemon=True).start()
+        self.run_async("Check update module", self.check_pswindowsupdate)
+        if self.share_repo_var.get():
+            self.run_async("Share repository", self.share_repo, [RESOURCE_REPO])
+        if self.maintenance_var.get():
+            self.maintenance.start()
 
-    def setup_fonts(self):
-        """Setup Windows 11-style fonts"""
-        self.font_title = font.Font(family="Segoe UI", size=24, weight="normal")
-        self.font_heading = font.Font(family="Segoe UI", size=16, weight="normal")
-        self.font_body = font.Font(family="Segoe UI", size=11)
-        self.font_body_bold = font.Font(family="Segoe UI", size=11, weight="bold")
-        self.font_small = font.Font(family="Segoe UI", size=9)
+    def __getattr__(self, name):
+        # Fonts are created on first use rather than before the first paint
+        spec = FONT_SPECS.get(name)
+        if spec is None:
+            raise AttributeError(name)
+        value = font.Font(**spec)
+        setattr(self, name, value)
+        return value
 
     def apply_color_scheme(self):
         """Apply color scheme based on dark mode setting"""
@@ -157,45 +564,90 @@ class Windows11UpdateManager:
         # Main container
         main_container = tk.Frame(self.root, bg=W11_COLORS['bg_primary'])
         main_container.pack(fill="both", expand=True)
+        self.style.register(main_container, bg='bg_primary')
         
         # Header section
         self.create_header(main_container)
         
         # Scrollable content area
-        canvas = tk.Canvas(main_container, bg=W11_COLORS['bg_primary'], 
-                          highlightthickness=0, bd=0)
+        self.canvas = canvas = tk.Canvas(main_container, bg=W11_COLORS['bg_primary'], 
+                                         highlightthickness=0, bd=0)
         scrollbar = ttk.Scrollbar(main_container, orient="vertical", command=canvas.yview)
         
         self.scrollable_frame = tk.Frame(canvas, bg=W11_COLORS['bg_primary'])
+        self.style.register(canvas, bg='bg_primary')
+        self.style.register(self.scrollable_frame, bg='bg_primary')
         self.scrollable_frame.bind(
             "<Configure>",
             lambda e: canvas.configure(scrollregion=canvas.bbox("all"))
         )
         
+        def on_yscroll(first, last):
+            scrollbar.set(first, last)
+            self.schedule_fill_viewport()
+        
         canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
+        canvas.configure(yscrollcommand=on_yscroll)
+        canvas.bind("<Configure>", lambda e: self.schedule_fill_viewport())
         
         canvas.pack(side="left", fill="both", expand=True, padx=40, pady=20)
         scrollbar.pack(side="right", fill="y")
         
-        # Content sections
-        self.create_status_card()
-        self.create_update_history_card()
-        self.create_advanced_options_card()
-        self.create_additional_tools_card()
-        
         # Status bar at bottom
         self.create_status_bar()
+        
+        # Content sections: only the status card is built before the first
+        # paint; the rest follow in order as they scroll into view or at idle
+        self.create_status_card()
+        self.pending_cards = deque([
+            self.create_activity_card,
+            self.create_update_history_card,
+            self.create_log_card,
+            self.create_advanced_options_card,
+            self.create_performance_card,
+            self.create_additional_tools_card
+        ])
+        self.fill_scheduled = False
+        self.root.after(CARD_IDLE_START_MS, self.build_cards_when_idle)
+
+    def build_next_card(self):
+        """Build the next pending card; returns False when none are left"""
+        if not self.pending_cards:
+            return False
+        self.pending_cards.popleft()()
+        return True
+
+    def schedule_fill_viewport(self):
+        if self.pending_cards and not self.fill_scheduled:
+            self.fill_scheduled = True
+            self.root.after_idle(self.fill_viewport)
+
+    def fill_viewport(self):
+        """Build pending cards until they reach past the bottom of the viewport"""
+        self.fill_scheduled = False
+        while self.pending_cards:
+            self.scrollable_frame.update_idletasks()
+            bottom = self.scrollable_frame.winfo_reqheight() - self.canvas.canvasy(0)
+            if bottom > self.canvas.winfo_height() + CARD_PRELOAD_PX:
+                break
+            self.build_next_card()
+
+    def build_cards_when_idle(self):
+        """Build the remaining cards one per idle step, so none is missing on a fast scroll"""
+        if self.build_next_card():
+            self.root.after(CARD_IDLE_STEP_MS, self.build_cards_when_idle)
 
     def create_header(self, parent):
         """Create Windows 11-style header"""
         header = tk.Frame(parent, bg=W11_COLORS['bg_primary'], height=80)
         header.pack(fill="x", padx=40, pady=(20, 0))
         header.pack_propagate(False)
+        self.style.register(header, bg='bg_primary')
         
         # Left side - Title
         left_frame = tk.Frame(header, bg=W11_COLORS['bg_primary'])
         left_frame.pack(side="left", fill="both", expand=True)
+        self.style.register(left_frame, bg='bg_primary')
         
         title_label = tk.Label(
             left_frame,
@@ -205,6 +657,7 @@ class Windows11UpdateManager:
             fg=W11_COLORS['text_primary']
         )
         title_label.pack(anchor="w", pady=(10, 0))
+        self.style.register(title_label, bg='bg_primary', fg='text_primary')
         
         # Subtitle
         self.subtitle_label = tk.Label(
@@ -215,10 +668,12 @@ class Windows11UpdateManager:
             fg=W11_COLORS['text_secondary']
         )
         self.subtitle_label.pack(anchor="w")
+        self.style.register(self.subtitle_label, bg='bg_primary', fg='text_secondary')
         
         # Right side - Dark mode toggle
         right_frame = tk.Frame(header, bg=W11_COLORS['bg_primary'])
         right_frame.pack(side="right", pady=10)
+        self.style.register(right_frame, bg='bg_primary')
         
         # Dark mode toggle button
         self.theme_button = tk.Button(
@@ -237,6 +692,8 @@ class Windows11UpdateManager:
             command=self.toggle_dark_mode
         )
         self.theme_button.pack(side="right")
+        self.style.register(self.theme_button, bg='bg_card', fg='text_primary',
+                            activebackground='border', activeforeground='text_primary')
         
         # Hover effects for theme button
         self.theme_button.bind("<Enter>", lambda e: self.theme_button.config(bg=W11_COLORS['border']))
@@ -249,6 +706,7 @@ class Windows11UpdateManager:
         # Status icon and text
         status_frame = tk.Frame(card, bg=W11_COLORS['bg_secondary'])
         status_frame.pack(fill="x", pady=20, padx=20)
+        self.style.register(status_frame, bg='bg_secondary')
         
         # Icon placeholder (you can add actual icon)
         self.status_icon = tk.Label(
@@ -259,10 +717,12 @@ class Windows11UpdateManager:
             fg=W11_COLORS['success']
         )
         self.status_icon.pack(side="left", padx=(0, 15))
+        self.style.register(self.status_icon, bg='bg_secondary')
         
         # Status text
         text_frame = tk.Frame(status_frame, bg=W11_COLORS['bg_secondary'])
         text_frame.pack(side="left", fill="x", expand=True)
+        self.style.register(text_frame, bg='bg_secondary')
         
         self.status_title = tk.Label(
             text_frame,
@@ -273,6 +733,7 @@ class Windows11UpdateManager:
             anchor="w"
         )
         self.status_title.pack(fill="x")
+        self.style.register(self.status_title, bg='bg_secondary', fg='text_primary')
         
         self.status_subtitle = tk.Label(
             text_frame,
@@ -283,9 +744,11 @@ class Windows11UpdateManager:
             anchor="w"
         )
         self.status_subtitle.pack(fill="x")
+        self.style.register(self.status_subtitle, bg='bg_secondary', fg='text_secondary')
         
         # Progress bar (hidden by default)
         self.progress_frame = tk.Frame(card, bg=W11_COLORS['bg_secondary'])
+        self.style.register(self.progress_frame, bg='bg_secondary')
         
         self.progress_label = tk.Label(
             self.progress_frame,
@@ -295,6 +758,7 @@ class Windows11UpdateManager:
             fg=W11_COLORS['text_secondary']
         )
         self.progress_label.pack(pady=(10, 5), padx=20, anchor="w")
+        self.style.register(self.progress_label, bg='bg_secondary', fg='text_secondary')
         
         # Custom progress bar
         self.progress_canvas = tk.Canvas(
@@ -305,12 +769,15 @@ class Windows11UpdateManager:
             bd=0
         )
         self.progress_canvas.pack(fill="x", padx=20, pady=(0, 20))
-        self.progress_bar_rect = None
+        self.progress_bar = ProgressBar(self.progress_canvas)
+        self.style.register(self.progress_canvas, bg='border')
+        self.style.on_apply(self.progress_bar.recolor)
         self.current_progress = 0
         
         # Buttons
         button_frame = tk.Frame(card, bg=W11_COLORS['bg_secondary'])
         button_frame.pack(fill="x", pady=(0, 20), padx=20)
+        self.style.register(button_frame, bg='bg_secondary')
         
         self.check_button = self.create_accent_button(
             button_frame,
@@ -334,11 +801,97 @@ class Windows11UpdateManager:
         self.install_button.pack(side="left")
         self.install_button.pack_forget()  # Hidden initially
 
+    def create_activity_card(self):
+        """Activity card listing queued, running and recent jobs"""
+        card = self.create_card(self.scrollable_frame)
+        
+        title = tk.Label(
+            card,
+            text="Activity",
+            font=self.font_body_bold,
+            bg=W11_COLORS['bg_secondary'],
+            fg=W11_COLORS['text_primary']
+        )
+        title.pack(anchor="w", pady=(20, 10), padx=20)
+        self.style.register(title, bg='bg_secondary', fg='text_primary')
+        
+        self.jobs_frame = tk.Frame(card, bg=W11_COLORS['bg_secondary'])
+        self.jobs_frame.pack(fill="x", padx=20, pady=(0, 20))
+        self.style.register(self.jobs_frame, bg='bg_secondary')
+        
+        self.jobs_empty = tk.Label(
+            self.jobs_frame,
+            text="No recent activity",
+            font=self.font_small,
+            bg=W11_COLORS['bg_secondary'],
+            fg=W11_COLORS['text_secondary']
+        )
+        self.jobs_empty.pack(anchor="w")
+        self.style.register(self.jobs_empty, bg='bg_secondary', fg='text_secondary')
+        
+        # Job id -> (row, label, cancel link); rows are reused between renders
+        self.job_rows = {}
+        self.render_jobs()
+
+    def create_job_row(self, job):
+        """Create the activity row of one job"""
+        row = tk.Frame(self.jobs_frame, bg=W11_COLORS['bg_secondary'])
+        row.pack(fill="x", pady=2)
+        
+        label = tk.Label(
+            row,
+            font=self.font_small,
+            bg=W11_COLORS['bg_secondary'],
+            fg=W11_COLORS['text_primary'],
+            anchor="w"
+        )
+        label.pack(side="left")
+        
+        cancel = tk.Label(
+            row,
+            text="Cancel",
+            font=self.font_small,
+            bg=W11_COLORS['bg_secondary'],
+            fg=W11_COLORS['accent'],
+            cursor="hand2"
+        )
+        cancel.pack(side="right")
+        cancel.bind("<Button-1>", lambda e: self.on_cancel_job(job.id))
+        self.style.register(row, bg='bg_secondary')
+        self.style.register(label, bg='bg_secondary', fg='text_primary')
+        self.style.register(cancel, bg='bg_secondary', fg='accent')
+        return row, label, cancel
+
+    def render_jobs(self):
+        """Bring the activity card in line with the scheduler's job table"""
+        if self.jobs_frame is None:
+            return
+        jobs = self.jobs.jobs()
+        current = {job.id for job in jobs}
+        for job_id in list(self.job_rows):
+            if job_id not in current:
+                self.job_rows.pop(job_id)[0].destroy()
+        
+        for job in jobs:
+            if job.id not in self.job_rows:
+                self.job_rows[job.id] = self.create_job_row(job)
+            row, label, cancel = self.job_rows[job.id]
+            text = f"{job.name} — {job.state}"
+            if job.finished and job.started:
+                text += f" ({job.finished - job.started:.0f}s)"
+            label.config(text=text)
+            if not job.active:
+                cancel.pack_forget()
+        
+        if jobs:
+            self.jobs_empty.pack_forget()
+        else:
+            self.jobs_empty.pack(anchor="w")
+
     def create_update_history_card(self):
-        """Update history card"""
+        """Update history card, paging through the engine's history database"""
         card = self.create_card(self.scrollable_frame)
         
-        # Card title
         title = tk.Label(
             card,
             text="Update history",
@@ -347,11 +900,166 @@ class Windows11UpdateManager:
             fg=W11_COLORS['text_primary']
         )
         title.pack(anchor="w", pady=(20, 10), padx=20)
+        self.style.register(title, bg='bg_secondary', fg='text_primary')
+        
+        # Filters: status, period and KB
+        filters = tk.Frame(card, bg=W11_COLORS['bg_secondary'])
+        filters.pack(fill="x", padx=20, pady=(0, 10))
+        self.style.register(filters, bg='bg_secondary')
+        
+        self.history_status_var = tk.StringVar(value=HISTORY_STATUSES[0])
+        self.history_period_var = tk.StringVar(value=next(iter(HISTORY_PERIODS)))
+        self.history_kb_var = tk.StringVar()
+        for var, values, width in ((self.history_status_var, HISTORY_STATUSES, 12),
+                                   (self.history_period_var, tuple(HISTORY_PERIODS), 14)):
+            box = ttk.Combobox(filters, textvariable=var, values=values,
+                               state="readonly", width=width)
+            box.pack(side="left", padx=(0, 10))
+            box.bind("<<ComboboxSelected>>", lambda e: self.on_history_filter())
+        
+        kb_entry = tk.Entry(
+            filters,
+            textvariable=self.history_kb_var,
+            font=self.font_small,
+            bg=W11_COLORS['bg_card'],
+            fg=W11_COLORS['text_primary'],
+            insertbackground=W11_COLORS['text_primary'],
+            relief="flat",
+            width=14
+        )
+        kb_entry.pack(side="left")
+        kb_entry.bind("<Return>", lambda e: self.on_history_filter())
+        self.style.register(kb_entry, bg='bg_card', fg='text_primary',
+                            insertbackground='text_primary')
+        
+        kb_hint = tk.Label(
+            filters,
+            text="KB (Enter to search)",
+            font=self.font_small,
+            bg=W11_COLORS['bg_secondary'],
+            fg=W11_COLORS['text_secondary']
+        )
+        kb_hint.pack(side="left", padx=(5, 0))
+        self.style.register(kb_hint, bg='bg_secondary', fg='text_secondary')
+        
+        # One page of query results at a time
+        self.history_label = tk.Label(
+            card,
+            text="No updates recorded yet",
+            font=("Consolas", 9),
+            bg=W11_COLORS['bg_secondary'],
+            fg=W11_COLORS['text_secondary'],
+            justify="left",
+            anchor="w"
+        )
+        self.history_label.pack(anchor="w", padx=20)
+        self.style.register(self.history_label, bg='bg_secondary', fg='text_secondary')
+        
+        pager = tk.Frame(card, bg=W11_COLORS['bg_secondary'])
+        pager.pack(fill="x", padx=20, pady=(10, 20))
+        self.style.register(pager, bg='bg_secondary')
+        
+        self.history_newer = tk.Label(
+            pager,
+            text="‹ Newer",
+            font=self.font_small,
+            bg=W11_COLORS['bg_secondary'],
+            fg=W11_COLORS['accent'],
+            cursor="hand2"
+        )
+        self.history_newer.pack(side="left")
+        self.history_newer.bind("<Button-1>", lambda e: self.on_history_page(-1))
+        self.style.register(self.history_newer, bg='bg_secondary', fg='accent')
+        
+        self.history_page_label = tk.Label(
+            pager,
+            font=self.font_small,
+            bg=W11_COLORS['bg_secondary'],
+            fg=W11_COLORS['text_secondary']
+        )
+        self.history_page_label.pack(side="left", padx=10)
+        self.style.register(self.history_page_label, bg='bg_secondary', fg='text_secondary')
+        
+        self.history_older = tk.Label(
+            pager,
+            text="Older ›",
+            font=self.font_small,
+            bg=W11_COLORS['bg_secondary'],
+            fg=W11_COLORS['accent'],
+            cursor="hand2"
+        )
+        self.history_older.pack(side="left")
+        self.history_older.bind("<Button-1>", lambda e: self.on_history_page(1))
+        self.style.register(self.history_older, bg='bg_secondary', fg='accent')
+        
+        self.history_offset = 0
+        self.history_total = 0
+        self.engine.history.on_change = lambda: self.dispatcher.post(
+            self.render_history, key="history")
+        self.dispatcher.post(self.render_history, key="history")
+
+    def history_filters(self):
+        """(kb, status, since) from the history card's filter widgets"""
+        status = self.history_status_var.get()
+        days = HISTORY_PERIODS.get(self.history_period_var.get())
+        return (self.history_kb_var.get().strip() or None,
+                None if status == HISTORY_STATUSES[0] else status,
+                time.time() - days * 86400 if days else None)
+
+    def render_history(self):
+        """Show the current page of history query results"""
+        if self.history_label is None:
+            return
+        kb, status, since = self.history_filters()
+        history = self.engine.history
+        self.history_total = history.count(kb, status, since)
+        # A filter or a prune can leave the offset past the end
+        if self.history_offset >= self.history_total:
+            self.history_offset = max(0, (self.history_total - 1) // HISTORY_CARD_ROWS
+                                      * HISTORY_CARD_ROWS)
+        rows = history.query(kb, status, since, limit=HISTORY_CARD_ROWS,
+                             offset=self.history_offset)
+        if rows:
+            self.history_label.config(text=format_history(rows))
+            self.history_page_label.config(
+                text=f"{self.history_offset + 1}–{self.history_offset + len(rows)}"
+                     f" of {self.history_total}")
+        else:
+            self.history_label.config(text="No matching updates")
+            self.history_page_label.config(text="")
+
+    def on_history_filter(self):
+        """Start again from the newest page after a filter change"""
+        self.history_offset = 0
+        self.render_history()
+
+    def on_history_page(self, step):
+        """Move one page towards older (step 1) or newer (step -1) entries"""
+        offset = self.history_offset + step * HISTORY_CARD_ROWS
+        if 0 <= offset < self.history_total:
+            self.history_offset = offset
+            self.render_history()
+
+    def create_log_card(self):
+        """Log card"""
+        card = self.create_card(self.scrollable_frame)
+        
+        # Card title
+        title = tk.Label(
+            card,
+            text="Log",
+            font=self.font_body_bold,
+            bg=W11_COLORS['bg_secondary'],
+            fg=W11_COLORS['text_primary']
+        )
+        title.pack(anchor="w", pady=(20, 10), padx=20)
+        self.style.register(title, bg='bg_secondary', fg='text_primary')
         
         # Log area with custom styling
         log_container = tk.Frame(card, bg=W11_COLORS['bg_card'], 
                                 relief="flat", bd=1)
         log_container.pack(fill="both", expand=True, padx=20, pady=(0, 20))
+        self.style.register(log_container, bg='bg_card')
         
         # Text widget for logs
         self.log_text = tk.Text(
@@ -368,12 +1076,18 @@ class Windows11UpdateManager:
         
         log_scrollbar = ttk.Scrollbar(log_container, orient="vertical", 
                                      command=self.log_text.yview)
-        self.log_text.configure(yscrollcommand=log_scrollbar.set)
+        self.style.register(self.log_text, bg='bg_card', fg='text_primary')
+        self.style.on_apply(self.apply_log_tag_colors)
+        self.apply_log_tag_colors()
+        
+        # Only a window of the log store is kept in the widget
+        self.log_view = LogView(self.log_text, log_scrollbar, self.log_store)
         
         self.log_text.pack(side="left", fill="both", expand=True, padx=5, pady=5)
         log_scrollbar.pack(side="right", fill="y")
         
         self.log_text.config(state="disabled")
+        self.log_view.refresh()
 
     def create_advanced_options_card(self):
         """Advanced options card"""
@@ -387,6 +1101,7 @@ class Windows11UpdateManager:
             fg=W11_COLORS['text_primary']
         )
         title.pack(anchor="w", pady=(20, 15), padx=20)
+        self.style.register(title, bg='bg_secondary', fg='text_primary')
         
         # Options list
         self.create_option_row(card, "Install from offline repo", 
@@ -397,20 +1112,82 @@ class Windows11UpdateManager:
                               self.on_update_dotnet)
         self.create_option_row(card, "Update VC++ Redistributables", 
                               self.on_update_vcredist)
+        self.create_option_row(card, "Update all selected categories", 
+                              self.on_update_all)
+        self.create_option_row(card, "Verify repository packages", 
+                              self.on_verify_repo)
+        self.create_option_row(card, "Clean up superseded packages", 
+                              self.on_clean_repo)
         
         # Separator
         sep = tk.Frame(card, bg=W11_COLORS['border'], height=1)
         sep.pack(fill="x", padx=20, pady=10)
+        self.style.register(sep, bg='border')
         
         # Settings
         self.auto_reboot_var = tk.BooleanVar(value=self.config.get("auto_reboot", False))
         self.create_toggle_row(card, "Automatic restart", self.auto_reboot_var, 
                               self.on_toggle_auto_reboot)
+        self.create_toggle_row(card, "Share repository on the local network", 
+                              self.share_repo_var, self.on_toggle_share_repo)
+        self.create_toggle_row(card, "Scheduled maintenance", 
+                              self.maintenance_var, self.on_toggle_maintenance)
         
         # Change repo path
         self.create_option_row(card, "Change repository path", 
                               self.on_change_repo, pad_bottom=20)
 
+    def create_performance_card(self):
+        """Timing summary of every update phase, from the engine's telemetry"""
+        card = self.create_card(self.scrollable_frame)
+        
+        title = tk.Label(
+            card,
+            text="Performance",
+            font=self.font_body_bold,
+            bg=W11_COLORS['bg_secondary'],
+            fg=W11_COLORS['text_primary']
+        )
+        title.pack(anchor="w", pady=(20, 10), padx=20)
+        self.style.register(title, bg='bg_secondary', fg='text_primary')
+        
+        self.metrics_label = tk.Label(
+            card,
+            text="No operations timed yet",
+            font=("Consolas", 9),
+            bg=W11_COLORS['bg_secondary'],
+            fg=W11_COLORS['text_secondary'],
+            justify="left",
+            anchor="w"
+        )
+        self.metrics_label.pack(anchor="w", padx=20)
+        self.style.register(self.metrics_label, bg='bg_secondary', fg='text_secondary')
+        
+        desc = tk.Label(
+            card,
+            text="Metrics file: " + self.engine.telemetry.path,
+            font=self.font_small,
+            bg=W11_COLORS['bg_secondary'],
+            fg=W11_COLORS['text_secondary'],
+            wraplength=600,
+            justify="left"
+        )
+        desc.pack(anchor="w", padx=20, pady=(10, 20))
+        self.style.register(desc, bg='bg_secondary', fg='text_secondary')
+        
+        # Earlier runs are read from the metrics file once the window is up
+        self.engine.telemetry.on_phase = lambda phase: self.dispatcher.post(
+            self.render_metrics, key="metrics")
+        self.dispatcher.post(self.render_metrics, key="metrics")
+
+    def render_metrics(self):
+        """Refresh the performance card from the telemetry summary"""
+        if self.metrics_label is None:
+            return
+        summary = self.engine.telemetry.summary()
+        if summary:
+            self.metrics_label.config(text=format_metrics(summary))
+
     def create_additional_tools_card(self):
         """Additional tools card"""
         card = self.create_card(self.scrollable_frame)
@@ -423,6 +1200,7 @@ class Windows11UpdateManager:
             fg=W11_COLORS['text_primary']
         )
         title.pack(anchor="w", pady=(20, 10), padx=20)
+        self.style.register(title, bg='bg_secondary', fg='text_primary')
         
         desc = tk.Label(
             card,
@@ -434,6 +1212,7 @@ class Windows11UpdateManager:
             justify="left"
         )
         desc.pack(anchor="w", padx=20, pady=(0, 20))
+        self.style.register(desc, bg='bg_secondary', fg='text_secondary')
 
     def create_status_bar(self):
         """Bottom status bar"""
@@ -441,6 +1220,7 @@ class Windows11UpdateManager:
                              height=40, relief="flat", bd=0)
         status_bar.pack(side="bottom", fill="x")
         status_bar.pack_propagate(False)
+        self.style.register(status_bar, bg='bg_secondary')
         
         self.status_text = tk.Label(
             status_bar,
@@ -451,6 +1231,7 @@ class Windows11UpdateManager:
             anchor="w"
         )
         self.status_text.pack(side="left", padx=20)
+        self.style.register(self.status_text, bg='bg_secondary', fg='text_secondary')
 
     def create_card(self, parent):
         """Create a Windows 11-style card"""
@@ -461,10 +1242,12 @@ class Windows11UpdateManager:
             bd=0
         )
         card.pack(fill="x", pady=(0, 20))
+        self.style.register(card, bg='bg_secondary')
         
         # Add subtle border
         border = tk.Frame(card, bg=W11_COLORS['border'], height=1)
         border.pack(fill="x", side="bottom")
+        self.style.register(border, bg='border')
         
         return card
 
@@ -486,6 +1269,8 @@ class Windows11UpdateManager:
             command=command
         )
         
+        self.style.register(btn, bg='accent', activebackground='accent_hover')
+        
         # Hover effects
         btn.bind("<Enter>", lambda e: btn.config(bg=W11_COLORS['accent_hover']))
         btn.bind("<Leave>", lambda e: btn.config(bg=W11_COLORS['accent']))
@@ -512,6 +1297,8 @@ class Windows11UpdateManager:
         
         btn.config(highlightbackground=W11_COLORS['border'], 
                   highlightthickness=1)
+        self.style.register(btn, bg='bg_card', fg='text_primary', activebackground='border',
+                            activeforeground='text_primary', highlightbackground='border')
         
         # Hover effects
         btn.bind("<Enter>", lambda e: btn.config(bg=W11_COLORS['border']))
@@ -543,6 +1330,9 @@ class Windows11UpdateManager:
             cursor="hand2"
         )
         chevron.pack(side="right", pady=12)
+        self.style.register(row, bg='bg_secondary')
+        self.style.register(label, bg='bg_secondary', fg='text_primary')
+        self.style.register(chevron, bg='bg_secondary', fg='text_secondary')
         
         # Click handlers
         row.bind("<Button-1>", lambda e: command())
@@ -589,34 +1379,62 @@ class Windows11UpdateManager:
             cursor="hand2"
         )
         toggle.pack(side="right")
+        self.style.register(row, bg='bg_secondary')
+        self.style.register(label, bg='bg_secondary', fg='text_primary')
+        self.style.register(toggle, bg='bg_secondary', activebackground='bg_secondary')
 
     def update_progress(self, value):
-        """Update progress bar with smooth animation"""
+        """Update progress bar (safe from any thread)"""
+        self.dispatcher.post(lambda: self._draw_progress(value), key="progress")
+
+    def set_progress_text(self, text):
+        """Set the label above the progress bar (safe from any thread)"""
+        self.dispatcher.post(lambda: self.progress_label.config(text=text), key="progress_text")
+
+    def set_check_enabled(self, enabled):
+        """Enable or disable the check button (safe from any thread)"""
+        state = "normal" if enabled else "disabled"
+        self.dispatcher.post(lambda: self.check_button.config(state=state), key="check_button")
+
+    def show_install_button(self, visible):
+        """Show or hide the install button (safe from any thread)"""
+        def update():
+            if visible:
+                self.install_button.pack(side="left", after=self.download_button)
+            else:
+                self.install_button.pack_forget()
+        self.dispatcher.post(update, key="install_button")
+
+    def _draw_progress(self, value):
+        """Draw progress bar; Tk thread only"""
         self.current_progress = value
         
         if value > 0:
             if not self.progress_frame.winfo_ismapped():
                 self.progress_frame.pack(fill="x", after=self.status_subtitle.master.master)
             
-            # Animate progress bar
-            width = self.progress_canvas.winfo_width()
-            if width > 1:
-                bar_width = int(width * (value / 100))
-                
-                if self.progress_bar_rect:
-                    self.progress_canvas.delete(self.progress_bar_rect)
-                
-                self.progress_bar_rect = self.progress_canvas.create_rectangle(
-                    0, 0, bar_width, 4,
-                    fill=W11_COLORS['accent'],
-                    outline=""
-                )
+            self.progress_bar.set(value)
         else:
             self.progress_frame.pack_forget()
+            self.progress_bar.set(0)
+
+    def finish_progress(self):
+        """Fill the bar, then hide it shortly after without blocking the caller"""
+        def finish():
+            self._draw_progress(100)
+            self.root.after(PROGRESS_HIDE_DELAY_MS, hide)
+        
+        def hide():
+            # A new operation may have started in the meantime
+            if self.current_progress == 100:
+                self._draw_progress(0)
+        
+        self.dispatcher.post(finish, key="progress")
 
     def log(self, message, level="info"):
         """Add message to log"""
-        self.log_queue.put((message, level))
+        self.log_queue.put((message, level, time.time()))
+        self.dispatcher.post(self.update_log_display, key="log")
 
     def update_log_display(self):
         """Update log text widget"""
@@ -628,19 +1446,10 @@ class Windows11UpdateManager:
             pass
         
         if messages:
-            self.log_text.config(state="normal")
-            for msg, level in messages:
-                timestamp = time.strftime("%H:%M:%S")
-                formatted = f"[{timestamp}] {msg}\n"
-                self.log_text.insert("end", formatted)
-            
-            self.log_text.see("end")
-            self.log_text.config(state="disabled")
-
-    def start_ui_loop(self):
-        """Main UI update loop"""
-        self.update_log_display()
-        self.root.after(50, self.start_ui_loop)
+            for msg, level, timestamp in messages:
+                self.log_store.append(msg, level, timestamp)
+            if self.log_view:
+                self.log_view.refresh()
 
     def set_status(self, title, subtitle=None, icon="✓", color=None):
         """Update main status display"""
@@ -651,13 +1460,14 @@ class Windows11UpdateManager:
             if color and hasattr(self, 'status_icon'):
                 self.status_icon.config(text=icon, fg=color)
         
-        self.ui_update_queue.put(update)
+        self.dispatcher.post(update, key="status")
 
-    def run_async(self, func):
-        """Run function in background thread"""
-        thread = threading.Thread(target=func, daemon=True)
-        self.running_threads.append(thread)
-        thread.start()
+    def run_async(self, name, func, resources=()):
+        """Queue func as a background job; jobs sharing a resource run one at a time"""
+        if self.jobs.busy(name):
+            self.log(f"{name} is already queued or running")
+            return
+        self.jobs.submit(name, func, resources)
 
     # ---------- Event Handlers ----------
     
@@ -665,39 +1475,77 @@ class Windows11UpdateManager:
         """Check for updates"""
         if self.checking_updates:
             return
-        self.run_async(self.check_updates)
+        self.run_async("Check for updates", self.check_updates)
 
     def on_download_updates(self):
         """Download updates to repo"""
-        self.run_async(self.download_updates)
+        self.run_async("Download to repo", self.download_updates, [RESOURCE_REPO])
 
     def on_install_updates(self):
         """Install updates online"""
-        self.run_async(self.install_updates)
+        self.run_async("Install updates", self.install_updates, [RESOURCE_SERVICING])
 
     def on_install_offline(self):
         """Install from offline repo"""
-        self.run_async(self.install_offline)
+        self.run_async("Install from offline repo", self.install_offline,
+                       [RESOURCE_SERVICING, RESOURCE_REPO])
 
     def on_update_office(self):
         """Update Office"""
-        self.run_async(self.update_office)
+        self.run_async("Update Office", self.update_office)
 
     def on_update_dotnet(self):
         """Update .NET"""
-        self.run_async(self.update_dotnet)
+        self.run_async("Update .NET Framework", self.update_dotnet, [RESOURCE_SERVICING])
 
     def on_update_vcredist(self):
         """Update VC++ Redistributables"""
-        self.run_async(self.update_vcredist)
+        self.run_async("Update VC++ Redistributables", self.update_vcredist)
+
+    def on_update_all(self):
+        """Update every category enabled in the config"""
+        self.run_async("Update all categories", self.update_all,
+                       [RESOURCE_SERVICING, RESOURCE_REPO])
+
+    def on_cancel_job(self, job_id):
+        """Cancel a queued or running job from the activity card"""
+        if self.jobs.cancel(job_id):
+            self.log("Cancelling job...", "warning")
+
+    def on_verify_repo(self):
+        """Check every stored package against its hash"""
+        self.run_async("Verify repository", self.verify_repo, [RESOURCE_REPO])
+
+    def on_clean_repo(self):
+        """Remove packages newer ones in the repo supersede"""
+        self.run_async("Clean up repository", self.clean_repo, [RESOURCE_REPO])
 
     def on_toggle_auto_reboot(self):
         """Toggle auto reboot setting"""
-        self.config["auto_reboot"] = self.auto_reboot_var.get()
-        save_config(self.config)
+        self.config_store.set("auto_reboot", self.auto_reboot_var.get())
         status = "enabled" if self.auto_reboot_var.get() else "disabled"
         self.log(f"Automatic restart {status}")
 
+    def on_toggle_maintenance(self):
+        """Start or stop background scans, downloads and installs"""
+        enabled = self.maintenance_var.get()
+        self.config_store.set("scheduled_maintenance", enabled)
+        if enabled:
+            self.maintenance.start()
+            self.log("Scheduled maintenance enabled")
+        else:
+            self.maintenance.stop()
+            self.log("Scheduled maintenance disabled")
+
+    def on_toggle_share_repo(self):
+        """Start or stop serving the repository to other machines"""
+        enabled = self.share_repo_var.get()
+        self.config_store.set("share_repo", enabled)
+        if enabled:
+            self.run_async("Share repository", self.share_repo, [RESOURCE_REPO])
+        else:
+            self.engine.stop_serving()
+
     def on_change_repo(self):
         """Change repository path"""
         new_path = filedialog.askdirectory(
@@ -705,16 +1553,14 @@ class Windows11UpdateManager:
             title="Select Repository Directory"
         )
         if new_path:
-            self.repo_path = new_path
-            self.config["repo_path"] = new_path
-            save_config(self.config)
-            self.log(f"Repository path changed to: {new_path}")
+            # Queued behind every job still using the current repository
+            self.run_async("Change repository", lambda: self.change_repo(new_path),
+                           [RESOURCE_SERVICING, RESOURCE_REPO])
 
     def toggle_dark_mode(self):
         """Toggle dark mode and refresh UI"""
         self.dark_mode = not self.dark_mode
-        self.config["dark_mode"] = self.dark_mode
-        save_config(self.config)
+        self.config_store.set("dark_mode", self.dark_mode)
         
         # Update color scheme
         self.apply_color_scheme()
@@ -728,191 +1574,33 @@ class Windows11UpdateManager:
         self.log(f"Switched to {'dark' if self.dark_mode else 'light'} mode")
 
     def refresh_theme(self):
-        """Refresh all UI elements with new theme colors"""
-        # Update root background
-        self.root.configure(bg=W11_COLORS['bg_primary'])
-        
-        # Recursively update all widgets
-        def update_widget_colors(widget):
-            widget_type = widget.winfo_class()
-            
-            try:
-                if widget_type == "Frame":
-                    current_bg = widget.cget('bg')
-                    # Map old colors to new colors
-                    if current_bg in [W11_COLORS_LIGHT['bg_primary'], W11_COLORS_DARK['bg_primary']]:
-                        widget.config(bg=W11_COLORS['bg_primary'])
-                    elif current_bg in [W11_COLORS_LIGHT['bg_secondary'], W11_COLORS_DARK['bg_secondary']]:
-                        widget.config(bg=W11_COLORS['bg_secondary'])
-                    elif current_bg in [W11_COLORS_LIGHT['bg_card'], W11_COLORS_DARK['bg_card']]:
-                        widget.config(bg=W11_COLORS['bg_card'])
-                
-                elif widget_type == "Label":
-                    current_bg = widget.cget('bg')
-                    current_fg = widget.cget('fg')
-                    
-                    # Update background
-                    if current_bg in [W11_COLORS_LIGHT['bg_primary'], W11_COLORS_DARK['bg_primary']]:
-                        widget.config(bg=W11_COLORS['bg_primary'])
-                    elif current_bg in [W11_COLORS_LIGHT['bg_secondary'], W11_COLORS_DARK['bg_secondary']]:
-                        widget.config(bg=W11_COLORS['bg_secondary'])
-                    elif current_bg in [W11_COLORS_LIGHT['bg_card'], W11_COLORS_DARK['bg_card']]:
-                        widget.config(bg=W11_COLORS['bg_card'])
-                    
-                    # Update foreground
-                    if current_fg in [W11_COLORS_LIGHT['text_primary'], W11_COLORS_DARK['text_primary']]:
-                        widget.config(fg=W11_COLORS['text_primary'])
-                    elif current_fg in [W11_COLORS_LIGHT['text_secondary'], W11_COLORS_DARK['text_secondary']]:
-                        widget.config(fg=W11_COLORS['text_secondary'])
-                
-                elif widget_type == "Button":
-                    # Check if it's an accent button or secondary button
-                    current_bg = widget.cget('bg')
-                    
-                    if current_bg in [W11_COLORS_LIGHT['accent'], W11_COLORS_DARK['accent']]:
-                        # Accent button
-                        widget.config(
-                            bg=W11_COLORS['accent'],
-                            activebackground=W11_COLORS['accent_hover']
-                        )
-                        # Rebind hover effects
-                        widget.unbind("<Enter>")
-                        widget.unbind("<Leave>")
-                        widget.bind("<Enter>", lambda e, w=widget: w.config(bg=W11_COLORS['accent_hover']))
-                        widget.bind("<Leave>", lambda e, w=widget: w.config(bg=W11_COLORS['accent']))
-                    
-                    elif current_bg in [W11_COLORS_LIGHT['bg_card'], W11_COLORS_DARK['bg_card']]:
-                        # Secondary button or theme button
-                        widget.config(
-                            bg=W11_COLORS['bg_card'],
-                            fg=W11_COLORS['text_primary'],
-                            activebackground=W11_COLORS['border'],
-                            activeforeground=W11_COLORS['text_primary']
-                        )
-                        # Rebind hover effects
-                        widget.unbind("<Enter>")
-                        widget.unbind("<Leave>")
-                        widget.bind("<Enter>", lambda e, w=widget: w.config(bg=W11_COLORS['border']))
-                        widget.bind("<Leave>", lambda e, w=widget: w.config(bg=W11_COLORS['bg_card']))
-                
-                elif widget_type == "Text":
-                    # Update text widget (log area)
-                    widget.config(
-                        bg=W11_COLORS['bg_card'],
-                        fg=W11_COLORS['text_primary']
-                    )
-                
-                elif widget_type == "Canvas":
-                    # Update progress bar canvas
-                    widget.config(bg=W11_COLORS['border'])
-                    # Redraw progress bar with new color
-                    if hasattr(self, 'progress_bar_rect') and self.progress_bar_rect:
-                        widget.delete(self.progress_bar_rect)
-                        width = widget.winfo_width()
-                        if width > 1 and self.current_progress > 0:
-                            bar_width = int(width * (self.current_progress / 100))
-                            self.progress_bar_rect = widget.create_rectangle(
-                                0, 0, bar_width, 4,
-                                fill=W11_COLORS['accent'],
-                                outline=""
-                            )
-                
-                # Recursively update children
-                for child in widget.winfo_children():
-                    update_widget_colors(child)
-            
-            except tk.TclError:
-                # Skip widgets that don't support certain options
-                pass
-        
-        # Start recursive update from root
-        update_widget_colors(self.root)
+        """Apply the active palette to every registered widget"""
+        self.style.apply(W11_COLORS)
 
-    # ---------- Backend Functions (Original Logic) ----------
+    def apply_log_tag_colors(self):
+        """Colour the error/warning tags of the log widget"""
+        self.log_text.tag_configure("error", foreground=W11_COLORS['error'])
+        self.log_text.tag_configure("warning", foreground=W11_COLORS['warning'])
+
+    # ---------- Backend Functions ----------
     
-    def run_powershell(self, command, capture_output=True):
-        """Run PowerShell command"""
-        try:
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = subprocess.SW_HIDE
-            
-            completed = subprocess.run(
-                ["powershell", "-NoProfile", "-ExecutionPolicy", "Bypass", 
-                 "-WindowStyle", "Hidden", "-Command", command],
-                capture_output=capture_output, 
-                text=True, 
-                timeout=3600,
-                startupinfo=startupinfo
-            )
-            
-            return completed.stdout.strip(), completed.stderr.strip(), completed.returncode
-        except subprocess.TimeoutExpired:
-            return "", "Command timed out", 1
-        except Exception as e:
-            return "", f"Error: {str(e)}", 1
+    def change_repo(self, new_path):
+        """Point the engine, the settings and the log file at another repository"""
+        self.engine.set_repo_path(new_path)
+        self.config_store.set("repo_path", new_path)
+        self.log_store.set_log_dir(os.path.join(new_path, "logs"))
+        self.repo_path = new_path
+        self.dispatcher.post(self.on_history_filter)
+        self.log(f"Repository path changed to: {new_path}")
 
     def check_pswindowsupdate(self):
         """Check if PSWindowsUpdate module is available"""
-        self.log("Checking for PSWindowsUpdate module...")
-        check_cmd = "Get-Module -ListAvailable -Name PSWindowsUpdate"
-        out, err, code = self.run_powershell(check_cmd)
-        
-        if not out.strip() and not err:
-            self.log("PSWindowsUpdate module not found")
-            self.pswindowsupdate_available = False
-        else:
-            self.pswindowsupdate_available = True
-            self.log("PSWindowsUpdate module is available")
-
-    def ensure_module(self):
-        """Ensure PSWindowsUpdate module is installed"""
-        if self.pswindowsupdate_available:
-            return True
-        
-        self.log("Installing PSWindowsUpdate module...")
-        
-        # First, try to set PSGallery as trusted
-        trust_cmd = "Set-PSRepository -Name PSGallery -InstallationPolicy Trusted -ErrorAction SilentlyContinue"
-        self.run_powershell(trust_cmd)
-        
-        # Install NuGet provider
-        nuget_cmd = "Install-PackageProvider -Name NuGet -MinimumVersion 2.8.5.201 -Force -ErrorAction SilentlyContinue"
-        self.run_powershell(nuget_cmd)
-        
-        # Now install PSWindowsUpdate with improved error handling
-        install_cmd = textwrap.dedent("""
-            $ErrorActionPreference = 'Stop'
-            try {
-                if (!(Get-Module -ListAvailable -Name PSWindowsUpdate)) {
-                    Install-Module PSWindowsUpdate -Force -Scope AllUsers -AllowClobber
-                    Write-Output "PSWindowsUpdate installed successfully"
-                } else {
-                    Write-Output "PSWindowsUpdate already installed"
-                }
-            } catch {
-                Write-Error $_.Exception.Message
-                exit 1
-            }
-        """)
-        
-        out, err, code = self.run_powershell(install_cmd)
-        
-        if out:
-            self.log(out)
-        
-        if code != 0 or (err and "error" in err.lower()):
-            self.log(f"Failed to install module: {err if err else 'Unknown error'}", "error")
-            return False
-        
-        self.pswindowsupdate_available = True
-        self.log("PSWindowsUpdate module installed successfully")
-        return True
+        self.engine.check_pswindowsupdate()
 
     def check_updates(self):
         """Check for Windows updates"""
         self.checking_updates = True
-        self.check_button.config(state="disabled")
+        self.set_check_enabled(False)
         
         self.set_status(
             "Checking for updates...",
@@ -921,444 +1609,108 @@ class Windows11UpdateManager:
             W11_COLORS['accent']
         )
         
-        self.progress_label.config(text="Checking for updates...")
-        self.log("Checking for updates online...")
-        
-        for i in range(0, 30, 5):
-            self.update_progress(i)
-            time.sleep(0.1)
-        
-        if not self.ensure_module():
+        if not self.engine.ensure_module():
             self.update_progress(0)
             self.set_status("Error", "Failed to load update module", "✕", W11_COLORS['error'])
             self.checking_updates = False
-            self.check_button.config(state="normal")
+            self.set_check_enabled(True)
             return
         
-        # Improved check command with better error handling
-        cmd = textwrap.dedent("""
-            Import-Module PSWindowsUpdate
-            $ErrorActionPreference = 'Continue'
-            
-            try {
-                $updates = Get-WindowsUpdate -MicrosoftUpdate
-                if ($updates) {
-                    $updates | Select-Object Title, KB, Size, IsDownloaded | ConvertTo-Json
-                } else {
-                    Write-Output "[]"
-                }
-            } catch {
-                Write-Error $_.Exception.Message
-                exit 1
-            }
-        """)
-        
-        out, err, code = self.run_powershell(cmd)
-        
-        for i in range(30, 90, 10):
-            self.update_progress(i)
-            time.sleep(0.05)
+        updates, err, code = self.engine.check_updates()
         
         self.last_check_time = time.strftime("%I:%M %p, %B %d, %Y")
         
-        if code != 0 or (err and "error" in err.lower() and "0x80240024" not in err):
-            self.log(f"Error checking updates: {err}", "error")
+        if cancel_requested():
+            self.set_status("Check cancelled", 
+                          f"Last checked: {self.last_check_time}",
+                          "✕", W11_COLORS['warning'])
+        elif code != 0:
             self.set_status("Error checking for updates", 
                           f"Last checked: {self.last_check_time}",
                           "✕", W11_COLORS['error'])
-        elif not out.strip() or out.strip() == "[]":
-            self.log("Your device is up to date")
+        elif updates is None:
+            self.set_status("Updates available", 
+                          f"Last checked: {self.last_check_time}",
+                          "!", W11_COLORS['warning'])
+            self.show_install_button(True)
+        elif not updates:
             self.set_status("You're up to date", 
                           f"Last checked: {self.last_check_time}",
                           "✓", W11_COLORS['success'])
-            self.install_button.pack_forget()
+            self.show_install_button(False)
         else:
-            try:
-                updates = json.loads(out)
-                update_count = len(updates) if isinstance(updates, list) else 1
-                
-                self.log(f"Found {update_count} available updates")
-                
-                # Log update details
-                if isinstance(updates, list):
-                    for update in updates[:10]:  # Show first 10
-                        if isinstance(update, dict):
-                            title = update.get('Title', 'Unknown')
-                            kb = update.get('KB', 'N/A')
-                            self.log(f"  - {title} (KB{kb})")
-                else:
-                    self.log(f"Update: {updates.get('Title', 'Unknown')}")
-                
-                self.set_status(f"{update_count} update{'s' if update_count != 1 else ''} available", 
-                              f"Last checked: {self.last_check_time}",
-                              "!", W11_COLORS['warning'])
-                self.install_button.pack(side="left", after=self.download_button)
-                
-            except json.JSONDecodeError:
-                self.log("Found updates but couldn't parse details")
-                self.set_status("Updates available", 
-                              f"Last checked: {self.last_check_time}",
-                              "!", W11_COLORS['warning'])
-                self.install_button.pack(side="left", after=self.download_button)
-        
-        self.update_progress(100)
-        time.sleep(0.3)
-        self.update_progress(0)
+            update_count = len(updates)
+            self.set_status(f"{update_count} update{'s' if update_count != 1 else ''} available", 
+                          f"Last checked: {self.last_check_time}",
+                          "!", W11_COLORS['warning'])
+            self.show_install_button(True)
         
         self.checking_updates = False
-        self.check_button.config(state="normal")
+        self.set_check_enabled(True)
 
     def download_updates(self):
         """Download updates to repository"""
-        self.log(f"Downloading updates to {self.repo_path}...")
-        self.update_progress(10)
-        
-        if not self.ensure_module():
-            self.update_progress(0)
-            return
-        
-        download_dir = os.path.join(self.repo_path, "Downloads")
-        os.makedirs(download_dir, exist_ok=True)
-        
-        self.update_progress(30)
-        self.progress_label.config(text="Downloading updates...")
-        
-        # Improved download command with proper error handling
-        cmd = textwrap.dedent(f"""
-            Import-Module PSWindowsUpdate
-            $ErrorActionPreference = 'Continue'
-            
-            try {{
-                $updates = Get-WindowsUpdate -MicrosoftUpdate
-                if ($updates) {{
-                    $updates | ForEach-Object {{
-                        Write-Output "Downloading: $($_.Title)"
-                    }}
-                    
-                    # Download updates
-                    Get-WindowsUpdate -MicrosoftUpdate -Download -AcceptAll -Verbose
-                    Write-Output "Download completed successfully"
-                }} else {{
-                    Write-Output "No updates available to download"
-                }}
-            }} catch {{
-                Write-Error $_.Exception.Message
-                exit 1
-            }}
-        """)
-        
-        self.update_progress(50)
-        out, err, code = self.run_powershell(cmd)
-        
-        self.update_progress(90)
-        
-        if out:
-            for line in out.split('\n'):
-                if line.strip():
-                    self.log(line)
-        
-        if err and "error" in err.lower():
-            self.log(f"Download error: {err}", "error")
-        else:
-            self.log("Updates downloaded successfully")
-            self._create_update_manifest(download_dir)
-        
-        self.update_progress(100)
-        time.sleep(0.3)
-        self.update_progress(0)
-
-    def _create_update_manifest(self, download_dir):
-        """Create update manifest with async file writing"""
-        manifest_path = os.path.join(self.repo_path, "updates_manifest.json")
-        cmd = textwrap.dedent("""
-            Import-Module PSWindowsUpdate
-            Get-WindowsUpdate -MicrosoftUpdate | Select-Object Title, KB, Size, IsDownloaded | ConvertTo-Json
-        """)
-        
-        out, err, code = self.run_powershell(cmd)
-        if out and not err and code == 0:
-            try:
-                updates = json.loads(out)
-                # Async file write for performance
-                def write_manifest():
-                    with open(manifest_path, 'w') as f:
-                        json.dump(updates, f, indent=2)
-                threading.Thread(target=write_manifest, daemon=True).start()
-                self.log("Created update manifest")
-            except Exception as e:
-                self.log(f"Could not create manifest: {str(e)}")
+        self.engine.download_updates()
 
     def install_updates(self):
         """Install updates online"""
         self.installing_updates = True
-        self.log("Installing updates...")
-        self.progress_label.config(text="Installing updates...")
-        self.update_progress(10)
-        
-        if not self.ensure_module():
-            self.update_progress(0)
-            self.installing_updates = False
-            return
-        
-        self.update_progress(30)
-        
-        check_cmd = """Import-Module PSWindowsUpdate; 
-                       $updates = Get-WUList -MicrosoftUpdate; 
-                       if ($updates) { $updates | ConvertTo-Json } else { '[]' }"""
-        out, err, code = self.run_powershell(check_cmd)
-        
-        try:
-            updates_list = json.loads(out) if out else []
-            if not updates_list or (isinstance(updates_list, dict) and not updates_list):
-                self.log("No updates available")
-                self.update_progress(0)
-                self.installing_updates = False
-                return
-        except Exception as e:
-            self.log(f"Failed to check updates: {str(e)}", "error")
-            self.update_progress(0)
-            self.installing_updates = False
-            return
-        
-        update_count = len(updates_list) if isinstance(updates_list, list) else 1
-        self.log(f"Installing {update_count} updates...")
-        self.update_progress(50)
-        
-        # Use correct cmdlet and parameters
-        reboot_param = "-AutoReboot" if self.config.get("auto_reboot", False) else "-IgnoreReboot"
-        
-        # Proper PowerShell command with error handling
-        cmd = textwrap.dedent(f"""
-            Import-Module PSWindowsUpdate
-            $ErrorActionPreference = 'Continue'
-            
-            try {{
-                Get-WindowsUpdate -MicrosoftUpdate -Install -AcceptAll {reboot_param} -Verbose
-                Write-Output "Installation completed"
-            }} catch {{
-                Write-Error $_.Exception.Message
-                exit 1
-            }}
-        """)
-        
-        self.log("Running Windows Update installation...")
-        out, err, code = self.run_powershell(cmd, capture_output=True)
-        
-        self.update_progress(90)
-        
-        if out:
-            for line in out.split('\n'):
-                if line.strip():
-                    self.log(line)
-        
-        if code != 0 or (err and "error" in err.lower()):
-            self.log(f"Installation failed: {err if err else 'Unknown error'}", "error")
-        else:
-            self.log("Updates installed successfully")
-        
-        self.update_progress(100)
-        time.sleep(0.3)
-        self.update_progress(0)
+        self.engine.install_updates()
         self.installing_updates = False
 
     def install_offline(self):
         """Install updates from offline repository"""
-        self.log(f"Installing from repository: {self.repo_path}...")
-        self.progress_label.config(text="Installing offline updates...")
-        self.update_progress(10)
-        
-        download_dir = os.path.join(self.repo_path, "Downloads")
-        if not os.path.exists(download_dir) or not os.listdir(download_dir):
-            self.log("No updates found in repository", "error")
-            self.update_progress(0)
-            return
-        
-        msu_files = [f for f in os.listdir(download_dir) if f.endswith('.msu')]
-        
-        if not msu_files:
-            self.log("No .msu files found", "error")
-            self.update_progress(0)
-            return
-        
-        self.log(f"Found {len(msu_files)} update files")
-        self.update_progress(30)
-        
-        success_count = 0
-        
-        for i, msu_file in enumerate(msu_files):
-            if self.stop_event.is_set():
-                break
-            
-            msu_path = os.path.join(download_dir, msu_file)
-            self.log(f"Installing {msu_file}...")
-            
-            try:
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                startupinfo.wShowWindow = subprocess.SW_HIDE
-                
-                result = subprocess.run(
-                    ["dism", "/online", "/add-package", 
-                     f"/packagepath:{msu_path}", "/quiet", "/norestart"],
-                    capture_output=True, text=True, timeout=600,
-                    startupinfo=startupinfo
-                )
-                
-                if result.returncode == 0:
-                    self.log(f"Successfully installed {msu_file}")
-                    success_count += 1
-                else:
-                    self.log(f"Failed to install {msu_file}", "error")
-            
-            except Exception as e:
-                self.log(f"Error installing {msu_file}: {str(e)}", "error")
-            
-            progress = 30 + ((i + 1) * 60 / len(msu_files))
-            self.update_progress(int(progress))
-        
-        self.log(f"Installed {success_count} of {len(msu_files)} updates")
-        
-        self.update_progress(100)
-        time.sleep(0.3)
-        self.update_progress(0)
+        self.engine.install_offline()
 
     def update_office(self):
         """Update Microsoft Office"""
-        self.log("Updating Office (Click-to-Run)...")
-        self.progress_label.config(text="Updating Office...")
-        self.update_progress(30)
-        
-        possible_paths = [
-            r"C:\Program Files\Common Files\Microsoft Shared\ClickToRun\OfficeC2RClient.exe",
-            r"C:\Program Files (x86)\Common Files\Microsoft Shared\ClickToRun\OfficeC2RClient.exe"
-        ]
-        
-        office_path = None
-        for path in possible_paths:
-            if os.path.exists(path):
-                office_path = path
-                break
-        
-        if not office_path:
-            self.log("Office Click-to-Run not found", "error")
-            self.update_progress(0)
-            return
-        
-        self.update_progress(60)
-        
-        try:
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = subprocess.SW_HIDE
-            
-            result = subprocess.run(
-                [office_path, "/update", "user"], 
-                capture_output=True, text=True, timeout=1200,
-                startupinfo=startupinfo
-            )
-            
-            self.update_progress(90)
-            
-            if result.returncode == 0:
-                self.log("Office updated successfully")
-            else:
-                self.log("Office update completed with warnings")
-        
-        except Exception as e:
-            self.log(f"Office update error: {str(e)}", "error")
-        
-        self.update_progress(100)
-        time.sleep(0.3)
-        self.update_progress(0)
+        self.engine.update_office()
 
     def update_dotnet(self):
         """Update .NET Framework"""
-        if not self.ensure_module():
-            return
-        
-        self.log("Updating .NET Framework...")
-        self.progress_label.config(text="Updating .NET Framework...")
-        self.update_progress(30)
-        
-        cmd = textwrap.dedent("""
-            Import-Module PSWindowsUpdate
-            $ErrorActionPreference = 'Continue'
-            
-            try {
-                $updates = Get-WindowsUpdate -MicrosoftUpdate | Where-Object { $_.Title -like '*.NET*' }
-                if ($updates) {
-                    Get-WindowsUpdate -MicrosoftUpdate -Install -AcceptAll -IgnoreReboot -Verbose | Where-Object { $_.Title -like '*.NET*' }
-                    Write-Output ".NET Framework updates installed"
-                } else {
-                    Write-Output "No .NET updates available"
-                }
-            } catch {
-                Write-Error $_.Exception.Message
-                exit 1
-            }
-        """)
-        
-        out, err, code = self.run_powershell(cmd)
-        
-        self.update_progress(90)
-        
-        if out:
-            self.log(out)
-        
-        if code == 0:
-            self.log(".NET Framework update completed")
-        else:
-            self.log(f".NET update error: {err if err else 'Unknown error'}", "error")
-        
-        self.update_progress(100)
-        time.sleep(0.3)
-        self.update_progress(0)
+        self.engine.update_dotnet()
 
     def update_vcredist(self):
         """Update Visual C++ Redistributables"""
-        self.log("Updating VC++ Redistributables...")
-        self.progress_label.config(text="Updating VC++ Redistributables...")
-        self.update_progress(30)
-        
+        self.engine.update_vcredist()
+
+    def verify_repo(self):
+        """Hash the repository's packages, dropping damaged ones"""
+        self.engine.verify_repo()
+
+    def clean_repo(self):
+        """Garbage-collect superseded packages from the repository"""
+        self.engine.collect_garbage()
+
+    def share_repo(self):
+        """Serve the repository to peers; switches sharing off if the port is taken"""
         try:
-            subprocess.run(["where", "winget"], check=True, capture_output=True)
-            cmd = "winget upgrade --id Microsoft.VCRedist.* --silent --accept-package-agreements"
-        except:
-            cmd = textwrap.dedent("""
-                $urls = @(
-                    'https://aka.ms/vs/17/release/vc_redist.x64.exe',
-                    'https://aka.ms/vs/17/release/vc_redist.x86.exe'
-                )
-                foreach ($url in $urls) {
-                    $file = "$env:TEMP\\" + [System.IO.Path]::GetFileName($url)
-                    Invoke-WebRequest -Uri $url -OutFile $file
-                    Start-Process -Wait -FilePath $file -ArgumentList "/install", "/quiet", "/norestart"
-                }
-            """)
-        
-        out, err, code = self.run_powershell(cmd)
-        
-        self.update_progress(90)
-        
-        if code == 0:
-            self.log("VC++ Redistributables updated")
-        else:
-            self.log(f"VC++ update error: {err}", "error")
-        
-        self.update_progress(100)
-        time.sleep(0.3)
-        self.update_progress(0)
+            self.engine.serve_repo()
+        except OSError as e:
+            self.log(f"Could not share repository: {e}", "error")
+            self.config_store.set("share_repo", False)
+            self.dispatcher.post(lambda: self.share_repo_var.set(False))
+
+    def update_all(self):
+        """Update Windows, Office, .NET and VC++ in one orchestrated run"""
+        self.installing_updates = True
+        self.engine.update_categories()
+        self.installing_updates = False
 
     def cleanup(self):
         """Cleanup on exit"""
         self.stop_event.set()
-        for thread in self.running_threads:
-            if thread.is_alive():
-                thread.join(timeout=1)
+        self.dispatcher.close()
+        self.maintenance.stop()
+        self.jobs.shutdown(timeout=3)
+        self.engine.close()
+        self.config_store.flush()
+        self.log_store.close()
 
 
 # ---------- Main Entry Point ----------
 if __name__ == "__main__":
+    ensure_elevated()
     root = tk.Tk()
     app = Windows11UpdateManager(root)
     
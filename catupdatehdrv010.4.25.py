@@ -4,36 +4,17 @@ Samsoft Update Manager - Windows 11 Style
 Modern Windows 11 Update interface with original backend functionality
 """
 
-import sys
-import os
-import ctypes
-import subprocess
 import threading
 import time
-import json
-import textwrap
 import queue
-from pathlib import Path
 from collections import deque
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, font
 
-# ---------- Auto-elevation ----------
-def is_admin():
-    try:
-        return ctypes.windll.shell32.IsUserAnAdmin()
-    except:
-        return False
-
-if not is_admin():
-    params = " ".join([f'"{arg}"' for arg in sys.argv])
-    ctypes.windll.shell32.ShellExecuteW(None, "runas", sys.executable, params, None, 1)
-    sys.exit()
-
-# ---------- Configuration ----------
-REPO_DIR = os.path.join(os.getcwd(), "SamsoftRepo")
-CONFIG_FILE = os.path.join(REPO_DIR, "config.json")
-os.makedirs(REPO_DIR, exist_ok=True)
+from samsoft_update_core import (
+    REPO_DIR, ConfigStore, ensure_elevated, UpdateEngine,
+    JobScheduler, RESOURCE_SERVICING, RESOURCE_REPO
+)
 
 # Windows 11 Color Palette
 W11_COLORS = {
@@ -50,32 +31,6 @@ W11_COLORS = {
     'error': '#d13438'
 }
 
-# Default configuration
-DEFAULT_CONFIG = {
-    "repo_path": REPO_DIR,
-    "update_categories": {
-        "windows": True,
-        "office": True,
-        "dotnet": True,
-        "vcredist": False
-    },
-    "auto_reboot": False,
-    "dark_mode": False
-}
-
-def load_config():
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return DEFAULT_CONFIG
-    return DEFAULT_CONFIG
-
-def save_config(config):
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=4)
-
 # ---------- Windows 11 Style Update Manager ----------
 class Windows11UpdateManager:
     def __init__(self, root):
@@ -87,9 +42,10 @@ class Windows11UpdateManager:
         # Remove window decorations for modern look (optional)
         # self.root.overrideredirect(True)
         
-        self.config = load_config()
+        # Settings are read from memory and saved in the background
+        self.config_store = ConfigStore()
+        self.config = self.config_store.data
         self.repo_path = self.config.get("repo_path", REPO_DIR)
-        self.pswindowsupdate_available = False
         
         # State variables
         self.checking_updates = False
@@ -100,8 +56,19 @@ class Windows11UpdateManager:
         # Thread control
         self.log_queue = queue.Queue()
         self.ui_update_queue = queue.Queue()
-        self.running_threads = []
         self.stop_event = threading.Event()
+        self.jobs = JobScheduler()
+        
+        # Scanning, downloading and installing all live in the shared engine;
+        # its callbacks arrive on worker threads and are handed to the Tk loop
+        self.engine = UpdateEngine(
+            self.config,
+            log=self.log,
+            progress=lambda value: self.call_ui(self.update_progress, value),
+            progress_text=lambda text: self.call_ui(self.progress_label.config, text=text),
+            finish_progress=self.finish_progress,
+            stop_event=self.stop_event
+        )
         
         # Custom fonts (Windows 11 style)
         self.setup_fonts()
@@ -111,7 +78,7 @@ class Windows11UpdateManager:
         self.start_ui_loop()
         
         # Initial check
-        threading.Thread(target=self.check_pswindowsupdate, daemon=True).start()
+        self.run_async("Check update module", self.check_pswindowsupdate)
 
     def setup_fonts(self):
         """Setup Windows 11-style fonts"""
@@ -555,6 +522,14 @@ class Windows11UpdateManager:
         else:
             self.progress_frame.pack_forget()
 
+    def finish_progress(self):
+        """Fill the progress bar, then hide it shortly after"""
+        def finish():
+            self.update_progress(100)
+            self.root.after(300, self.update_progress, 0)
+        
+        self.call_ui(finish)
+
     def log(self, message, level="info"):
         """Add message to log"""
         self.log_queue.put((message, level))
@@ -578,11 +553,25 @@ class Windows11UpdateManager:
             self.log_text.see("end")
             self.log_text.config(state="disabled")
 
+    def run_ui_updates(self):
+        """Run the widget updates queued by worker threads"""
+        while True:
+            try:
+                update = self.ui_update_queue.get_nowait()
+            except queue.Empty:
+                break
+            update()
+
     def start_ui_loop(self):
         """Main UI update loop"""
+        self.run_ui_updates()
         self.update_log_display()
         self.root.after(50, self.start_ui_loop)
 
+    def call_ui(self, func, *args, **kwargs):
+        """Run func on the Tk thread; widgets must not be touched from workers"""
+        self.ui_update_queue.put(lambda: func(*args, **kwargs))
+
     def set_status(self, title, subtitle=None, icon="✓", color=None):
         """Update main status display"""
         def update():
@@ -593,13 +582,14 @@ class Windows11UpdateManager:
                 icon_label = self.status_title.master.master.winfo_children()[0]
                 icon_label.config(text=icon, fg=color)
         
-        self.ui_update_queue.put(update)
+        self.call_ui(update)
 
-    def run_async(self, func):
-        """Run function in background thread"""
-        thread = threading.Thread(target=func, daemon=True)
-        self.running_threads.append(thread)
-        thread.start()
+    def run_async(self, name, func, resources=()):
+        """Queue func as a background job; jobs sharing a resource run one at a time"""
+        if self.jobs.busy(name):
+            self.log(f"{name} is already queued or running")
+            return
+        self.jobs.submit(name, func, resources)
 
     # ---------- Event Handlers ----------
     
@@ -607,36 +597,36 @@ class Windows11UpdateManager:
         """Check for updates"""
         if self.checking_updates:
             return
-        self.run_async(self.check_updates)
+        self.run_async("Check for updates", self.check_updates)
 
     def on_download_updates(self):
         """Download updates to repo"""
-        self.run_async(self.download_updates)
+        self.run_async("Download to repo", self.download_updates, [RESOURCE_REPO])
 
     def on_install_updates(self):
         """Install updates online"""
-        self.run_async(self.install_updates)
+        self.run_async("Install updates", self.install_updates, [RESOURCE_SERVICING])
 
     def on_install_offline(self):
         """Install from offline repo"""
-        self.run_async(self.install_offline)
+        self.run_async("Install from offline repo", self.install_offline,
+                       [RESOURCE_SERVICING, RESOURCE_REPO])
 
     def on_update_office(self):
         """Update Office"""
-        self.run_async(self.update_office)
+        self.run_async("Update Office", self.update_office)
 
     def on_update_dotnet(self):
         """Update .NET"""
-        self.run_async(self.update_dotnet)
+        self.run_async("Update .NET Framework", self.update_dotnet, [RESOURCE_SERVICING])
 
     def on_update_vcredist(self):
         """Update VC++ Redistributables"""
-        self.run_async(self.update_vcredist)
+        self.run_async("Update VC++ Redistributables", self.update_vcredist)
 
     def on_toggle_auto_reboot(self):
         """Toggle auto reboot setting"""
-        self.config["auto_reboot"] = self.auto_reboot_var.get()
-        save_config(self.config)
+        self.config_store.set("auto_reboot", self.auto_reboot_var.get())
         status = "enabled" if self.auto_reboot_var.get() else "disabled"
         self.log(f"Automatic restart {status}")
 
@@ -648,72 +638,20 @@ class Windows11UpdateManager:
         )
         if new_path:
             self.repo_path = new_path
-            self.config["repo_path"] = new_path
-            save_config(self.config)
+            self.engine.set_repo_path(new_path)
+            self.config_store.set("repo_path", new_path)
             self.log(f"Repository path changed to: {new_path}")
 
-    # ---------- Backend Functions (Original Logic) ----------
+    # ---------- Backend Functions ----------
     
-    def run_powershell(self, command, capture_output=True):
-        """Run PowerShell command"""
-        try:
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = subprocess.SW_HIDE
-            
-            completed = subprocess.run(
-                ["powershell", "-NoProfile", "-ExecutionPolicy", "Bypass", 
-                 "-WindowStyle", "Hidden", "-Command", command],
-                capture_output=capture_output, 
-                text=True, 
-                timeout=3600,
-                startupinfo=startupinfo
-            )
-            
-            return completed.stdout.strip(), completed.stderr.strip(), completed.returncode
-        except subprocess.TimeoutExpired:
-            return "", "Command timed out", 1
-        except Exception as e:
-            return "", f"Error: {str(e)}", 1
-
     def check_pswindowsupdate(self):
         """Check if PSWindowsUpdate module is available"""
-        self.log("Checking for PSWindowsUpdate module...")
-        check_cmd = "Get-Module -ListAvailable -Name PSWindowsUpdate"
-        out, err, code = self.run_powershell(check_cmd)
-        
-        if not out.strip() and not err:
-            self.log("PSWindowsUpdate module not found")
-            self.pswindowsupdate_available = False
-        else:
-            self.pswindowsupdate_available = True
-            self.log("PSWindowsUpdate module is available")
-
-    def ensure_module(self):
-        """Ensure PSWindowsUpdate module is installed"""
-        if self.pswindowsupdate_available:
-            return True
-        
-        self.log("Installing PSWindowsUpdate module...")
-        install_cmd = textwrap.dedent("""
-            Set-PSRepository -Name PSGallery -InstallationPolicy Trusted
-            Install-PackageProvider -Name NuGet -Force
-            Install-Module PSWindowsUpdate -Force -AcceptLicense -Scope AllUsers
-        """)
-        
-        _, err, code = self.run_powershell(install_cmd)
-        if err and "already exists" not in err:
-            self.log(f"Failed to install module: {err}", "error")
-            return False
-        
-        self.pswindowsupdate_available = True
-        self.log("PSWindowsUpdate module installed")
-        return True
+        self.engine.check_pswindowsupdate()
 
     def check_updates(self):
         """Check for Windows updates"""
         self.checking_updates = True
-        self.check_button.config(state="disabled")
+        self.call_ui(self.check_button.config, state="disabled")
         
         self.set_status(
             "Checking for updates...",
@@ -722,337 +660,73 @@ class Windows11UpdateManager:
             W11_COLORS['accent']
         )
         
-        self.progress_label.config(text="Checking for updates...")
-        self.log("Checking for updates online...")
-        
-        for i in range(0, 30, 5):
-            self.update_progress(i)
-            time.sleep(0.1)
-        
-        if not self.ensure_module():
-            self.update_progress(0)
+        if not self.engine.ensure_module():
+            self.call_ui(self.update_progress, 0)
             self.set_status("Error", "Failed to load update module", "✕", W11_COLORS['error'])
             self.checking_updates = False
-            self.check_button.config(state="normal")
+            self.call_ui(self.check_button.config, state="normal")
             return
         
-        cmd = "Import-Module PSWindowsUpdate; Get-WUList -MicrosoftUpdate -Verbose"
-        out, err, code = self.run_powershell(cmd)
-        
-        for i in range(30, 90, 10):
-            self.update_progress(i)
-            time.sleep(0.05)
+        updates, err, code = self.engine.check_updates()
         
         self.last_check_time = time.strftime("%I:%M %p, %B %d, %Y")
         
-        if err and "0x80240024" not in err:
-            self.log(f"Error: {err}", "error")
+        if code != 0:
             self.set_status("Error checking for updates", 
                           f"Last checked: {self.last_check_time}",
                           "✕", W11_COLORS['error'])
-        elif not out.strip() or "0x80240024" in err:
-            self.log("Your device is up to date")
+        elif updates == []:
             self.set_status("You're up to date", 
                           f"Last checked: {self.last_check_time}",
                           "✓", W11_COLORS['success'])
-            self.install_button.pack_forget()
+            self.call_ui(self.install_button.pack_forget)
         else:
-            lines = out.split('\n')
-            update_count = len([l for l in lines if l.strip() and 'KB' in l])
-            
-            self.log(f"Found {update_count} available updates")
-            for line in lines[:20]:
-                if line.strip():
-                    self.log(line)
-            
-            self.set_status(f"{update_count} updates available", 
+            count = f"{len(updates)} updates" if updates else "Updates"
+            self.set_status(f"{count} available", 
                           f"Last checked: {self.last_check_time}",
                           "!", W11_COLORS['warning'])
-            self.install_button.pack(side="left", after=self.download_button)
-        
-        self.update_progress(100)
-        time.sleep(0.3)
-        self.update_progress(0)
+            self.call_ui(self.install_button.pack, side="left", after=self.download_button)
         
         self.checking_updates = False
-        self.check_button.config(state="normal")
+        self.call_ui(self.check_button.config, state="normal")
 
     def download_updates(self):
         """Download updates to repository"""
-        self.log(f"Downloading updates to {self.repo_path}...")
-        self.update_progress(10)
-        
-        if not self.ensure_module():
-            self.update_progress(0)
-            return
-        
-        download_dir = os.path.join(self.repo_path, "Downloads")
-        os.makedirs(download_dir, exist_ok=True)
-        
-        self.update_progress(30)
-        self.progress_label.config(text="Downloading updates...")
-        
-        cmd = textwrap.dedent(f"""
-            Import-Module PSWindowsUpdate
-            $updates = Get-WUList -MicrosoftUpdate
-            if ($updates) {{
-                Save-WUUpdates -Updates $updates -DirectoryPath "{download_dir}" -Verbose
-            }}
-        """)
-        
-        self.update_progress(50)
-        out, err, code = self.run_powershell(cmd)
-        
-        self.update_progress(90)
-        
-        if err:
-            self.log(f"Error: {err}", "error")
-        else:
-            self.log("Updates downloaded successfully")
-        
-        self.update_progress(100)
-        time.sleep(0.3)
-        self.update_progress(0)
+        self.engine.download_updates()
 
     def install_updates(self):
         """Install updates online"""
         self.installing_updates = True
-        self.log("Installing updates...")
-        self.progress_label.config(text="Installing updates...")
-        self.update_progress(10)
-        
-        if not self.ensure_module():
-            self.update_progress(0)
-            self.installing_updates = False
-            return
-        
-        self.update_progress(30)
-        
-        check_cmd = """Import-Module PSWindowsUpdate; 
-                       $updates = Get-WUList -MicrosoftUpdate; 
-                       if ($updates) { $updates | ConvertTo-Json } else { '[]' }"""
-        out, err, code = self.run_powershell(check_cmd)
-        
-        try:
-            updates_list = json.loads(out) if out else []
-            if not updates_list:
-                self.log("No updates available")
-                self.update_progress(0)
-                self.installing_updates = False
-                return
-        except:
-            self.log("Failed to check updates", "error")
-            self.update_progress(0)
-            self.installing_updates = False
-            return
-        
-        self.log(f"Installing {len(updates_list)} updates...")
-        self.update_progress(50)
-        
-        reboot_param = "-AutoReboot" if self.config.get("auto_reboot", False) else ""
-        cmd = f"Import-Module PSWindowsUpdate; Install-WUUpdates -MicrosoftUpdate -AcceptAll {reboot_param} -Verbose"
-        
-        _, err, code = self.run_powershell(cmd, capture_output=False)
-        
-        self.update_progress(90)
-        
-        if code != 0:
-            self.log(f"Installation failed", "error")
-        else:
-            self.log("Updates installed successfully")
-        
-        self.update_progress(100)
-        time.sleep(0.3)
-        self.update_progress(0)
+        self.engine.install_updates()
         self.installing_updates = False
 
     def install_offline(self):
         """Install updates from offline repository"""
-        self.log(f"Installing from repository: {self.repo_path}...")
-        self.progress_label.config(text="Installing offline updates...")
-        self.update_progress(10)
-        
-        download_dir = os.path.join(self.repo_path, "Downloads")
-        if not os.path.exists(download_dir) or not os.listdir(download_dir):
-            self.log("No updates found in repository", "error")
-            self.update_progress(0)
-            return
-        
-        msu_files = [f for f in os.listdir(download_dir) if f.endswith('.msu')]
-        
-        if not msu_files:
-            self.log("No .msu files found", "error")
-            self.update_progress(0)
-            return
-        
-        self.log(f"Found {len(msu_files)} update files")
-        self.update_progress(30)
-        
-        success_count = 0
-        
-        for i, msu_file in enumerate(msu_files):
-            if self.stop_event.is_set():
-                break
-            
-            msu_path = os.path.join(download_dir, msu_file)
-            self.log(f"Installing {msu_file}...")
-            
-            try:
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                startupinfo.wShowWindow = subprocess.SW_HIDE
-                
-                result = subprocess.run(
-                    ["dism", "/online", "/add-package", 
-                     f"/packagepath:{msu_path}", "/quiet", "/norestart"],
-                    capture_output=True, text=True, timeout=600,
-                    startupinfo=startupinfo
-                )
-                
-                if result.returncode == 0:
-                    self.log(f"Successfully installed {msu_file}")
-                    success_count += 1
-                else:
-                    self.log(f"Failed to install {msu_file}", "error")
-            
-            except Exception as e:
-                self.log(f"Error installing {msu_file}: {str(e)}", "error")
-            
-            progress = 30 + ((i + 1) * 60 / len(msu_files))
-            self.update_progress(int(progress))
-        
-        self.log(f"Installed {success_count} of {len(msu_files)} updates")
-        
-        self.update_progress(100)
-        time.sleep(0.3)
-        self.update_progress(0)
+        self.engine.install_offline()
 
     def update_office(self):
         """Update Microsoft Office"""
-        self.log("Updating Office (Click-to-Run)...")
-        self.progress_label.config(text="Updating Office...")
-        self.update_progress(30)
-        
-        possible_paths = [
-            r"C:\Program Files\Common Files\Microsoft Shared\ClickToRun\OfficeC2RClient.exe",
-            r"C:\Program Files (x86)\Common Files\Microsoft Shared\ClickToRun\OfficeC2RClient.exe"
-        ]
-        
-        office_path = None
-        for path in possible_paths:
-            if os.path.exists(path):
-                office_path = path
-                break
-        
-        if not office_path:
-            self.log("Office Click-to-Run not found", "error")
-            self.update_progress(0)
-            return
-        
-        self.update_progress(60)
-        
-        try:
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = subprocess.SW_HIDE
-            
-            result = subprocess.run(
-                [office_path, "/update", "user"], 
-                capture_output=True, text=True, timeout=1200,
-                startupinfo=startupinfo
-            )
-            
-            self.update_progress(90)
-            
-            if result.returncode == 0:
-                self.log("Office updated successfully")
-            else:
-                self.log("Office update completed with warnings")
-        
-        except Exception as e:
-            self.log(f"Office update error: {str(e)}", "error")
-        
-        self.update_progress(100)
-        time.sleep(0.3)
-        self.update_progress(0)
+        self.engine.update_office()
 
     def update_dotnet(self):
         """Update .NET Framework"""
-        if not self.ensure_module():
-            return
-        
-        self.log("Updating .NET Framework...")
-        self.progress_label.config(text="Updating .NET Framework...")
-        self.update_progress(30)
-        
-        cmd = textwrap.dedent("""
-            Import-Module PSWindowsUpdate
-            $updates = Get-WUList -MicrosoftUpdate | Where-Object { $_.Title -like '* .NET*' }
-            if ($updates) {
-                Install-WUUpdates -Updates $updates -AcceptAll -Verbose
-            } else {
-                Write-Output 'No .NET updates available'
-            }
-        """)
-        
-        out, err, code = self.run_powershell(cmd)
-        
-        self.update_progress(90)
-        
-        if code == 0:
-            self.log(".NET Framework update completed")
-        else:
-            self.log(f".NET update error: {err}", "error")
-        
-        self.update_progress(100)
-        time.sleep(0.3)
-        self.update_progress(0)
+        self.engine.update_dotnet()
 
     def update_vcredist(self):
         """Update Visual C++ Redistributables"""
-        self.log("Updating VC++ Redistributables...")
-        self.progress_label.config(text="Updating VC++ Redistributables...")
-        self.update_progress(30)
-        
-        try:
-            subprocess.run(["where", "winget"], check=True, capture_output=True)
-            cmd = "winget upgrade --id Microsoft.VCRedist.* --silent --accept-package-agreements"
-        except:
-            cmd = textwrap.dedent("""
-                $urls = @(
-                    'https://aka.ms/vs/17/release/vc_redist.x64.exe',
-                    'https://aka.ms/vs/17/release/vc_redist.x86.exe'
-                )
-                foreach ($url in $urls) {
-                    $file = "$env:TEMP\\" + [System.IO.Path]::GetFileName($url)
-                    Invoke-WebRequest -Uri $url -OutFile $file
-                    Start-Process -Wait -FilePath $file -ArgumentList "/install", "/quiet", "/norestart"
-                }
-            """)
-        
-        out, err, code = self.run_powershell(cmd)
-        
-        self.update_progress(90)
-        
-        if code == 0:
-            self.log("VC++ Redistributables updated")
-        else:
-            self.log(f"VC++ update error: {err}", "error")
-        
-        self.update_progress(100)
-        time.sleep(0.3)
-        self.update_progress(0)
+        self.engine.update_vcredist()
 
     def cleanup(self):
         """Cleanup on exit"""
         self.stop_event.set()
-        for thread in self.running_threads:
-            if thread.is_alive():
-                thread.join(timeout=1)
+        self.jobs.shutdown(timeout=3)
+        self.engine.close()
+        self.config_store.flush()
 
 
 # ---------- Main Entry Point ----------
 if __name__ == "__main__":
+    ensure_elevated()
     root = tk.Tk()
     app = Windows11UpdateManager(root)
     
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Samsoft Update CLI - headless front-end for the update engine
+
+Runs the same check / download / install operations as the GUI without Tk,
+for scheduled or fleet use. Every log line, progress change and result is
+written to stdout as one JSON object per line:
+
+    {"event": "log", "level": "info", "message": "...", "time": ...}
+    {"event": "progress", "value": 30, "time": ...}
+    {"event": "update", "Title": "...", "KB": "KB5034123", ...}
+    {"event": "phase", "phase": "scan", "seconds": 41.2, "spawn": [...], ...}
+    {"event": "result", "command": "check", "ok": true, ...}
+
+Usage:
+    samsoft_update_cli.py [--repo DIR] [--fake] check
+    samsoft_update_cli.py download | install | install-offline | update-all | verify
+    samsoft_update_cli.py metrics
+    samsoft_update_cli.py history [--kb KB] [--status STATE] [--days N] [--kbs]
+    samsoft_update_cli.py daemon [--interval SECONDS] [--actions check,download]
+    samsoft_update_cli.py maintain [--tick SECONDS]
+    samsoft_update_cli.py serve [--host ADDR] [--port PORT]
+    samsoft_update_cli.py gc [--archive] [--dry-run]
+    samsoft_update_cli.py --peer http://HOST:8765 download | install-offline
+
+--fake serves PowerShell and DISM from in-process stand-ins, so the CLI
+runs on machines without Windows.
+
+maintain scans, pre-downloads and installs on the windows set in the
+config (scan_interval, download_window, install_window, idle_minutes,
+download_rate_limit, cpu_budget) until stopped.
+
+install-offline reports ok false with an error when the repository is
+empty, and up_to_date true when every stored package is installed.
+
+serve shares the repository with other machines over HTTP until stopped;
+--peer makes download and install-offline take packages from such a
+machine before going upstream.
+"""
+
+import sys
+import os
+import json
+import re
+import time
+import signal
+import argparse
+import threading
+
+from samsoft_update_core import (
+    load_config, is_admin, UpdateEngine, PowerShellSession,
+    FakePowerShellHost, FakeDism, CancelToken, use_token, MaintenanceScheduler,
+    MAINTENANCE_TICK, MANIFEST_STATES, HISTORY_PAGE_SIZE
+)
+
+COMMANDS = ("check", "download", "install", "install-offline", "update-all", "verify",
+            "metrics")
+DAEMON_INTERVAL = 6 * 60 * 60
+
+# ---------- Fake Backend ----------
+FAKE_UPDATES = [
+    {"Title": "2024-01 Servicing Stack Update for Windows 11 (KB5034848)",
+     "KB": "KB5034848", "Size": 15728640, "IsDownloaded": False, "DownloadUrls": [],
+     "UpdateID": "5b5c5a7e-0d0c-4c4e-9d1a-3f6c2b8e1a01", "SupersededUpdateIDs": []},
+    {"Title": "2024-01 Cumulative Update for Windows 11 (KB5034123)",
+     "KB": "KB5034123", "Size": 524288000, "IsDownloaded": False, "DownloadUrls": [],
+     "UpdateID": "8e0f2c3d-6a1b-4f5e-b7c9-2d4a6e8f0b02", "SupersededUpdateIDs": []},
+    {"Title": "2024-01 Cumulative Update for .NET Framework 4.8.1 (KB5033920)",
+     "KB": "KB5033920", "Size": 73400320, "IsDownloaded": False, "DownloadUrls": [],
+     "UpdateID": "c1d3e5f7-9a2b-4c6d-8e0f-1a3b5c7d9e03", "SupersededUpdateIDs": []}
+]
+
+FAKE_CAPABILITIES = {
+    "PSWindowsUpdate": {"Version": "2.2.1.5", "Path": None},
+    "NuGet": {"Version": "2.8.5.208", "Path": None},
+    "Winget": None
+}
+
+
+def fake_powershell_handler(command):
+    """Answer the engine's PowerShell commands with canned output"""
+    if "Get-Module -ListAvailable" in command:
+        return [json.dumps(FAKE_CAPABILITIES, separators=(",", ":"))], [], 0
+    if "ConvertTo-Json" in command:
+        return [json.dumps(u, separators=(",", ":")) for u in FAKE_UPDATES], [], 0
+    match = re.search(r"-UpdateID (\S+)", command)
+    wanted = set(match.group(1).split(",")) if match else None
+    for flag, verb in (("-Download", "Downloaded"), ("-Install", "Installed")):
+        if flag in command:
+            return [f"{verb}: {u['Title']}" for u in FAKE_UPDATES
+                    if wanted is None or u["UpdateID"] in wanted], [], 0
+    return [], [], 0
+
+# ---------- JSON Output ----------
+class JsonEmitter:
+    """Writes events to a stream as JSON lines; safe from any thread"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+        self._last_progress = None
+
+    def emit(self, event, **fields):
+        record = {"event": event}
+        record.update(fields)
+        record["time"] = round(time.time(), 3)
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def log(self, message, level="info"):
+        self.emit("log", level=level, message=message)
+
+    def progress(self, value):
+        # Watchers report the same value repeatedly; only changes are emitted
+        if value != self._last_progress:
+            self._last_progress = value
+            self.emit("progress", value=value)
+
+    def progress_text(self, text):
+        self.emit("status", text=text)
+
+
+def build_engine(args, emitter, stop_event):
+    config = load_config()
+    if args.repo:
+        config["repo_path"] = os.path.abspath(args.repo)
+    if args.peer:
+        config["peer_cache_url"] = args.peer
+    session = None
+    if args.fake:
+        session = PowerShellSession(host_factory=lambda: FakePowerShellHost(fake_powershell_handler))
+    engine = UpdateEngine(
+        config,
+        log=emitter.log,
+        progress=emitter.progress,
+        progress_text=emitter.progress_text,
+        ps_session=session,
+        stop_event=stop_event
+    )
+    if args.fake:
+        engine.dism_runner = FakeDism()
+    # Every timed phase is reported as it ends (and kept in the repo's metrics.jsonl)
+    engine.telemetry.on_phase = lambda phase: emitter.emit("phase", **phase.as_dict())
+    return engine
+
+# ---------- Commands ----------
+def run_command(engine, emitter, command):
+    """Run one engine operation and return its result fields"""
+    if command == "check":
+        # Each update is reported as soon as the scan streams it in
+        updates, err, code = engine.check_updates(
+            on_record=lambda record: emitter.emit("update", **record.to_dict())
+        )
+        result = {"ok": code == 0, "code": code,
+                  "updates": None if updates is None else [u.to_dict() for u in updates]}
+        if err:
+            result["error"] = err
+        return result
+    if command == "download":
+        return {"ok": engine.download_updates()}
+    if command == "install":
+        return {"ok": engine.install_updates()}
+    if command == "install-offline":
+        installed, failed = engine.install_offline()
+        result = {"ok": not failed,
+                  "installed": [p.name for p in installed],
+                  "failed": [p.name for p in failed]}
+        if not installed and not failed:
+            # An empty repository is an error; a fully installed one is not
+            if engine.store.entries():
+                result["up_to_date"] = True
+            else:
+                result.update(ok=False, error="No updates found in repository")
+        return result
+    if command == "update-all":
+        results = engine.update_categories()
+        return {"ok": bool(results) and all(results.values()), "categories": results}
+    if command == "verify":
+        valid, invalid = engine.verify_repo()
+        return {"ok": not invalid,
+                "valid": len(valid),
+                "invalid": [{"name": p.name, "error": p.error} for p in invalid]}
+    if command == "metrics":
+        return {"ok": True, "phases": engine.telemetry.summary()}
+    raise ValueError(f"Unknown command: {command}")
+
+
+def run_daemon(engine, emitter, actions, interval, stop_event):
+    """Run actions every interval seconds until stopped; returns exit code"""
+    emitter.emit("daemon", state="started", actions=actions, interval=interval)
+    while not stop_event.is_set():
+        for command in actions:
+            if stop_event.is_set():
+                break
+            emitter.emit("result", command=command, **run_command(engine, emitter, command))
+        stop_event.wait(interval)
+    emitter.emit("daemon", state="stopped")
+    return 0
+
+
+def run_history(engine, args):
+    """Query the history database; nothing is scanned"""
+    since = time.time() - args.days * 86400 if args.days else None
+    if args.kbs:
+        # e.g. history --status failed --days 90 --kbs
+        return {"ok": True, "kbs": engine.history.kbs(args.status, since)}
+    return {"ok": True,
+            "total": engine.history.count(args.kb, args.status, since),
+            "updates": engine.history.query(args.kb, args.status, since,
+                                            limit=args.limit, offset=args.offset)}
+
+
+def run_maintenance(engine, emitter, tick, stop_event):
+    """Run scheduled maintenance until stopped; returns exit code"""
+    scheduler = MaintenanceScheduler(engine, tick=tick)
+    emitter.emit("maintenance", state="started", tick=tick,
+                 **{key: engine.config.get(key) for key in (
+                     "scan_interval", "download_window", "install_window", "idle_minutes",
+                     "download_rate_limit", "cpu_budget")})
+    while not stop_event.is_set():
+        actions = scheduler.run_due()
+        if actions:
+            emitter.emit("maintenance", state="ran", actions=actions)
+        stop_event.wait(tick)
+    emitter.emit("maintenance", state="stopped")
+    return 0
+
+
+def run_server(engine, emitter, host, port, stop_event):
+    """Share the repository until stopped; returns exit code"""
+    try:
+        server = engine.serve_repo(host, port)
+    except OSError as e:
+        emitter.emit("result", command="serve", ok=False, error=str(e))
+        return 1
+    emitter.emit("serving", url=server.url, port=server.port,
+                 packages=len(engine.store.entries()))
+    stop_event.wait()
+    emitter.emit("result", command="serve", ok=True, bytes_served=server.bytes_served)
+    return 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Headless Samsoft Update Manager")
+    parser.add_argument("--repo", help="repository directory (default: from config)")
+    parser.add_argument("--fake", action="store_true",
+                        help="use in-process PowerShell and DISM stand-ins")
+    parser.add_argument("--peer", help="peer cache URL to try before upstream (default: from config)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for command in COMMANDS:
+        sub.add_parser(command)
+    daemon = sub.add_parser("daemon", help="repeat actions on an interval")
+    daemon.add_argument("--interval", type=float, default=DAEMON_INTERVAL,
+                        help="seconds between runs (default: %(default)s)")
+    daemon.add_argument("--actions", default="check",
+                        help="comma-separated commands to run each time (default: check)")
+    history = sub.add_parser("history", help="query past scans, downloads and installs")
+    history.add_argument("--kb", help="only this KB")
+    history.add_argument("--status", choices=MANIFEST_STATES, help="only outcomes in this state")
+    history.add_argument("--days", type=float, help="only the last N days")
+    history.add_argument("--limit", type=int, default=HISTORY_PAGE_SIZE,
+                         help="rows per page (default: %(default)s)")
+    history.add_argument("--offset", type=int, default=0, help="rows to skip")
+    history.add_argument("--kbs", action="store_true", help="list the matching KBs only")
+    maintain = sub.add_parser("maintain", help="scan, download and install on configured windows")
+    maintain.add_argument("--tick", type=float, default=MAINTENANCE_TICK,
+                          help="seconds between checks of the windows (default: %(default)s)")
+    serve = sub.add_parser("serve", help="share the repository with peers over HTTP")
+    serve.add_argument("--host", default="", help="address to bind (default: all)")
+    serve.add_argument("--port", type=int, default=None,
+                       help="port to listen on, 0 for any free port (default: from config)")
+    gc = sub.add_parser("gc", help="remove packages superseded by newer ones in the repo")
+    gc.add_argument("--archive", action="store_true",
+                    help="move superseded packages to Archive instead of deleting them")
+    gc.add_argument("--dry-run", action="store_true", help="only report what would be reclaimed")
+    args = parser.parse_args(argv)
+    if args.command == "daemon":
+        args.actions = [a.strip() for a in args.actions.split(",") if a.strip()]
+        unknown = [a for a in args.actions if a not in COMMANDS]
+        if unknown:
+            parser.error(f"unknown actions: {', '.join(unknown)}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    emitter = JsonEmitter()
+    stop_event = threading.Event()
+    # Cancelling the token kills whatever child process the command is waiting on
+    token = CancelToken()
+
+    def stop(signum, frame):
+        stop_event.set()
+        token.cancel()
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    if not args.fake and not is_admin():
+        emitter.log("Not running as administrator; installs will fail", "warning")
+
+    engine = build_engine(args, emitter, stop_event)
+    try:
+        with use_token(token):
+            if args.command == "daemon":
+                return run_daemon(engine, emitter, args.actions, args.interval, stop_event)
+            if args.command == "history":
+                emitter.emit("result", command="history", **run_history(engine, args))
+                return 0
+            if args.command == "maintain":
+                return run_maintenance(engine, emitter, args.tick, stop_event)
+            if args.command == "serve":
+                return run_server(engine, emitter, args.host, args.port, stop_event)
+            if args.command == "gc":
+                result = dict(engine.collect_garbage(archive=args.archive, dry_run=args.dry_run),
+                              ok=True)
+                emitter.emit("result", command="gc", **result)
+                return 0
+            result = run_command(engine, emitter, args.command)
+        emitter.emit("result", command=args.command, **result)
+        return 0 if result["ok"] else 1
+    finally:
+        engine.close()
+
+
+# ---------- Main Entry Point ----------
+if __name__ == "__main__":
+    sys.exit(main())
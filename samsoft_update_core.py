@@ -0,0 +1,4263 @@
+#!/usr/bin/env python3
+"""
+Samsoft Update Core - headless updater engine
+
+Scanning, downloading and installing logic shared by every Samsoft Update
+Manager front-end. Importing this module has no side effects: nothing is
+elevated, spawned or written until an UpdateEngine is asked to do work.
+"""
+
+import sys
+import os
+import ctypes
+import subprocess
+import threading
+import time
+import json
+import base64
+import binascii
+import textwrap
+import queue
+import shutil
+import signal
+import urllib.parse
+import re
+import hashlib
+import mmap
+import itertools
+import functools
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# ---------- Elevation ----------
+def is_admin():
+    try:
+        return ctypes.windll.shell32.IsUserAnAdmin()
+    except:
+        return False
+
+def ensure_elevated():
+    """Relaunch the current script elevated and exit if not running as admin"""
+    if not is_admin():
+        params = " ".join([f'"{arg}"' for arg in sys.argv])
+        ctypes.windll.shell32.ShellExecuteW(None, "runas", sys.executable, params, None, 1)
+        sys.exit()
+
+# ---------- Configuration ----------
+REPO_DIR = os.path.join(os.getcwd(), "SamsoftRepo")
+CONFIG_FILE = os.path.join(REPO_DIR, "config.json")
+
+# Default configuration
+DEFAULT_CONFIG = {
+    "repo_path": REPO_DIR,
+    "update_categories": {
+        "windows": True,
+        "office": True,
+        "dotnet": True,
+        "vcredist": False
+    },
+    "auto_reboot": False,
+    "dark_mode": False,
+    "scan_cache_ttl": 1800,
+    "download_connections": 4,
+    # Another machine's shared repo, e.g. "http://10.0.0.5:8765" (empty: none)
+    "peer_cache_url": "",
+    "share_repo": False,
+    "peer_cache_port": 8765,
+    # Background maintenance: periodic scans, off-peak downloads, windowed installs
+    "scheduled_maintenance": False,
+    "scan_interval": 6 * 60 * 60,
+    # Local "HH:MM-HH:MM" windows; empty download window: only while idle,
+    # empty install window: never install automatically
+    "download_window": "",
+    "install_window": "",
+    "idle_minutes": 15,
+    # Background download budget: bytes per second and percent (1-100) of
+    # the machine's total CPU time; 0 lifts either limit
+    "download_rate_limit": 0,
+    "cpu_budget": 25
+}
+
+# Expected type of each setting; values of another type fall back to the
+# default. update_categories is checked entry by entry.
+CONFIG_SCHEMA = {
+    "repo_path": str,
+    "update_categories": dict,
+    "auto_reboot": bool,
+    "dark_mode": bool,
+    "scan_cache_ttl": int,
+    "download_connections": int,
+    "peer_cache_url": str,
+    "share_repo": bool,
+    "peer_cache_port": int,
+    "scheduled_maintenance": bool,
+    "scan_interval": int,
+    "download_window": str,
+    "install_window": str,
+    "idle_minutes": int,
+    "download_rate_limit": int,
+    "cpu_budget": int
+}
+
+# Allowed (minimum, maximum) of integer settings; None is unbounded and
+# settings not listed must be at least 1
+CONFIG_INT_RANGES = {
+    "scan_cache_ttl": (0, None),        # 0: never reuse a scan
+    "download_rate_limit": (0, None),   # 0: unlimited
+    "cpu_budget": (0, 100),             # 0: unlimited
+    "peer_cache_port": (1, 65535)
+}
+
+# Seconds a change waits for further changes before it is written
+CONFIG_SAVE_DELAY = 0.5
+
+
+def validate_config(data):
+    """Return a new config dict: defaults overlaid with the valid entries of data
+    
+    Keys outside the schema are kept as they are, so settings written by a
+    newer version survive a round trip.
+    """
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    if not isinstance(data, dict):
+        return config
+    for key, value in data.items():
+        expected = CONFIG_SCHEMA.get(key)
+        if expected is None:
+            config[key] = value
+        elif expected is dict:
+            if isinstance(value, dict):
+                for name, enabled in value.items():
+                    if isinstance(enabled, bool):
+                        config[key][name] = enabled
+        elif isinstance(value, expected) and (expected is bool or not isinstance(value, bool)):
+            if expected is int:
+                low, high = CONFIG_INT_RANGES.get(key, (1, None))
+                if value < low or (high is not None and value > high):
+                    continue
+            if expected is str and not value:
+                continue
+            config[key] = value
+    return config
+
+def load_config(path=None):
+    """Read and validate the config file; always returns a fresh dict"""
+    try:
+        with open(path or CONFIG_FILE, 'r') as f:
+            return validate_config(json.load(f))
+    except (OSError, ValueError):
+        return validate_config(None)
+
+def save_config(config, path=None):
+    """Write config atomically: a partial write never replaces the file"""
+    path = path or CONFIG_FILE
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(config, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ConfigStore:
+    """Validated settings served from memory, saved in the background
+    
+    set() updates `data` immediately and schedules a write; changes arriving
+    within CONFIG_SAVE_DELAY of each other are written once, on a timer
+    thread, through save_config's temp-file-and-rename. Call flush() before
+    exit to write any pending change.
+    """
+
+    def __init__(self, path=None, delay=CONFIG_SAVE_DELAY):
+        self.path = path or CONFIG_FILE
+        self.delay = delay
+        self.data = load_config(self.path)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._timer = None
+        self._dirty = False
+        self._version = 0
+        self._written_version = 0
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        """Change one setting; invalid values raise ValueError"""
+        self.update({key: value})
+
+    def update(self, values):
+        merged = dict(self.data)
+        merged.update(values)
+        checked = validate_config(merged)
+        for key, value in values.items():
+            if checked.get(key) != value:
+                raise ValueError(f"Invalid value for {key}: {value!r}")
+        with self._lock:
+            self.data.update(values)
+            self._dirty = True
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Write pending changes now"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            self._version += 1
+            version = self._version
+            snapshot = json.loads(json.dumps(self.data))
+        # The file is written outside _lock so set() never waits on the disk
+        with self._write_lock:
+            if version < self._written_version:
+                return
+            try:
+                save_config(snapshot, self.path)
+                self._written_version = version
+            except OSError:
+                with self._lock:
+                    self._dirty = True
+
+# ---------- Cancellation ----------
+class CancelToken:
+    """Cancellation flag for one job, with callbacks that stop its work
+
+    Code that starts a child process registers a callback killing it, so
+    cancel() stops PowerShell or DISM mid-run rather than at the next check.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def on_cancel(self, callback):
+        """Register callback; returns a function that unregisters it"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._discard(callback)
+        callback()
+        return lambda: None
+
+    def _discard(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+# The token (and telemetry phase, throttle and progress reporter) of the job
+# running on the current thread
+_job_context = threading.local()
+# Context besides the token that bind_token carries to other threads
+_JOB_CONTEXT_FIELDS = ("phase", "throttle", "reporter")
+
+
+def current_token():
+    return getattr(_job_context, "token", None)
+
+def cancel_requested():
+    token = current_token()
+    return token is not None and token.cancelled
+
+@contextmanager
+def use_token(token):
+    """Run the enclosed code as part of the job that owns token"""
+    previous = current_token()
+    _job_context.token = token
+    try:
+        yield token
+    finally:
+        _job_context.token = previous
+
+def bind_token(func):
+    """Wrap func so it runs under the caller's token, phase, throttle and reporter on another thread"""
+    token = current_token()
+    context = {name: getattr(_job_context, name, None) for name in _JOB_CONTEXT_FIELDS}
+    def run(*args, **kwargs):
+        previous = {name: getattr(_job_context, name, None) for name in _JOB_CONTEXT_FIELDS}
+        for name, value in context.items():
+            setattr(_job_context, name, value)
+        try:
+            with use_token(token):
+                return func(*args, **kwargs)
+        finally:
+            for name, value in previous.items():
+                setattr(_job_context, name, value)
+    return run
+
+def current_reporter():
+    return getattr(_job_context, "reporter", None)
+
+@contextmanager
+def use_reporter(reporter):
+    """Send the enclosed work's engine progress to reporter instead of the front-end"""
+    previous = current_reporter()
+    _job_context.reporter = reporter
+    try:
+        yield reporter
+    finally:
+        _job_context.reporter = previous
+
+def kill_process_tree(proc):
+    """Kill proc and every process it started
+    
+    On Windows the tree goes through taskkill. Elsewhere the process group is
+    killed when proc leads its own (started with start_new_session=True), so
+    grandchildren holding its pipes die with it.
+    """
+    pid = getattr(proc, "pid", None)
+    if os.name == "nt" and pid:
+        try:
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(pid)],
+                           capture_output=True, timeout=30,
+                           startupinfo=hidden_startupinfo())
+        except Exception:
+            pass
+    elif pid:
+        try:
+            if os.getpgid(pid) == pid:
+                os.killpg(pid, signal.SIGKILL)
+        except OSError:
+            pass
+    try:
+        proc.kill()
+    except Exception:
+        pass
+
+# ---------- Background Throttling ----------
+# CPU use is measured over windows of this many seconds
+THROTTLE_CPU_WINDOW = 5.0
+# Longest single sleep, so a throttled job still notices cancellation
+THROTTLE_MAX_SLEEP = 0.25
+
+
+class Throttle:
+    """Bandwidth and CPU budget shared by every thread of a background job
+    
+    consume(n) is called after each n bytes of work and sleeps long enough to
+    keep the job under bytes_per_second and the process under cpu_percent of
+    the machine's total CPU time. Zero disables either limit, as does a
+    download_rate_limit or cpu_budget of 0 in the config.
+    """
+
+    def __init__(self, bytes_per_second=0, cpu_percent=0):
+        self.bytes_per_second = bytes_per_second
+        self.cpu_percent = cpu_percent
+        self._lock = threading.Lock()
+        # When the bytes consumed so far are paid for at the allowed rate
+        self._clear_at = time.monotonic()
+        self._cpu_mark = (time.monotonic(), time.process_time())
+
+    def _delay(self, nbytes):
+        now = time.monotonic()
+        delay = 0.0
+        with self._lock:
+            if self.bytes_per_second and nbytes:
+                self._clear_at = max(self._clear_at, now) + nbytes / self.bytes_per_second
+                delay = self._clear_at - now
+            if self.cpu_percent:
+                share = (os.cpu_count() or 1) * self.cpu_percent / 100
+                wall_start, cpu_start = self._cpu_mark
+                cpu = time.process_time() - cpu_start
+                # Wall time the CPU used so far is allowed to take
+                delay = max(delay, cpu / share - (now - wall_start))
+                if now - wall_start > THROTTLE_CPU_WINDOW:
+                    self._cpu_mark = (now, time.process_time())
+        return delay
+
+    def consume(self, nbytes=0):
+        deadline = time.monotonic() + self._delay(nbytes)
+        while not cancel_requested():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, THROTTLE_MAX_SLEEP))
+
+
+def current_throttle():
+    return getattr(_job_context, "throttle", None)
+
+@contextmanager
+def use_throttle(throttle):
+    """Hold the enclosed work (and work it binds to other threads) to throttle"""
+    previous = current_throttle()
+    _job_context.throttle = throttle
+    try:
+        yield throttle
+    finally:
+        _job_context.throttle = previous
+
+# ---------- Phase Telemetry ----------
+METRICS_FILE = "metrics.jsonl"
+# The metrics file is rotated to metrics.jsonl.1 past this size
+METRICS_MAX_BYTES = 1024 * 1024
+# Finished phases kept in memory for summaries
+METRICS_HISTORY = 500
+
+
+class Phase:
+    """Timing of one backend operation and of the work done inside it
+
+    Code running in the phase reports through current_phase(): process
+    spawn time, latency to the first output byte, bytes transferred and
+    per-package install times. Phases nest; what a nested phase records is
+    counted in the enclosing phases as well.
+    """
+
+    def __init__(self, name, fields=None, parent=None):
+        self.name = name
+        self.fields = dict(fields or {})
+        self.parent = parent
+        self.start = time.time()
+        self._t0 = time.monotonic()
+        self.seconds = None
+        self.ok = None
+        self.spawns = []
+        self.first_output = []
+        self.bytes = 0
+        self.packages = []
+        self._lock = threading.Lock()
+
+    def _chain(self):
+        # Work done in a nested phase also counts towards the enclosing ones
+        phase = self
+        while phase is not None:
+            yield phase
+            phase = phase.parent
+
+    def note_spawn(self, seconds):
+        for phase in self._chain():
+            with phase._lock:
+                phase.spawns.append(seconds)
+
+    def note_first_output(self, seconds):
+        for phase in self._chain():
+            with phase._lock:
+                phase.first_output.append(seconds)
+
+    def add_bytes(self, count):
+        for phase in self._chain():
+            with phase._lock:
+                phase.bytes += count
+
+    def add_package(self, name, seconds, ok, batch=1):
+        """One installed package; batch > 1 means seconds is its share of a batched call"""
+        package = {"name": name, "seconds": round(seconds, 3), "ok": ok, "batch": batch}
+        for phase in self._chain():
+            with phase._lock:
+                phase.packages.append(package)
+
+    def finish(self, ok):
+        self.seconds = time.monotonic() - self._t0
+        if self.ok is None:
+            self.ok = ok
+
+    def as_dict(self):
+        with self._lock:
+            record = {"phase": self.name, "start": round(self.start, 3),
+                      "seconds": round(self.seconds or 0.0, 3), "ok": self.ok,
+                      "spawn": [round(s, 3) for s in self.spawns],
+                      "first_output": [round(s, 3) for s in self.first_output],
+                      "bytes": self.bytes, "packages": list(self.packages)}
+        record.update(self.fields)
+        return record
+
+
+def current_phase():
+    return getattr(_job_context, "phase", None)
+
+
+class Telemetry:
+    """Records phases to a JSONL metrics file and summarises them
+
+    Each finished phase is appended to the file as one line and kept in
+    memory; earlier runs are read back from the file the first time a
+    summary is asked for. on_phase(phase) is called as each phase ends, and
+    top-level phases are also kept as runs in the history store, if any.
+    """
+
+    def __init__(self, path=None, history=METRICS_HISTORY, on_phase=None, store=None):
+        self.path = path
+        self.on_phase = on_phase
+        self.store = store
+        self._records = deque(maxlen=history)
+        self._loaded = path is None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name, **fields):
+        """Time the enclosed block as one phase; code inside sees it as current_phase()"""
+        previous = current_phase()
+        phase = Phase(name, fields, previous)
+        _job_context.phase = phase
+        ok = False
+        try:
+            yield phase
+            ok = True
+        finally:
+            _job_context.phase = previous
+            phase.finish(ok)
+            self._record(phase)
+
+    def _record(self, phase):
+        record = phase.as_dict()
+        with self._lock:
+            self._records.append(record)
+            if self.path:
+                try:
+                    if os.path.getsize(self.path) > METRICS_MAX_BYTES:
+                        os.replace(self.path, self.path + ".1")
+                except OSError:
+                    pass
+                try:
+                    with open(self.path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(record) + "\n")
+                except OSError:
+                    pass
+        if self.store is not None and phase.parent is None:
+            self.store.record_run(phase)
+        if self.on_phase:
+            try:
+                self.on_phase(phase)
+            except Exception:
+                pass
+
+    def _load(self):
+        records = []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            pass
+        # Phases recorded this session are already in the file
+        self._records = deque(records, maxlen=self._records.maxlen)
+        self._loaded = True
+
+    def records(self):
+        """Recent phase records, oldest first"""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            return list(self._records)
+
+    def summary(self):
+        """{phase: {count, failed, total, mean, max, last, spawn, first_output, bytes, packages}}"""
+        summary = {}
+        for record in self.records():
+            stats = summary.setdefault(record["phase"], {
+                "count": 0, "failed": 0, "total": 0.0, "max": 0.0, "last": 0.0,
+                "spawn": [], "first_output": [], "bytes": 0, "packages": []
+            })
+            seconds = record.get("seconds") or 0.0
+            stats["count"] += 1
+            stats["failed"] += 0 if record.get("ok") else 1
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["last"] = seconds
+            stats["spawn"].extend(record.get("spawn") or ())
+            stats["first_output"].extend(record.get("first_output") or ())
+            stats["bytes"] += record.get("bytes") or 0
+            stats["packages"].extend(p["seconds"] for p in record.get("packages") or ())
+        for stats in summary.values():
+            stats["mean"] = stats["total"] / stats["count"]
+            for key in ("spawn", "first_output", "packages"):
+                values = stats[key]
+                stats[key] = sum(values) / len(values) if values else None
+        return summary
+
+
+def timed_phase(name, ok=None):
+    """UpdateEngine method decorator running each call as a telemetry phase
+
+    ok(result) decides whether the phase succeeded; by default any result
+    other than False counts.
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def run(self, *args, **kwargs):
+            with self.telemetry.phase(name) as phase:
+                result = method(self, *args, **kwargs)
+                phase.ok = ok(result) if ok else result is not False
+                return result
+        return run
+    return decorate
+
+# ---------- PowerShell Host Session ----------
+def hidden_startupinfo():
+    """STARTUPINFO that hides console windows (None off Windows)"""
+    if not hasattr(subprocess, "STARTUPINFO"):
+        return None
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    startupinfo.wShowWindow = subprocess.SW_HIDE
+    return startupinfo
+
+# Streamed commands keep only this many trailing lines per stream in memory
+STREAM_TAIL_LINES = 200
+
+ERROR_LINE_PATTERN = re.compile(r"\berror\b|\bfailed\b|\bexception\b|0x8[0-9a-f]{7}", re.IGNORECASE)
+
+
+def classify_output_line(text, stream="stdout"):
+    """Log level for one line of command output"""
+    if stream == "stderr":
+        return "error"
+    if text.lstrip().upper().startswith("WARNING"):
+        return "warning"
+    if ERROR_LINE_PATTERN.search(text):
+        return "error"
+    return "info"
+
+
+def run_streaming(args, on_line=None, timeout=3600, tail_lines=STREAM_TAIL_LINES, cancel=None):
+    """Run a process, handing each stdout/stderr line to on_line(stream, text)
+    
+    Both pipes are drained on reader threads as output arrives. Only the last
+    tail_lines lines of each stream are kept and returned as (stdout, stderr, code).
+    Cancelling `cancel` (default: the current job's token) kills the process tree.
+    """
+    token = cancel or current_token()
+    if token is not None and token.cancelled:
+        return "", "Cancelled", 1
+    phase = current_phase()
+    started = time.monotonic()
+    try:
+        proc = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors="replace",
+            startupinfo=hidden_startupinfo(),
+            # Its own process group, so a cancel also kills its children
+            start_new_session=os.name != "nt"
+        )
+    except Exception as e:
+        return "", f"Error: {str(e)}", 1
+    if phase:
+        phase.note_spawn(time.monotonic() - started)
+    
+    tails = {"stdout": deque(maxlen=tail_lines), "stderr": deque(maxlen=tail_lines)}
+    first_output = threading.Event()
+    
+    def pump(pipe, stream):
+        try:
+            for line in pipe:
+                if phase and not first_output.is_set():
+                    first_output.set()
+                    phase.note_first_output(time.monotonic() - started)
+                line = line.rstrip("\r\n")
+                tails[stream].append(line)
+                if on_line:
+                    on_line(stream, line)
+        except (OSError, ValueError):
+            pass
+        finally:
+            pipe.close()
+    
+    readers = [
+        threading.Thread(target=pump, args=(proc.stdout, "stdout"), daemon=True),
+        threading.Thread(target=pump, args=(proc.stderr, "stderr"), daemon=True)
+    ]
+    for reader in readers:
+        reader.start()
+    unregister = token.on_cancel(lambda: kill_process_tree(proc)) if token else None
+    
+    try:
+        code = proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_tree(proc)
+        proc.wait()
+        code = None
+    finally:
+        if unregister:
+            unregister()
+    for reader in readers:
+        reader.join(timeout=5)
+    
+    if token is not None and token.cancelled:
+        return "\n".join(tails["stdout"]).strip(), "Cancelled", 1
+    if code is None:
+        return "\n".join(tails["stdout"]).strip(), "Command timed out", 1
+    return "\n".join(tails["stdout"]).strip(), "\n".join(tails["stderr"]).strip(), code
+
+# Every frame is one line: "@@SAMSOFT <id> <kind> <base64 payload>".
+# Requests use kind CMD; the host answers with OUT/ERR lines and one END
+# frame whose payload is the exit code. READY is sent once after startup.
+FRAME_MARKER = "@@SAMSOFT"
+# Seconds between cancellation checks while waiting for the busy host
+POWERSHELL_WAIT_POLL = 0.25
+
+POWERSHELL_HOST_SCRIPT = textwrap.dedent("""
+    $ErrorActionPreference = 'Continue'
+    $ProgressPreference = 'SilentlyContinue'
+    [Console]::OutputEncoding = New-Object System.Text.UTF8Encoding $false
+    $iss = [System.Management.Automation.Runspaces.InitialSessionState]::CreateDefault()
+    if (Get-Module -ListAvailable -Name PSWindowsUpdate) { $iss.ImportPSModule(@('PSWindowsUpdate')) }
+    $rs = [System.Management.Automation.Runspaces.RunspaceFactory]::CreateRunspace($iss)
+    $rs.Open()
+
+    function Send-Frame([string]$id, [string]$kind, [string]$text) {
+        $b64 = [Convert]::ToBase64String([Text.Encoding]::UTF8.GetBytes($text))
+        [Console]::Out.WriteLine("@@SAMSOFT $id $kind $b64")
+        [Console]::Out.Flush()
+    }
+
+    function Send-Pending($ps, $out, $seen, $id) {
+        while ($seen.o -lt $out.Count) { Send-Frame $id OUT ([string]$out[$seen.o]).TrimEnd(); $seen.o++ }
+        while ($seen.v -lt $ps.Streams.Verbose.Count) { Send-Frame $id OUT ('VERBOSE: ' + $ps.Streams.Verbose[$seen.v].Message); $seen.v++ }
+        while ($seen.w -lt $ps.Streams.Warning.Count) { Send-Frame $id OUT ('WARNING: ' + $ps.Streams.Warning[$seen.w].Message); $seen.w++ }
+        while ($seen.e -lt $ps.Streams.Error.Count) { Send-Frame $id ERR ([string]$ps.Streams.Error[$seen.e]); $seen.e++ }
+    }
+
+    Send-Frame 0 READY ''
+    while ($true) {
+        $line = [Console]::In.ReadLine()
+        if ($null -eq $line) { break }
+        $parts = $line.Split(' ')
+        if ($parts.Length -ne 4 -or $parts[0] -ne '@@SAMSOFT' -or $parts[2] -ne 'CMD') { continue }
+        $id = $parts[1]
+        $script = [Text.Encoding]::UTF8.GetString([Convert]::FromBase64String($parts[3]))
+        $rs.SessionStateProxy.SetVariable('LASTEXITCODE', 0)
+        $ps = [PowerShell]::Create()
+        $ps.Runspace = $rs
+        # Local scope: variables and preferences set by one request end with it
+        [void]$ps.AddScript($script, $true).AddCommand('Out-String').AddParameter('Stream')
+        $in = New-Object 'System.Management.Automation.PSDataCollection[psobject]'
+        $out = New-Object 'System.Management.Automation.PSDataCollection[psobject]'
+        $seen = @{ o = 0; v = 0; w = 0; e = 0 }
+        $handle = $ps.BeginInvoke($in, $out)
+        while (-not $handle.AsyncWaitHandle.WaitOne(50)) { Send-Pending $ps $out $seen $id }
+        $code = 0
+        try { [void]$ps.EndInvoke($handle) } catch { Send-Frame $id ERR $_.Exception.Message; $code = 1 }
+        Send-Pending $ps $out $seen $id
+        $last = $rs.SessionStateProxy.GetVariable('LASTEXITCODE')
+        if ($last) { $code = [int]$last }
+        $ps.Dispose()
+        Send-Frame $id END ([string]$code)
+    }
+""")
+
+
+def encode_frame(request_id, kind, text):
+    """Encode one protocol frame (without trailing newline)"""
+    payload = base64.b64encode(text.encode("utf-8")).decode("ascii")
+    return f"{FRAME_MARKER} {request_id} {kind} {payload}"
+
+
+def decode_frame(line):
+    """Decode a protocol frame into (id, kind, text), or None for noise"""
+    parts = line.rstrip("\r\n").split(" ")
+    if len(parts) != 4 or parts[0] != FRAME_MARKER:
+        return None
+    try:
+        text = base64.b64decode(parts[3]).decode("utf-8", errors="replace")
+    except (ValueError, binascii.Error):
+        return None
+    return parts[1], parts[2], text
+
+
+def spawn_powershell_host():
+    """Start a real powershell.exe running the framed host loop"""
+    # -EncodedCommand sidesteps command-line quoting of the multi-line script
+    encoded = base64.b64encode(POWERSHELL_HOST_SCRIPT.encode("utf-16-le")).decode("ascii")
+    return subprocess.Popen(
+        ["powershell", "-NoProfile", "-NonInteractive", "-ExecutionPolicy", "Bypass",
+         "-WindowStyle", "Hidden", "-EncodedCommand", encoded],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+        bufsize=1,
+        startupinfo=hidden_startupinfo()
+    )
+
+
+class FakePowerShellHost:
+    """In-process stand-in for the PowerShell host, for running without Windows.
+
+    `handler(command)` returns (stdout_lines, stderr_lines, exit_code). It may
+    raise SystemExit to simulate the host process dying mid-request.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.commands = []
+        self.returncode = None
+        req_r, req_w = os.pipe()
+        resp_r, resp_w = os.pipe()
+        self.stdin = os.fdopen(req_w, "w", encoding="utf-8", buffering=1)
+        self.stdout = os.fdopen(resp_r, "r", encoding="utf-8")
+        self._req = os.fdopen(req_r, "r", encoding="utf-8")
+        self._resp = os.fdopen(resp_w, "w", encoding="utf-8", buffering=1)
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        try:
+            self._resp.write(encode_frame(0, "READY", "") + "\n")
+            for line in self._req:
+                frame = decode_frame(line)
+                if not frame or frame[1] != "CMD":
+                    continue
+                request_id, _, command = frame
+                self.commands.append(command)
+                out_lines, err_lines, code = self.handler(command)
+                for text in out_lines:
+                    self._resp.write(encode_frame(request_id, "OUT", text) + "\n")
+                for text in err_lines:
+                    self._resp.write(encode_frame(request_id, "ERR", text) + "\n")
+                self._resp.write(encode_frame(request_id, "END", str(code)) + "\n")
+            self.returncode = 0
+        except (SystemExit, OSError, ValueError):
+            self.returncode = 1
+        finally:
+            for stream in (self._resp, self._req):
+                try:
+                    stream.close()
+                except OSError:
+                    pass
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        for stream in (self.stdin, self._resp):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        self.returncode = -9
+
+    def wait(self, timeout=None):
+        # A killed host is gone at once, even if the handler is still running
+        if self.returncode is None:
+            self._thread.join(timeout)
+        return self.returncode
+
+
+class PowerShellSession:
+    """Long-lived PowerShell host shared by every backend command.
+
+    The host imports PSWindowsUpdate once and then executes framed requests
+    one at a time. A dead or hung host is replaced on the next request.
+    """
+
+    def __init__(self, host_factory=None, startup_timeout=120):
+        self.host_factory = host_factory or spawn_powershell_host
+        self.startup_timeout = startup_timeout
+        self.restarts = 0
+        self._started = False
+        self._proc = None
+        self._frames = None
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def _read_frames(self, proc, frames):
+        """Reader thread: push decoded frames, then None on EOF"""
+        try:
+            for line in proc.stdout:
+                frame = decode_frame(line)
+                if frame:
+                    frames.put(frame)
+        except (OSError, ValueError):
+            pass
+        frames.put(None)
+
+    def _read_host_stderr(self, proc, frames):
+        """Reader thread: host-level errors are reported to the current request"""
+        try:
+            for line in proc.stderr:
+                if line.strip():
+                    frames.put(("*", "ERR", line.rstrip("\r\n")))
+        except (OSError, ValueError):
+            pass
+
+    def _start(self):
+        if self._started:
+            self.restarts += 1
+        self._started = True
+        started = time.monotonic()
+        self._proc = self.host_factory()
+        self._frames = queue.Queue()
+        threading.Thread(target=self._read_frames, args=(self._proc, self._frames),
+                         daemon=True).start()
+        if getattr(self._proc, "stderr", None) is not None:
+            threading.Thread(target=self._read_host_stderr, args=(self._proc, self._frames),
+                             daemon=True).start()
+        try:
+            frame = self._frames.get(timeout=self.startup_timeout)
+        except queue.Empty:
+            frame = None
+        if not frame or frame[1] != "READY":
+            self._kill()
+            raise RuntimeError("PowerShell host failed to start")
+        # Host startup, module import included, counts as spawn time
+        phase = current_phase()
+        if phase:
+            phase.note_spawn(time.monotonic() - started)
+
+    def _kill(self):
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.kill()
+            proc.wait(timeout=5)
+        except Exception:
+            pass
+
+    def _alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def _send(self, request_id, command):
+        self._proc.stdin.write(encode_frame(request_id, "CMD", command) + "\n")
+        self._proc.stdin.flush()
+
+    def _acquire(self, token, timeout):
+        """Wait for the host to be free; "Cancelled" or "timeout" if it never was"""
+        deadline = time.monotonic() + timeout
+        while not self._lock.acquire(timeout=POWERSHELL_WAIT_POLL):
+            if token is not None and token.cancelled:
+                return "Cancelled"
+            if time.monotonic() >= deadline:
+                return "timeout"
+        if token is not None and token.cancelled:
+            self._lock.release()
+            return "Cancelled"
+        return None
+
+    def execute(self, command, timeout=3600, on_line=None, tail_lines=None):
+        """Run a command in the host; returns (stdout, stderr, returncode)
+        
+        Each line is passed to on_line(stream, text) as soon as the host sends
+        it. With tail_lines set, only that many trailing lines per stream are kept.
+        While another command holds the host, this waits up to timeout for it
+        and gives up early if the current job is cancelled.
+        """
+        token = current_token()
+        busy = self._acquire(token, timeout)
+        if busy == "Cancelled":
+            return "", "Cancelled", 1
+        if busy:
+            return "", "Command timed out waiting for the PowerShell host", 1
+        try:
+            request_id = str(self._next_id)
+            self._next_id += 1
+            try:
+                if not self._alive():
+                    self._start()
+                try:
+                    self._send(request_id, command)
+                except (OSError, ValueError):
+                    # Host died between requests; the command never ran
+                    self._kill()
+                    self._start()
+                    self._send(request_id, command)
+            except Exception as e:
+                return "", f"Error: {str(e)}", 1
+
+            # Cancelling kills the host; _collect then sees EOF and the next
+            # command starts a fresh host
+            proc = self._proc
+            unregister = token.on_cancel(lambda: kill_process_tree(proc)) if token else None
+            try:
+                return self._collect(request_id, timeout, on_line, tail_lines, token)
+            finally:
+                if unregister:
+                    unregister()
+        finally:
+            self._lock.release()
+
+    def _collect(self, request_id, timeout, on_line, tail_lines, token):
+        """Read frames for request_id until its END frame; caller holds _lock"""
+        out_lines, err_lines = deque(maxlen=tail_lines), deque(maxlen=tail_lines)
+        sent = time.monotonic()
+        deadline = sent + timeout
+        phase = current_phase()
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                frame = self._frames.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                self._kill()
+                return "", "Command timed out", 1
+            if frame is None:
+                self._kill()
+                if token is not None and token.cancelled:
+                    return "\n".join(out_lines).strip(), "Cancelled", 1
+                err_lines.append("PowerShell host exited unexpectedly")
+                return "\n".join(out_lines).strip(), "\n".join(err_lines).strip(), 1
+            frame_id, kind, text = frame
+            if frame_id not in (request_id, "*"):
+                continue
+            if phase:
+                phase.note_first_output(time.monotonic() - sent)
+                phase = None
+            if kind == "OUT":
+                out_lines.append(text)
+                if on_line:
+                    on_line("stdout", text)
+            elif kind == "ERR":
+                err_lines.append(text)
+                if on_line:
+                    on_line("stderr", text)
+            elif kind == "END":
+                try:
+                    code = int(text)
+                except ValueError:
+                    code = 1
+                return "\n".join(out_lines).strip(), "\n".join(err_lines).strip(), code
+
+    def close(self):
+        """Shut the host down"""
+        with self._lock:
+            if self._proc is not None:
+                try:
+                    self._proc.stdin.close()
+                    self._proc.wait(timeout=5)
+                except Exception:
+                    pass
+            self._kill()
+
+# ---------- Capability Probe ----------
+CAPABILITY_CACHE_FILE = "capabilities.json"
+# Cached probes older than this are refreshed in the background
+CAPABILITY_MAX_AGE = 24 * 60 * 60
+
+# One PowerShell round trip reporting every optional component the engine uses
+CAPABILITY_PROBE_SCRIPT = textwrap.dedent("""
+    $module = Get-Module -ListAvailable -Name PSWindowsUpdate | Sort-Object Version -Descending | Select-Object -First 1
+    $nuget = Get-PackageProvider -ListAvailable -Name NuGet -ErrorAction SilentlyContinue | Sort-Object Version -Descending | Select-Object -First 1
+    $winget = Get-Command winget -ErrorAction SilentlyContinue | Select-Object -First 1
+    [pscustomobject]@{
+        PSWindowsUpdate = if ($module) { @{ Version = "$($module.Version)"; Path = $module.ModuleBase } } else { $null }
+        NuGet = if ($nuget) { @{ Version = "$($nuget.Version)"; Path = $null } } else { $null }
+        Winget = if ($winget) { @{ Version = "$($winget.Version)"; Path = $winget.Source } } else { $null }
+    } | ConvertTo-Json -Compress -Depth 3
+""").strip()
+
+
+class CapabilityProbe:
+    """Availability of PSWindowsUpdate, the NuGet provider and winget
+
+    Results are cached in CAPABILITY_CACHE_FILE with the version and the
+    install path of each component, plus that path's mtime. A cached entry
+    stays valid while those mtimes match, which is checked with os.stat and
+    no PowerShell. Entries older than max_age are refreshed on a background
+    thread; missing or invalid ones are probed on demand.
+    """
+
+    def __init__(self, repo_path, run_powershell, max_age=CAPABILITY_MAX_AGE):
+        self.path = os.path.join(repo_path, CAPABILITY_CACHE_FILE)
+        self.run_powershell = run_powershell
+        self.max_age = max_age
+        self._entry = None
+        self._lock = threading.Lock()
+        self._refreshing = None
+        self._load()
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except (OSError, TypeError, ValueError):
+            return None
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(entry, dict) and isinstance(entry.get("capabilities"), dict):
+            self._entry = entry
+
+    def _valid(self, entry):
+        """Whether every cached install path is unchanged on disk"""
+        for info in entry["capabilities"].values():
+            if info and info.get("Path") and self._mtime(info["Path"]) != info.get("Mtime"):
+                return False
+        return True
+
+    def cached(self):
+        """Cached capabilities, or None when there is no valid cache"""
+        with self._lock:
+            entry = self._entry
+        if entry is None or not self._valid(entry):
+            return None
+        if time.time() - entry.get("time", 0) > self.max_age:
+            self.refresh_async()
+        return entry["capabilities"]
+
+    def probe(self):
+        """Run the probe now, cache and return the capabilities (None on failure)"""
+        out, err, code = self.run_powershell(CAPABILITY_PROBE_SCRIPT)
+        try:
+            data = json.loads(out.strip().splitlines()[-1]) if code == 0 and out.strip() else None
+        except (ValueError, IndexError):
+            data = None
+        if not isinstance(data, dict):
+            return None
+        capabilities = {}
+        for name in ("PSWindowsUpdate", "NuGet", "Winget"):
+            info = data.get(name)
+            if isinstance(info, dict):
+                info = {"Version": info.get("Version"), "Path": info.get("Path"),
+                        "Mtime": self._mtime(info.get("Path"))}
+            else:
+                info = None
+            capabilities[name] = info
+        entry = {"time": time.time(), "capabilities": capabilities}
+        with self._lock:
+            self._entry = entry
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(entry, f)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                pass
+        return capabilities
+
+    def get(self):
+        """Cached capabilities if valid, otherwise a fresh probe"""
+        capabilities = self.cached()
+        return capabilities if capabilities is not None else self.probe()
+
+    def refresh_async(self):
+        """Re-probe on a background thread unless a refresh is already running"""
+        with self._lock:
+            if self._refreshing is not None and self._refreshing.is_alive():
+                return
+            self._refreshing = threading.Thread(target=self.probe, daemon=True)
+            self._refreshing.start()
+
+    def available(self, name):
+        """Whether a component is installed, by the cache or a fresh probe"""
+        capabilities = self.get() or {}
+        return bool(capabilities.get(name))
+
+    def invalidate(self):
+        with self._lock:
+            self._entry = None
+
+# ---------- Scan Records ----------
+# Per-update projection run inside the scan: one compressed JSON object per
+# line, holding only the fields UpdateRecord keeps
+SCAN_PROJECTION = textwrap.dedent("""
+    ForEach-Object {
+        [pscustomobject]@{
+            Title = $_.Title
+            KB = $_.KB
+            Size = $_.Size
+            IsDownloaded = $_.IsDownloaded
+            DownloadUrls = @($_.BundledUpdates | ForEach-Object { $_.DownloadContents } | ForEach-Object { $_.DownloadUrl })
+            UpdateID = $_.Identity.UpdateID
+            SupersededUpdateIDs = @($_.SupersededUpdateIDs)
+        } | ConvertTo-Json -Compress -Depth 2
+    }
+""").strip()
+
+
+class UpdateRecord:
+    """One update from a scan, holding only the projected fields
+
+    Serialised with the PowerShell property names (Title, KB, ...), the
+    format used by the scan output, the scan cache and the update manifest.
+    """
+
+    __slots__ = ("title", "kb", "size", "is_downloaded", "download_urls",
+                 "update_id", "superseded_ids")
+
+    def __init__(self, title=None, kb=None, size=None, is_downloaded=False, download_urls=(),
+                 update_id=None, superseded_ids=()):
+        self.title = title
+        self.kb = normalize_kb(kb)
+        self.size = size
+        self.is_downloaded = is_downloaded
+        self.download_urls = tuple(download_urls or ())
+        # Windows Update identity, and the identities of updates this one replaces
+        self.update_id = update_id
+        self.superseded_ids = tuple(superseded_ids or ())
+
+    @classmethod
+    def from_dict(cls, data):
+        urls = data.get("DownloadUrls") or ()
+        if isinstance(urls, str):
+            urls = (urls,)
+        superseded = data.get("SupersededUpdateIDs") or ()
+        if isinstance(superseded, str):
+            superseded = (superseded,)
+        size = data.get("Size")
+        return cls(
+            title=data.get("Title"),
+            kb=data.get("KB"),
+            size=size if isinstance(size, int) else None,
+            is_downloaded=bool(data.get("IsDownloaded")),
+            download_urls=urls,
+            update_id=data.get("UpdateID"),
+            superseded_ids=superseded
+        )
+
+    def to_dict(self):
+        return {"Title": self.title, "KB": self.kb, "Size": self.size,
+                "IsDownloaded": self.is_downloaded, "DownloadUrls": list(self.download_urls),
+                "UpdateID": self.update_id, "SupersededUpdateIDs": list(self.superseded_ids)}
+
+    def __repr__(self):
+        return f"UpdateRecord({self.kb!r}, {self.title!r})"
+
+
+class ScanStreamParser:
+    """on_line callback that decodes NDJSON scan output one line at a time
+
+    Each complete line becomes an UpdateRecord as soon as it arrives and is
+    handed to on_record; the raw output is never accumulated. Lines that are
+    not JSON objects (warnings, progress text) are counted in `skipped`.
+    """
+
+    def __init__(self, on_record=None):
+        self.on_record = on_record
+        self.records = []
+        self.skipped = 0
+
+    def __call__(self, stream, text):
+        if stream != "stdout":
+            return
+        text = text.strip()
+        if not text:
+            return
+        try:
+            data = json.loads(text) if text.startswith("{") else None
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            self.skipped += 1
+            return
+        record = UpdateRecord.from_dict(data)
+        self.records.append(record)
+        if self.on_record:
+            self.on_record(record)
+
+# ---------- Scan Result Cache ----------
+SCAN_CACHE_FILE = "scan_cache.json"
+
+# Category filters applied on top of a full scan, matched against the title
+SCAN_CATEGORY_FILTERS = {
+    "dotnet": lambda update: ".NET" in (update.title or ""),
+}
+
+
+class ScanCache:
+    """Windows Update scan results keyed by (source, category).
+
+    Entries live in memory and are mirrored to SCAN_CACHE_FILE in the repo so
+    a restart can reuse a recent scan. Entries older than `ttl` seconds are
+    ignored; installs call invalidate() because they change the result.
+    """
+
+    def __init__(self, repo_path, ttl=1800):
+        self.path = os.path.join(repo_path, SCAN_CACHE_FILE)
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def _key(source, category):
+        return f"{source}/{category}"
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._entries = data
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    def get(self, source, category="all"):
+        """Return cached UpdateRecords, or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(self._key(source, category))
+            if not entry or time.time() - entry.get("time", 0) > self.ttl:
+                return None
+            return [UpdateRecord.from_dict(u) for u in entry.get("updates", [])
+                    if isinstance(u, dict)]
+
+    def age(self, source, category="all"):
+        """Seconds since the entry was stored, or None"""
+        with self._lock:
+            entry = self._entries.get(self._key(source, category))
+            return time.time() - entry["time"] if entry else None
+
+    def put(self, source, category, updates):
+        with self._lock:
+            self._entries[self._key(source, category)] = {
+                "time": time.time(),
+                "updates": [u.to_dict() for u in updates]
+            }
+            self._save()
+
+    def invalidate(self, source=None):
+        """Drop all entries, or only those for one source"""
+        with self._lock:
+            if source is None:
+                self._entries.clear()
+            else:
+                prefix = f"{source}/"
+                self._entries = {k: v for k, v in self._entries.items()
+                                 if not k.startswith(prefix)}
+            self._save()
+
+# ---------- Offline Install Pipeline ----------
+KB_PATTERN = re.compile(r"kb(\d{6,8})", re.IGNORECASE)
+SSU_PATTERN = re.compile(r"servicing stack|\bssu\b", re.IGNORECASE)
+
+# .msu files are cabinet archives; the header's cbCabinet field is the file size
+MSU_MAGIC = b"MSCF"
+CAB_HEADER_SIZE = 12
+
+# DISM results that count as installed (3010 = success, reboot required)
+DISM_SUCCESS_CODES = (0, 3010)
+DISM_PACKAGE_TIMEOUT = 600
+# Keeps a batched DISM command line well under the Windows length limit
+DISM_MAX_BATCH = 16
+
+
+class MsuPackage:
+    """One .msu file in the offline repo, plus what validation learned about it"""
+
+    def __init__(self, path, name=None, kb=None, title=None, expected_sha256=None):
+        self.path = path
+        self.name = name or os.path.basename(path)
+        match = KB_PATTERN.search(self.name)
+        self.kb = kb or (f"KB{match.group(1)}" if match else None)
+        self.title = title or self.name
+        self.expected_sha256 = expected_sha256
+        self.size = 0
+        self.sha256 = None
+        self.error = None
+        # Readable but damaged: bad header, wrong size or a hash other than expected
+        self.corrupt = False
+
+    @property
+    def valid(self):
+        return self.error is None
+
+    @property
+    def is_servicing_stack(self):
+        return bool(SSU_PATTERN.search(self.title) or SSU_PATTERN.search(self.name))
+
+
+# ---------- Package Verification ----------
+VERIFY_CACHE_FILE = "verify_cache.json"
+# Bytes handed to hashlib per call; large enough that the GIL is rarely held
+VERIFY_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def hash_file(path, hash_name="sha256", block_size=VERIFY_BLOCK_SIZE):
+    """Hex digest of a file, read through a read-only memory map"""
+    return file_digests(path, (hash_name,), block_size)[hash_name]
+
+
+def file_digests(path, hash_names, block_size=VERIFY_BLOCK_SIZE):
+    """{hash_name: hex digest} of a file, all computed in one pass
+    
+    The file is read through a read-only memory map. hashlib releases the
+    GIL while it hashes each block, so several files hash in parallel on a
+    thread pool. Falls back to buffered reads where a file cannot be mapped.
+    """
+    digests = {name: hashlib.new(name) for name in hash_names}
+    throttle = current_throttle()
+
+    def update(block):
+        for digest in digests.values():
+            digest.update(block)
+        if throttle:
+            throttle.consume()
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        try:
+            view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        except (OSError, ValueError, OverflowError):
+            view = None
+            for block in iter(lambda: f.read(block_size), b""):
+                update(block)
+        if view is not None:
+            with view, memoryview(view) as data:
+                for start in range(0, size, block_size):
+                    update(data[start:start + block_size])
+    return {name: digest.hexdigest() for name, digest in digests.items()}
+
+
+def cabinet_size(path):
+    """Size recorded in a cabinet file's header, or None if it is not a cabinet"""
+    with open(path, 'rb') as f:
+        header = f.read(CAB_HEADER_SIZE)
+    if len(header) < CAB_HEADER_SIZE or not header.startswith(MSU_MAGIC):
+        return None
+    return int.from_bytes(header[8:12], "little")
+
+
+class VerifyCache:
+    """Verification results keyed by (path, size, mtime)
+    
+    A file whose size and modification time are unchanged is not hashed
+    again. Results are kept in verify_cache.json in the repo; call save()
+    after a verification pass.
+    """
+
+    def __init__(self, repo_path):
+        self.path = os.path.join(repo_path, VERIFY_CACHE_FILE)
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(self.path, 'r') as f:
+                self._entries = json.load(f)
+            if not isinstance(self._entries, dict):
+                self._entries = {}
+        except (OSError, ValueError):
+            self._entries = {}
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def lookup(self, path, stat):
+        """Cached {"cabinet_size", "sha256", ...digests} for this version of path, or None"""
+        with self._lock:
+            entry = self._entries.get(self._key(path))
+        # Entries from before the cabinet size was checked have no cabinet_size
+        if (isinstance(entry, dict) and entry.get("size") == stat.st_size
+                and entry.get("mtime") == stat.st_mtime_ns and "cabinet_size" in entry):
+            return entry
+        return None
+
+    def put(self, path, stat, cab_size, digests):
+        with self._lock:
+            self._entries[self._key(path)] = dict(digests, size=stat.st_size, mtime=stat.st_mtime_ns,
+                                                  cabinet_size=cab_size)
+            self._dirty = True
+
+    def save(self):
+        """Write the cache if it changed, dropping files that no longer exist"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._entries = {k: v for k, v in self._entries.items() if os.path.exists(k)}
+            self._dirty = False
+            entries = dict(self._entries)
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+
+def inspect_package(package, cache=None):
+    """Cabinet header, size and hash check of a path or MsuPackage
+    
+    The size recorded in the cabinet header must match the file's, which
+    catches truncated packages whatever hash they were stored under. The
+    SHA-256 is compared with package.expected_sha256 when one is known, and
+    a catalog SHA-1 embedded in the package name is checked as well.
+    cache (a VerifyCache) skips hashing files that have not changed.
+    """
+    if not isinstance(package, MsuPackage):
+        package = MsuPackage(package)
+    path = package.path
+    expected_sha1, _ = catalog_expected_hash(package.name)
+    hash_names = ("sha256", "sha1") if expected_sha1 else ("sha256",)
+    try:
+        stat = os.stat(path)
+        package.size = stat.st_size
+        cached = cache.lookup(path, stat) if cache else None
+        if cached and all(name in cached for name in hash_names):
+            cab_size, digests = cached["cabinet_size"], cached
+        else:
+            cab_size = cabinet_size(path)
+            digests = file_digests(path, hash_names) if cab_size == stat.st_size else {}
+            if cache:
+                cache.put(path, stat, cab_size, digests)
+    except OSError as e:
+        package.error = str(e)
+        return package
+    if cab_size is None:
+        package.error = "not a valid .msu (bad cabinet header)"
+        package.corrupt = True
+        return package
+    if cab_size != package.size:
+        package.error = f"incomplete .msu ({package.size} bytes, cabinet header says {cab_size})"
+        package.corrupt = True
+        return package
+    package.sha256 = digests.get("sha256")
+    if package.expected_sha256 and package.sha256 != package.expected_sha256.lower():
+        package.error = "hash does not match the repository manifest (corrupt or truncated)"
+        package.corrupt = True
+    elif expected_sha1 and digests.get("sha1") != expected_sha1.lower():
+        package.error = "hash does not match the catalog file name (corrupt or truncated)"
+        package.corrupt = True
+    return package
+
+
+def order_packages(packages, metadata=None):
+    """Split packages into install layers
+    
+    Servicing stack updates each get their own leading layer, since later
+    packages may need the newer stack. Everything else forms one final
+    layer that can share DISM calls. metadata (manifest entries by KB)
+    supplies titles, which is how servicing stack updates are recognised.
+    """
+    metadata = metadata or {}
+    for package in packages:
+        info = metadata.get(package.kb) or {}
+        package.title = info.get("Title") or package.title
+
+    ssus = sorted((p for p in packages if p.is_servicing_stack), key=lambda p: p.name)
+    layers = [[p] for p in ssus]
+    remaining = sorted((p for p in packages if not p.is_servicing_stack), key=lambda p: p.name)
+    if remaining:
+        layers.append(remaining)
+    return layers
+
+
+def dism_add_package_args(paths):
+    """One DISM invocation adding every package in paths"""
+    return (["dism", "/online", "/add-package"]
+            + [f"/packagepath:{path}" for path in paths]
+            + ["/quiet", "/norestart"])
+
+
+class FakeDism:
+    """Stand-in for dism.exe with the run_streaming signature, for use off Windows.
+    
+    Packages whose file name contains one of `fail` make the call fail. Store
+    blobs are named by hash, so given the UpdateStore they are also matched
+    by the KB and original file name in its index.
+    """
+
+    def __init__(self, fail=(), delay=0.0, store=None):
+        self.fail = tuple(fail)
+        self.delay = delay
+        self.store = store
+        self.calls = []
+
+    def _names(self, path):
+        name = os.path.basename(path)
+        entry = self.store.by_hash.get(os.path.splitext(name)[0]) if self.store else None
+        if entry is None:
+            return [name]
+        return [name, entry.get("kb") or "", entry.get("name") or ""]
+
+    def __call__(self, args, on_line=None, timeout=3600):
+        paths = [a.split(":", 1)[1] for a in args if a.lower().startswith("/packagepath:")]
+        self.calls.append(paths)
+        time.sleep(self.delay * len(paths))
+        failed = [p for p in paths
+                  if any(f in name for f in self.fail for name in self._names(p))]
+        if failed:
+            message = f"Error: 0x800f081e The package {os.path.basename(failed[0])} is not applicable"
+            if on_line:
+                on_line("stdout", message)
+            return message, "", 2
+        if on_line:
+            on_line("stdout", "The operation completed successfully.")
+        return "The operation completed successfully.", "", 0
+
+
+class OfflineInstallPipeline:
+    """Validate, order and install the .msu files of an offline repo
+    
+    Validation hashes every package on a thread pool, reusing verify_cache
+    results for files that have not changed. Installation runs the
+    ordered layers one after another, with each layer batched into as few
+    DISM calls as possible. A failed batch is retried one package at a time
+    so only the bad package is reported.
+    """
+
+    def __init__(self, packages, metadata=None, dism_runner=None, workers=None,
+                 log=None, on_line=None, stop_event=None, verify_cache=None):
+        # Paths or MsuPackage objects
+        self.paths = list(packages)
+        self.metadata = metadata or {}
+        self.verify_cache = verify_cache
+        self.dism_runner = dism_runner or run_streaming
+        self.workers = workers or min(8, (os.cpu_count() or 2) + 2)
+        self.log = log or (lambda message, level="info": None)
+        self.on_line = on_line
+        self.stop_event = stop_event or threading.Event()
+        self.packages = []
+
+    def validate(self):
+        """Inspect all packages concurrently; returns the valid ones"""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            self.packages = list(pool.map(
+                bind_token(lambda package: inspect_package(package, self.verify_cache)),
+                self.paths))
+        if self.verify_cache:
+            self.verify_cache.save()
+        for package in self.packages:
+            if not package.valid:
+                self.log(f"Skipping {package.name}: {package.error}", "error")
+        return [p for p in self.packages if p.valid]
+
+    def _run_dism(self, batch):
+        started = time.monotonic()
+        out, err, code = self.dism_runner(
+            dism_add_package_args([p.path for p in batch]),
+            on_line=self.on_line,
+            timeout=DISM_PACKAGE_TIMEOUT * len(batch)
+        )
+        ok = code in DISM_SUCCESS_CODES
+        phase = current_phase()
+        if phase:
+            share = (time.monotonic() - started) / len(batch)
+            for package in batch:
+                phase.add_package(package.name, share, ok, batch=len(batch))
+        return ok, err
+
+    def install(self, progress=None):
+        """Install all valid packages; returns (installed, failed) package lists"""
+        valid = self.validate()
+        layers = order_packages(valid, self.metadata)
+        installed, failed = [], []
+        total = len(valid)
+
+        for layer in layers:
+            for start in range(0, len(layer), DISM_MAX_BATCH):
+                if self.stop_event.is_set() or cancel_requested():
+                    return installed, failed
+                batch = layer[start:start + DISM_MAX_BATCH]
+                names = ", ".join(p.name for p in batch)
+                self.log(f"Installing {names}...")
+                ok, err = self._run_dism(batch)
+                if ok:
+                    installed.extend(batch)
+                elif len(batch) == 1:
+                    self.log(f"Failed to install {batch[0].name}", "error")
+                    failed.extend(batch)
+                else:
+                    self.log("Batch install failed, retrying packages individually", "warning")
+                    for package in batch:
+                        if self.stop_event.is_set() or cancel_requested():
+                            return installed, failed
+                        ok, err = self._run_dism([package])
+                        if ok:
+                            installed.append(package)
+                        else:
+                            self.log(f"Failed to install {package.name}", "error")
+                            failed.append(package)
+                if progress:
+                    progress(len(installed) + len(failed), total)
+        return installed, failed
+
+# ---------- Content-Addressed Update Store ----------
+STORE_DIR = "Store"
+STORE_INDEX_FILE = "index.jsonl"
+
+
+def normalize_kb(kb):
+    """'5034441', 'kb5034441' -> 'KB5034441' (None for empty)"""
+    kb = str(kb or "").strip().upper()
+    if not kb:
+        return None
+    return kb if kb.startswith("KB") else f"KB{kb}"
+
+
+def file_sha256(path):
+    return hash_file(path, "sha256")
+
+
+class UpdateStore:
+    """Packages stored under their SHA-256 with an append-only JSONL index
+    
+    Blobs live at Store/blobs/<aa>/<sha256>.msu. Every add or removal appends
+    one line to Store/index.jsonl; the in-memory index is rebuilt by replaying
+    it and gives O(1) lookups by KB and by hash. The log is compacted once it
+    is mostly superseded lines.
+    """
+
+    def __init__(self, repo_path, log=None):
+        self.root = os.path.join(repo_path, STORE_DIR)
+        self.log = log or (lambda message, level="info": None)
+        self.blob_dir = os.path.join(self.root, "blobs")
+        self.index_path = os.path.join(self.root, STORE_INDEX_FILE)
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.by_hash = {}
+        self.by_kb = {}
+        self._log_lines = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._log_lines += 1
+                    self._apply(record)
+        except OSError:
+            pass
+
+    def _apply(self, record):
+        op = record.pop("op", "add")
+        sha256 = record.get("sha256")
+        if op == "add":
+            self.by_hash[sha256] = record
+            if record.get("kb"):
+                self.by_kb[record["kb"]] = record
+        elif op == "remove":
+            entry = self.by_hash.pop(sha256, None)
+            if entry and self.by_kb.get(entry.get("kb")) is entry:
+                del self.by_kb[entry["kb"]]
+
+    def _append(self, record):
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+        self._log_lines += 1
+        if self._log_lines > 2 * len(self.by_hash) + 64:
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the index with one line per live entry"""
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in self.by_hash.values():
+                f.write(json.dumps(dict(entry, op="add")) + "\n")
+        os.replace(tmp_path, self.index_path)
+        self._log_lines = len(self.by_hash)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blob_dir, sha256[:2], f"{sha256}.msu")
+
+    def get(self, kb):
+        """Index entry for a KB, or None"""
+        return self.by_kb.get(normalize_kb(kb))
+
+    def has_kb(self, kb):
+        return normalize_kb(kb) in self.by_kb
+
+    def entries(self):
+        with self._lock:
+            return list(self.by_hash.values())
+
+    def add_file(self, path, kb=None, title=None, move=True, sha256=None):
+        """Store a downloaded package; returns (entry, added)
+        
+        A package whose hash is already stored is not copied again.
+        """
+        name = os.path.basename(path)
+        kb = normalize_kb(kb)
+        if not kb:
+            match = KB_PATTERN.search(name)
+            kb = f"KB{match.group(1)}" if match else None
+        sha256 = sha256 or file_sha256(path)
+        with self._lock:
+            existing = self.by_hash.get(sha256)
+            if existing and os.path.exists(self.blob_path(sha256)):
+                if move:
+                    os.remove(path)
+                return existing, False
+            target = self.blob_path(sha256)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if move:
+                os.replace(path, target)
+            else:
+                shutil.copyfile(path, target)
+            entry = {
+                "kb": kb,
+                "title": title or name,
+                "name": name,
+                "size": os.path.getsize(target),
+                "sha256": sha256,
+                "downloaded": time.strftime("%Y-%m-%dT%H:%M:%S")
+            }
+            self._apply(dict(entry, op="add"))
+            self._append(dict(entry, op="add"))
+            return entry, True
+
+    def remove(self, sha256, archive_dir=None):
+        """Drop a blob and its index entry, or move the blob to archive_dir
+        
+        Returns False, keeping the entry, if the blob could not be removed.
+        """
+        with self._lock:
+            entry = self.by_hash.get(sha256)
+            if entry is None:
+                return False
+            try:
+                if archive_dir:
+                    os.makedirs(archive_dir, exist_ok=True)
+                    shutil.move(self.blob_path(sha256),
+                                os.path.join(archive_dir, entry.get("name") or f"{sha256}.msu"))
+                else:
+                    os.remove(self.blob_path(sha256))
+            except FileNotFoundError:
+                # Already gone; only the index entry is left to drop
+                pass
+            except OSError as e:
+                self.log(f"Could not remove {entry.get('name') or sha256}: {e}", "error")
+                return False
+            self._apply({"op": "remove", "sha256": sha256})
+            self._append({"op": "remove", "sha256": sha256})
+            return True
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def ingest_directory(self, directory, titles=None):
+        """Move loose .msu files from directory into the store
+        
+        titles maps KB to update title. Returns (added, duplicates) counts.
+        """
+        titles = titles or {}
+        added = duplicates = 0
+        try:
+            names = [n for n in os.listdir(directory) if n.lower().endswith('.msu')]
+        except OSError:
+            return 0, 0
+        for name in names:
+            match = KB_PATTERN.search(name)
+            kb = f"KB{match.group(1)}" if match else None
+            _, is_new = self.add_file(os.path.join(directory, name), kb=kb, title=titles.get(kb))
+            if is_new:
+                added += 1
+            else:
+                duplicates += 1
+        return added, duplicates
+
+# ---------- Update Manifest Journal ----------
+MANIFEST_FILE = "updates_manifest.json"
+MANIFEST_JOURNAL_FILE = "updates_manifest.jsonl"
+MANIFEST_STATES = ("discovered", "downloaded", "verified", "installed", "failed", "superseded")
+# States a rescan does not reset to discovered
+PENDING_STATES = ("downloaded", "verified", "failed")
+
+
+class UpdateManifest:
+    """Per-update state kept as a snapshot plus an append-only journal
+    
+    Every state change (discovered, downloaded, verified, installed, failed)
+    appends one numbered line to updates_manifest.jsonl; recording a state an
+    update is already in with the same fields writes nothing, and neither
+    does rediscovering one that is already downloaded or failed. Once the
+    journal is mostly superseded lines it is folded into the
+    updates_manifest.json snapshot and truncated. Lines already covered by
+    the snapshot's sequence number are skipped on load, so a crash between
+    the two writes loses nothing.
+    
+    Entries use the scan's field names (Title, KB, Size, ...) plus State,
+    Changed, Error and States, the last time each state was reached.
+    on_events(events) sees each batch of journal events once written.
+    """
+
+    def __init__(self, repo_path, on_events=None):
+        self.path = os.path.join(repo_path, MANIFEST_FILE)
+        self.on_events = on_events
+        self.journal_path = os.path.join(repo_path, MANIFEST_JOURNAL_FILE)
+        self.entries = {}
+        self._seq = 0
+        self._journal_lines = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            snapshot = {}
+        if isinstance(snapshot, list):
+            # Manifests written before the journal were a bare list of scan results
+            snapshot = {"seq": 0, "updates": [dict(u, State="discovered")
+                                              for u in snapshot if isinstance(u, dict)]}
+        elif not isinstance(snapshot, dict):
+            snapshot = {}
+        for entry in snapshot.get("updates") or []:
+            key = self._key(entry)
+            if key:
+                self.entries[key] = entry
+        self._seq = snapshot.get("seq") or 0
+
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._journal_lines += 1
+                    if event.get("seq", 0) > self._seq:
+                        self._seq = event["seq"]
+                        self._apply(event)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _key(fields):
+        return normalize_kb(fields.get("KB")) or fields.get("Title")
+
+    @staticmethod
+    def _fields(item):
+        """Manifest fields of an UpdateRecord, MsuPackage or dict"""
+        if isinstance(item, UpdateRecord):
+            return item.to_dict()
+        if isinstance(item, MsuPackage):
+            fields = {"Title": item.title, "KB": item.kb}
+            if item.sha256:
+                fields["Sha256"] = item.sha256
+            if item.size:
+                fields["Size"] = item.size
+            if item.error:
+                fields["Error"] = item.error
+            return fields
+        return dict(item)
+
+    def _apply(self, event):
+        fields = {k: v for k, v in event.items() if k not in ("seq", "state", "time")}
+        key = self._key(fields)
+        entry = self.entries.setdefault(key, {})
+        entry.update(fields)
+        if event["state"] != "failed":
+            entry.pop("Error", None)
+        entry["State"] = event["state"]
+        entry["Changed"] = event["time"]
+        entry.setdefault("States", {})[event["state"]] = event["time"]
+
+    def _redundant(self, state, fields):
+        entry = self.entries.get(self._key(fields))
+        if entry is None:
+            return False
+        if state == "discovered" and entry.get("State") in PENDING_STATES:
+            # A scan still offering an update that is on its way in is not news
+            return True
+        return (entry.get("State") == state
+                and all(entry.get(k) == v for k, v in fields.items()))
+
+    def record(self, state, items, error=None):
+        """Journal that items reached state; returns the number of changes written
+        
+        items are UpdateRecords, MsuPackages or dicts with manifest field names.
+        """
+        if state not in MANIFEST_STATES:
+            raise ValueError(f"Unknown update state: {state}")
+        now = time.strftime("%Y-%m-%dT%H:%M:%S")
+        with self._lock:
+            events = []
+            for item in items:
+                fields = self._fields(item)
+                if fields.get("KB"):
+                    fields["KB"] = normalize_kb(fields["KB"])
+                if error and "Error" not in fields:
+                    fields["Error"] = error
+                if not self._key(fields) or self._redundant(state, fields):
+                    continue
+                self._seq += 1
+                event = dict(fields, seq=self._seq, state=state, time=now)
+                self._apply(event)
+                events.append(event)
+            if not events:
+                return 0
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write("".join(json.dumps(e) + "\n" for e in events))
+            self._journal_lines += len(events)
+            if self._journal_lines > 2 * len(self.entries) + 64:
+                self._compact()
+        if self.on_events:
+            self.on_events(events)
+        return len(events)
+
+    def _compact(self):
+        """Fold the journal into the snapshot and truncate it"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"seq": self._seq, "updates": list(self.entries.values())}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        open(self.journal_path, 'w').close()
+        self._journal_lines = 0
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def get(self, kb):
+        """Manifest entry for a KB, or None"""
+        with self._lock:
+            entry = self.entries.get(normalize_kb(kb))
+            return dict(entry) if entry else None
+
+    def metadata(self):
+        """Entries keyed by KB, used to order offline packages"""
+        with self._lock:
+            return {key: dict(e) for key, e in self.entries.items() if e.get("KB")}
+
+    def history(self, state=None, limit=None):
+        """Entries most recently changed first, optionally only those in state"""
+        with self._lock:
+            entries = [dict(e) for e in self.entries.values()
+                       if state is None or e.get("State") == state]
+        entries.sort(key=lambda e: e.get("Changed") or "", reverse=True)
+        return entries[:limit] if limit else entries
+
+# ---------- Update History Store ----------
+HISTORY_DB_FILE = "history.sqlite3"
+HISTORY_PAGE_SIZE = 50
+# Outcomes older than this are pruned when the database is opened
+HISTORY_RETENTION_DAYS = 2 * 365
+
+HISTORY_SCHEMA = textwrap.dedent("""
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        operation TEXT NOT NULL,
+        started REAL NOT NULL,
+        seconds REAL,
+        ok INTEGER,
+        bytes INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS outcomes (
+        id INTEGER PRIMARY KEY,
+        run_id INTEGER REFERENCES runs(id),
+        kb TEXT,
+        title TEXT,
+        status TEXT NOT NULL,
+        time REAL NOT NULL,
+        seconds REAL,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS outcomes_kb ON outcomes(kb, time);
+    CREATE INDEX IF NOT EXISTS outcomes_status ON outcomes(status, time);
+    CREATE INDEX IF NOT EXISTS outcomes_time ON outcomes(time);
+    CREATE INDEX IF NOT EXISTS outcomes_run ON outcomes(run_id);
+    CREATE INDEX IF NOT EXISTS runs_started ON runs(operation, started);
+""")
+
+
+def _sqlite_errors():
+    """Exception types raised by a failed history query; sqlite3 loads on first use"""
+    import sqlite3
+    return (sqlite3.Error, OSError)
+
+def _manifest_time(text):
+    """Epoch seconds of a manifest "Changed" timestamp (local time)"""
+    try:
+        return time.mktime(time.strptime(text, "%Y-%m-%dT%H:%M:%S"))
+    except (TypeError, ValueError, OverflowError):
+        return time.time()
+
+
+class UpdateHistory:
+    """SQLite history of every operation and each update's outcomes
+    
+    runs has one row per top-level telemetry phase (check, download,
+    install, ...) with its duration and result. outcomes has one row per
+    manifest state change, linked to the run it happened in, with the
+    package's DISM time where one was measured. Outcomes are indexed by KB,
+    status and time, so questions over months of history stay instant.
+    
+    The database is opened on first use; a new one is seeded from the
+    manifest (seed() returns its entries) so earlier updates are not lost.
+    on_change() is called after every write. Failed writes are dropped:
+    the history never stops an update.
+    """
+
+    def __init__(self, path, seed=None, on_change=None):
+        self.path = path
+        self.seed = seed
+        self.on_change = on_change
+        self._conn = None
+        self._lock = threading.Lock()
+        # id(root phase) -> run id, for runs whose phase is still going
+        self._open_runs = {}
+
+    def _connection(self, pending=()):
+        """Open the database; a new one is seeded with the manifest minus pending events"""
+        if self._conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(HISTORY_SCHEMA)
+            conn.execute("DELETE FROM outcomes WHERE time < ?",
+                         (time.time() - HISTORY_RETENTION_DAYS * 86400,))
+            if self.seed and conn.execute("SELECT 1 FROM outcomes LIMIT 1").fetchone() is None:
+                # The manifest has already applied the events being written
+                skip = {(UpdateManifest._key(e), e["state"], e.get("time")) for e in pending}
+                conn.executemany(
+                    "INSERT INTO outcomes (kb, title, status, time, error) VALUES (?, ?, ?, ?, ?)",
+                    [(normalize_kb(e.get("KB")), e.get("Title"), state, _manifest_time(changed),
+                      e.get("Error") if state == "failed" else None)
+                     for e in self.seed()
+                     for state, changed in sorted((e.get("States") or {}).items(),
+                                                  key=lambda item: item[1])
+                     if (UpdateManifest._key(e), state, changed) not in skip]
+                )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _write(self, func, pending=()):
+        try:
+            with self._lock:
+                conn = self._connection(pending)
+                result = func(conn)
+                conn.commit()
+        except _sqlite_errors():
+            return None
+        if self.on_change:
+            try:
+                self.on_change()
+            except Exception:
+                pass
+        return result
+
+    def _read(self, sql, params, default):
+        try:
+            with self._lock:
+                return self._connection().execute(sql, params).fetchall()
+        except _sqlite_errors():
+            return default
+
+    @staticmethod
+    def _root(phase):
+        while phase is not None and phase.parent is not None:
+            phase = phase.parent
+        return phase
+
+    def _run_id(self, conn, root):
+        """Run row of a top-level phase, inserted while it is still going"""
+        if root is None:
+            return None
+        run_id = self._open_runs.get(id(root))
+        if run_id is None:
+            run_id = conn.execute("INSERT INTO runs (operation, started) VALUES (?, ?)",
+                                  (root.name, root.start)).lastrowid
+            self._open_runs[id(root)] = run_id
+        return run_id
+
+    def add_outcomes(self, events, phase=None):
+        """Store manifest journal events, linked to phase's run (default: the current one)"""
+        root = self._root(phase or current_phase())
+
+        def write(conn):
+            run_id = self._run_id(conn, root)
+            conn.executemany(
+                "INSERT INTO outcomes (run_id, kb, title, status, time, error)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(run_id, normalize_kb(e.get("KB")), e.get("Title"), e["state"],
+                  _manifest_time(e.get("time")), e.get("Error")) for e in events]
+            )
+        self._write(write, events)
+
+    def record_run(self, phase):
+        """Store a finished top-level phase, with its per-package install times"""
+        def write(conn):
+            run_id = self._open_runs.pop(id(phase), None)
+            fields = (phase.seconds, None if phase.ok is None else int(bool(phase.ok)),
+                      phase.bytes)
+            if run_id is None:
+                run_id = conn.execute(
+                    "INSERT INTO runs (operation, started, seconds, ok, bytes)"
+                    " VALUES (?, ?, ?, ?, ?)", (phase.name, phase.start) + fields).lastrowid
+            else:
+                conn.execute("UPDATE runs SET seconds = ?, ok = ?, bytes = ? WHERE id = ?",
+                             fields + (run_id,))
+            for package in phase.packages:
+                match = KB_PATTERN.search(package["name"])
+                if match:
+                    conn.execute(
+                        "UPDATE outcomes SET seconds = ? WHERE run_id = ? AND kb = ?"
+                        " AND status IN ('installed', 'failed') AND seconds IS NULL",
+                        (package["seconds"], run_id, f"KB{match.group(1)}"))
+        self._write(write)
+
+    @staticmethod
+    def _filters(kb, status, since):
+        clauses, params = [], []
+        if kb:
+            clauses.append("o.kb = ?")
+            params.append(normalize_kb(kb))
+        if status:
+            clauses.append("o.status = ?")
+            params.append(status)
+        if since is not None:
+            clauses.append("o.time >= ?")
+            params.append(since)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def query(self, kb=None, status=None, since=None, limit=HISTORY_PAGE_SIZE, offset=0):
+        """Outcome dicts, newest first, each with the operation it happened in
+        
+        since is in epoch seconds; limit and offset page through the results.
+        """
+        where, params = self._filters(kb, status, since)
+        rows = self._read(
+            "SELECT o.kb, o.title, o.status, o.time, o.seconds, o.error, r.operation"
+            " FROM outcomes o LEFT JOIN runs r ON r.id = o.run_id" + where +
+            " ORDER BY o.time DESC, o.id DESC LIMIT ? OFFSET ?",
+            params + [limit, offset], [])
+        return [dict(row) for row in rows]
+
+    def count(self, kb=None, status=None, since=None):
+        where, params = self._filters(kb, status, since)
+        rows = self._read("SELECT COUNT(*) FROM outcomes o" + where, params, [(0,)])
+        return rows[0][0]
+
+    def kbs(self, status=None, since=None):
+        """Distinct KBs with a matching outcome, e.g. those that failed in the last 90 days"""
+        where, params = self._filters(None, status, since)
+        clause = " AND o.kb IS NOT NULL" if where else " WHERE o.kb IS NOT NULL"
+        rows = self._read("SELECT DISTINCT o.kb FROM outcomes o" + where + clause +
+                          " ORDER BY o.kb", params, [])
+        return [row[0] for row in rows]
+
+    def runs(self, operation=None, since=None, limit=HISTORY_PAGE_SIZE, offset=0):
+        """Run dicts, newest first"""
+        clauses, params = [], []
+        if operation:
+            clauses.append("operation = ?")
+            params.append(operation)
+        if since is not None:
+            clauses.append("started >= ?")
+            params.append(since)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        rows = self._read("SELECT * FROM runs" + where +
+                          " ORDER BY started DESC LIMIT ? OFFSET ?", params + [limit, offset], [])
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+# ---------- Supersedence ----------
+# "2024-01 Cumulative Update for Windows 11 Version 23H2 for x64-based Systems (KB5034123)"
+DATED_TITLE_PATTERN = re.compile(r"^\s*(\d{4})-(\d{2})\s+(.*?)\s*\(KB(\d+)\)\s*$", re.IGNORECASE)
+# Kinds of update where each month's release replaces the previous one
+CUMULATIVE_PATTERN = re.compile(
+    r"cumulative update|monthly (quality )?rollup|servicing stack update", re.IGNORECASE
+)
+
+
+def update_family(title):
+    """(family, release) of a dated cumulative update title, or None
+    
+    The family is the title without its date and KB, so releases of the
+    same product line compare by (year, month, KB number).
+    """
+    match = DATED_TITLE_PATTERN.match(title or "")
+    if not match or not CUMULATIVE_PATTERN.search(match.group(3)):
+        return None
+    year, month, family, kb = match.groups()
+    return " ".join(family.lower().split()), (int(year), int(month), int(kb))
+
+
+def supersedence_graph(packages):
+    """{superseded KB: superseding KB} among packages
+    
+    packages are dicts with "kb", "title" and optionally "supersedes" (a KB
+    list, from the scan's SupersededUpdateIDs). Explicit supersedes lists
+    are used as given; on top of that the newest release of each dated
+    cumulative family supersedes the older ones. Only packages in the list
+    can supersede each other, so nothing is dropped before its replacement
+    is present.
+    """
+    present = {normalize_kb(p.get("kb")) for p in packages} - {None}
+    graph = {}
+    newest = {}
+    for package in packages:
+        kb = normalize_kb(package.get("kb"))
+        if not kb:
+            continue
+        for old in package.get("supersedes") or ():
+            old = normalize_kb(old)
+            if old in present and old != kb:
+                graph[old] = kb
+        family = update_family(package.get("title"))
+        if family:
+            name, release = family
+            newest.setdefault(name, []).append((release, kb))
+    for releases in newest.values():
+        releases.sort()
+        latest = releases[-1][1]
+        for _, kb in releases[:-1]:
+            graph.setdefault(kb, latest)
+
+    # Follow chains to the final replacement; a cycle leaves its members alone
+    resolved = {}
+    for kb in graph:
+        seen, target = {kb}, graph[kb]
+        while target in graph and target not in seen:
+            seen.add(target)
+            target = graph[target]
+        if target not in seen:
+            resolved[kb] = target
+    return resolved
+
+# ---------- Package Downloader ----------
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+DOWNLOAD_BLOCK_SIZE = 256 * 1024
+DOWNLOAD_USER_AGENT = "SamsoftUpdateManager/1.0"
+
+# Microsoft catalog file names end in the SHA-1 of their content
+CATALOG_SHA1_PATTERN = re.compile(r"_([0-9a-f]{40})\.(?:msu|cab|exe)$", re.IGNORECASE)
+
+
+def _http_errors():
+    """Exception types raised by a failed HTTP request
+
+    urllib.request and http.client pull in ssl and email, so they are only
+    imported once something is actually downloaded.
+    """
+    import http.client
+    import urllib.error
+    return (urllib.error.URLError, http.client.HTTPException, OSError)
+
+
+class DownloadError(Exception):
+    """A download failed or did not match its expected hash"""
+
+
+class _OrderedHasher:
+    """Hashes a partially written file front to back as chunks complete
+    
+    A chunk_size of None means a single chunk running to end of file.
+    """
+
+    def __init__(self, path, chunk_size, chunk_count, hash_names):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.chunk_count = chunk_count
+        self.hashes = {name: hashlib.new(name) for name in hash_names}
+        self.done = set()
+        self.next_chunk = 0
+        self._lock = threading.Lock()
+
+    def chunk_done(self, index):
+        with self._lock:
+            self.done.add(index)
+            if self.next_chunk not in self.done:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self.next_chunk * (self.chunk_size or 0))
+                while self.next_chunk in self.done:
+                    remaining = self.chunk_size or float("inf")
+                    while remaining:
+                        block = f.read(int(min(DOWNLOAD_BLOCK_SIZE, remaining)))
+                        if not block:
+                            break
+                        for digest in self.hashes.values():
+                            digest.update(block)
+                        remaining -= len(block)
+                    self.next_chunk += 1
+
+    def hexdigest(self, name):
+        return self.hashes[name].hexdigest()
+
+
+class PackageDownloader:
+    """Resumable HTTP downloader with range-request chunking
+    
+    Files are fetched in chunk_size ranges over up to connections_per_host
+    parallel connections per server. Progress is kept in a "<dest>.part.json"
+    sidecar, so an interrupted download resumes with the chunks still
+    missing. The file is hashed while later chunks are still in flight.
+    """
+
+    def __init__(self, connections_per_host=4, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                 timeout=60, retries=3, stop_event=None):
+        self.connections_per_host = connections_per_host
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.retries = retries
+        self.stop_event = stop_event or threading.Event()
+        self._host_slots = {}
+        self._slots_lock = threading.Lock()
+
+    def _stopped(self):
+        return self.stop_event.is_set() or cancel_requested()
+
+    def _slot(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self._slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.connections_per_host)
+            return self._host_slots[host]
+
+    def _open(self, url, start=None, end=None, method="GET"):
+        import urllib.request
+        request = urllib.request.Request(url, method=method,
+                                         headers={"User-Agent": DOWNLOAD_USER_AGENT})
+        if start is not None:
+            request.add_header("Range", f"bytes={start}-{end}")
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def probe(self, url):
+        """Return (size, supports_ranges, etag) for url"""
+        with self._slot(url):
+            try:
+                with self._open(url, 0, 0) as resp:
+                    etag = resp.headers.get("ETag")
+                    content_range = resp.headers.get("Content-Range", "")
+                    if resp.status == 206 and "/" in content_range:
+                        total = content_range.rsplit("/", 1)[1]
+                        if total.isdigit():
+                            return int(total), True, etag
+                    length = resp.headers.get("Content-Length")
+                    return (int(length) if length and length.isdigit() else None), False, etag
+            except _http_errors() as e:
+                raise DownloadError(f"Cannot reach {url}: {e}")
+
+    def _load_state(self, state_path, url, size, etag):
+        try:
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (state.get("url") != url or state.get("size") != size
+                or state.get("etag") != etag or state.get("chunk_size") != self.chunk_size):
+            return None
+        return state
+
+    def _save_state(self, state_path, state):
+        tmp_path = state_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, state_path)
+
+    def _fetch(self, url, part_path, start, end, ranged, on_bytes):
+        throttle = current_throttle()
+        last_error = None
+        for attempt in range(self.retries):
+            if self._stopped():
+                raise DownloadError("Download cancelled")
+            written = 0
+            try:
+                with self._slot(url):
+                    with self._open(url, start if ranged else None, end) as resp:
+                        if ranged and resp.status != 206:
+                            raise DownloadError("Server ignored the range request")
+                        with open(part_path, 'r+b') as f:
+                            f.seek(start)
+                            while True:
+                                if self._stopped():
+                                    raise DownloadError("Download cancelled")
+                                block = resp.read(DOWNLOAD_BLOCK_SIZE)
+                                if not block:
+                                    break
+                                f.write(block)
+                                written += len(block)
+                                on_bytes(len(block))
+                                if throttle:
+                                    throttle.consume(len(block))
+                if end is not None and written != end - start + 1:
+                    raise DownloadError(f"Short read ({written} of {end - start + 1} bytes)")
+                return
+            except _http_errors() as e:
+                last_error = e
+            except DownloadError as e:
+                if self._stopped():
+                    raise
+                last_error = e
+            on_bytes(-written)
+            time.sleep(min(2 ** attempt, 10))
+        raise DownloadError(f"Failed to download {url}: {last_error}")
+
+    def download(self, url, dest, expected_hash=None, hash_name="sha256", progress=None):
+        """Download url to dest; returns {"path", "size", "sha256", "resumed"}
+        
+        expected_hash is checked with hashlib algorithm hash_name. progress is
+        called as progress(bytes_done, total_bytes) from worker threads.
+        """
+        started = time.monotonic()
+        phase = current_phase()
+        size, ranged, etag = self.probe(url)
+        ranged = ranged and bool(size)
+        part_path = dest + ".part"
+        state_path = dest + ".part.json"
+
+        # Without range support the whole body is one chunk of unknown length
+        chunk_size = self.chunk_size if ranged else None
+        chunk_count = -(-size // chunk_size) if ranged else 1
+        state = self._load_state(state_path, url, size, etag) if ranged else None
+        resumed = bool(state and state.get("done")) and os.path.exists(part_path)
+        if not resumed:
+            state = {"url": url, "size": size, "etag": etag,
+                     "chunk_size": self.chunk_size, "done": []}
+            os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+            with open(part_path, 'wb') as f:
+                if size:
+                    f.truncate(size)
+
+        hasher = _OrderedHasher(part_path, chunk_size, chunk_count, {"sha256", hash_name})
+        done = set(state["done"]) if ranged else set()
+        counter = {"bytes": 0}
+        counter_lock = threading.Lock()
+        first_byte = threading.Event()
+
+        def on_bytes(n):
+            with counter_lock:
+                counter["bytes"] += n
+                current = counter["bytes"]
+            if progress:
+                progress(current, size)
+
+        def on_fetched(n):
+            if phase and n > 0 and not first_byte.is_set():
+                first_byte.set()
+                phase.note_first_output(time.monotonic() - started)
+            on_bytes(n)
+
+        for index in sorted(done):
+            on_bytes(min(chunk_size, size - index * chunk_size))
+            hasher.chunk_done(index)
+        resumed_bytes = counter["bytes"]
+
+        def fetch_chunk(index):
+            if ranged:
+                start = index * chunk_size
+                end = min(start + chunk_size, size) - 1
+            else:
+                start, end = 0, None
+            self._fetch(url, part_path, start, end, ranged, on_fetched)
+            hasher.chunk_done(index)
+            if ranged:
+                with counter_lock:
+                    state["done"].append(index)
+                    self._save_state(state_path, state)
+
+        missing = [i for i in range(chunk_count) if i not in done]
+        with ThreadPoolExecutor(max_workers=max(1, min(self.connections_per_host, len(missing) or 1))) as pool:
+            for future in [pool.submit(bind_token(fetch_chunk), index) for index in missing]:
+                future.result()
+
+        if expected_hash and hasher.hexdigest(hash_name).lower() != expected_hash.lower():
+            for path in (part_path, state_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            raise DownloadError(f"Hash mismatch for {os.path.basename(dest)}")
+
+        os.replace(part_path, dest)
+        try:
+            os.remove(state_path)
+        except OSError:
+            pass
+        if phase:
+            phase.add_bytes(counter["bytes"] - resumed_bytes)
+        return {"path": dest, "size": os.path.getsize(dest),
+                "sha256": hasher.hexdigest("sha256"), "resumed": resumed}
+
+
+def catalog_expected_hash(url):
+    """(hexdigest, hash_name) embedded in a catalog file name, or (None, "sha256")"""
+    match = CATALOG_SHA1_PATTERN.search(urllib.parse.urlsplit(url).path)
+    return (match.group(1), "sha1") if match else (None, "sha256")
+
+# ---------- Peer Cache ----------
+PEER_CACHE_PORT = 8765
+# Seconds a peer's manifest is trusted before it is fetched again
+PEER_MANIFEST_TTL = 60
+PEER_MANIFEST_TIMEOUT = 5
+PEER_BLOB_PATH = re.compile(r"/blobs/([0-9a-f]{64})")
+PEER_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+def parse_range(header, size):
+    """(start, end) of a single-range "bytes=" header, or "invalid" if it cannot be satisfied
+    
+    None means the whole body: the header is absent, or it is something
+    other than one well-formed range (multiple ranges, another unit,
+    garbage), which RFC 9110 lets a server ignore.
+    """
+    if not header:
+        return None
+    match = PEER_RANGE.fullmatch(header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if not length:
+            return "invalid"
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return "invalid"
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+def _peer_handler(server):
+    """Request handler class serving server.store over HTTP"""
+    import http.server
+
+    class PeerCacheHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        server_version = "SamsoftPeerCache/1.0"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_HEAD(self):
+            self._serve(send_body=False)
+
+        def do_GET(self):
+            self._serve(send_body=True)
+
+        def _serve(self, send_body):
+            path = urllib.parse.urlsplit(self.path).path
+            if path == "/manifest":
+                return self._serve_manifest(send_body)
+            match = PEER_BLOB_PATH.fullmatch(path)
+            if match:
+                return self._serve_blob(match.group(1), send_body)
+            self._empty(404)
+
+        def _empty(self, status, headers=()):
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def _serve_manifest(self, send_body):
+            body = json.dumps({"packages": server.store.entries()}).encode("utf-8")
+            etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+            if self.headers.get("If-None-Match") == etag:
+                return self._empty(304, [("ETag", etag)])
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+
+        def _serve_blob(self, sha256, send_body):
+            # Blobs are named by their hash, which makes it a strong ETag
+            etag = f'"{sha256}"'
+            try:
+                f = open(server.store.blob_path(sha256), 'rb')
+            except OSError:
+                return self._empty(404)
+            with f:
+                size = os.fstat(f.fileno()).st_size
+                if self.headers.get("If-None-Match") == etag:
+                    return self._empty(304, [("ETag", etag)])
+                byte_range = parse_range(self.headers.get("Range"), size)
+                if_range = self.headers.get("If-Range")
+                if if_range and if_range != etag:
+                    byte_range = None
+                if byte_range == "invalid":
+                    return self._empty(416, [("Content-Range", f"bytes */{size}")])
+                start, end = byte_range or (0, size - 1)
+                length = end - start + 1 if size else 0
+                self.send_response(206 if byte_range else 200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(length))
+                if byte_range:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                self.end_headers()
+                if not send_body:
+                    return
+                f.seek(start)
+                remaining = length
+                try:
+                    while remaining > 0:
+                        block = f.read(min(DOWNLOAD_BLOCK_SIZE, remaining))
+                        if not block:
+                            break
+                        self.wfile.write(block)
+                        remaining -= len(block)
+                    server.bytes_served += length - remaining
+                except (ConnectionError, OSError):
+                    self.close_connection = True
+
+    return PeerCacheHandler
+
+
+class PeerCacheServer:
+    """Serves a repository's package store to other machines on the LAN
+
+    GET /manifest lists the stored packages (kb, title, name, size, sha256);
+    GET or HEAD /blobs/<sha256> returns one package, with single-range
+    requests, a strong ETag (the hash itself), If-None-Match and If-Range.
+    store may be swapped for another UpdateStore while serving.
+    """
+
+    def __init__(self, store, host="", port=PEER_CACHE_PORT):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.bytes_served = 0
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host = self.host if self.host not in ("", "0.0.0.0") else "127.0.0.1"
+        return f"http://{host}:{self.port}"
+
+    def start(self):
+        """Bind and serve on a background thread; raises OSError if the port is taken"""
+        import http.server
+        self._httpd = http.server.ThreadingHTTPServer((self.host, self.port), _peer_handler(self))
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    @property
+    def running(self):
+        return self._httpd is not None
+
+
+class PeerCacheClient:
+    """Fetches packages from another machine's PeerCacheServer
+
+    Blobs go through the PackageDownloader, so peer downloads are ranged,
+    resumable and checked against the hash the peer advertises.
+    """
+
+    def __init__(self, base_url, downloader, timeout=PEER_MANIFEST_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.downloader = downloader
+        self.timeout = timeout
+        self._packages = None
+        self._fetched = 0
+
+    def packages(self):
+        """The peer's package list, or None if the peer cannot be reached"""
+        if self._packages is not None and time.time() - self._fetched < PEER_MANIFEST_TTL:
+            return self._packages
+        import urllib.request
+        request = urllib.request.Request(self.base_url + "/manifest",
+                                         headers={"User-Agent": DOWNLOAD_USER_AGENT})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+                data = json.loads(resp.read().decode("utf-8"))
+        except _http_errors() + (ValueError,):
+            return None
+        packages = data.get("packages") if isinstance(data, dict) else None
+        if not isinstance(packages, list):
+            return None
+        self._packages = [p for p in packages
+                          if isinstance(p, dict) and PEER_BLOB_PATH.fullmatch(f"/blobs/{p.get('sha256')}")]
+        self._fetched = time.time()
+        return self._packages
+
+    def blob_url(self, sha256):
+        return f"{self.base_url}/blobs/{sha256}"
+
+    def fetch(self, package, dest, progress=None):
+        """Download one package listed by packages(); returns the downloader's result"""
+        return self.downloader.download(self.blob_url(package["sha256"]), dest,
+                                        expected_hash=package["sha256"], progress=progress)
+
+# ---------- Job Scheduler ----------
+JOB_WORKERS = 3
+# Finished jobs kept in the job table
+JOB_HISTORY = 20
+
+# Resources a job can claim; jobs claiming the same resource never overlap
+RESOURCE_SERVICING = "servicing"   # Windows Update, DISM and .NET installs
+RESOURCE_REPO = "repo"             # the repository directory
+
+
+class Job:
+    """One unit of work submitted to a JobScheduler"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name, func, resources=()):
+        self.id = next(self._ids)
+        self.name = name
+        self.func = func
+        self.resources = frozenset(resources)
+        self.token = CancelToken()
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def active(self):
+        return self.state in ("queued", "running")
+
+    def as_row(self):
+        """Plain dict describing the job, for job tables and JSON output"""
+        end = self.finished or time.time()
+        return {"id": self.id, "name": self.name, "state": self.state,
+                "resources": sorted(self.resources), "error": self.error,
+                "elapsed": round(end - self.started, 1) if self.started else 0.0}
+
+
+class JobScheduler:
+    """Bounded worker pool running jobs with per-resource mutual exclusion
+
+    A queued job starts once a worker is free and none of its resources is
+    held by a running job; jobs that are blocked do not hold up later ones
+    that are runnable. Submitting a job whose name matches an active job
+    returns that job instead of queueing a duplicate.
+
+    Each job runs under its own CancelToken, so run_streaming and the
+    PowerShell session kill their child processes when it is cancelled.
+    on_change(job) is called from worker threads whenever a job changes state.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, on_change=None):
+        self.on_change = on_change
+        self._cond = threading.Condition()
+        self._pending = []
+        self._held = set()
+        self._jobs = {}
+        self._closed = False
+        self._threads = [threading.Thread(target=self._worker, daemon=True)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _changed(self, job):
+        if self.on_change:
+            try:
+                self.on_change(job)
+            except Exception:
+                pass
+
+    def submit(self, name, func, resources=()):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Scheduler is shut down")
+            for job in self._jobs.values():
+                if job.name == name and job.active:
+                    return job
+            job = Job(name, func, resources)
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._cond.notify()
+        self._changed(job)
+        return job
+
+    def _next_runnable(self):
+        for job in self._pending:
+            if not job.resources & self._held:
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_runnable()
+                while job is None and not self._closed:
+                    self._cond.wait()
+                    job = self._next_runnable()
+                if self._closed:
+                    return
+                self._pending.remove(job)
+                self._held |= job.resources
+                job.state = "running"
+                job.started = time.time()
+            self._changed(job)
+
+            try:
+                with use_token(job.token):
+                    job.result = job.func()
+                job.state = "cancelled" if job.token.cancelled else "done"
+            except Exception as e:
+                job.error = str(e)
+                job.state = "cancelled" if job.token.cancelled else "failed"
+
+            with self._cond:
+                job.finished = time.time()
+                self._held -= job.resources
+                self._prune()
+                self._cond.notify_all()
+            self._changed(job)
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if not j.active]
+        for job in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del self._jobs[job.id]
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns False if it is not active"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or not job.active:
+                return False
+            if job.state == "queued":
+                self._pending.remove(job)
+                job.state = "cancelled"
+                job.finished = time.time()
+        # A running job stops once its child processes are killed
+        job.token.cancel()
+        self._changed(job)
+        return True
+
+    def cancel_all(self):
+        for job in self.jobs():
+            self.cancel(job.id)
+
+    def jobs(self):
+        """Snapshot of known jobs, oldest first"""
+        with self._cond:
+            return sorted(self._jobs.values(), key=lambda j: j.id)
+
+    def busy(self, name):
+        """Whether a job with this name is queued or running"""
+        return any(j.name == name and j.active for j in self.jobs())
+
+    def shutdown(self, timeout=5):
+        """Cancel everything and wait up to timeout seconds for the workers"""
+        self.cancel_all()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(timeout=max(0, deadline - time.monotonic()))
+
+
+class ProgressReporter:
+    """progress / progress_text / finish_progress callbacks for part of a job"""
+
+    def __init__(self, progress, progress_text=None, finish_progress=None):
+        self.progress = progress
+        self.progress_text = progress_text or (lambda text: None)
+        self.finish_progress = finish_progress or (lambda: progress(0))
+
+
+def progress_span(update, start, end):
+    """Map (done, total) progress events onto the start..end percent range"""
+    def report(done, total):
+        if total:
+            update(int(start + (end - start) * min(done, total) / total))
+    return report
+
+VCREDIST_URLS = (
+    'https://aka.ms/vs/17/release/vc_redist.x64.exe',
+    'https://aka.ms/vs/17/release/vc_redist.x86.exe'
+)
+
+OFFICE_C2R_PATHS = (
+    r"C:\Program Files\Common Files\Microsoft Shared\ClickToRun\OfficeC2RClient.exe",
+    r"C:\Program Files (x86)\Common Files\Microsoft Shared\ClickToRun\OfficeC2RClient.exe"
+)
+
+# Categories of the update_categories config block, in run order
+UPDATE_CATEGORIES = ("windows", "dotnet", "office", "vcredist")
+# Categories installed through the Windows servicing stack, which only
+# runs one install at a time
+SERVICING_CATEGORIES = ("windows", "dotnet")
+CATEGORY_LABELS = {
+    "windows": "Windows Update",
+    "dotnet": ".NET Framework",
+    "office": "Office",
+    "vcredist": "VC++ Redistributables"
+}
+
+# ---------- Update Engine ----------
+class UpdateEngine:
+    """Headless updater backend shared by every front-end
+
+    The engine never touches widgets. It reports through four callbacks,
+    each safe to call from worker threads as long as the front-end's
+    implementation is:
+
+        log(message, level)    level is "info", "warning" or "error"
+        progress(value)        0-100; 0 hides the progress display
+        progress_text(text)    label for the current operation
+        finish_progress()      the operation is done; defaults to progress(0)
+
+    Operations block until done and return their result, so front-ends run
+    them on their own threads.
+    """
+
+    def __init__(self, config=None, log=None, progress=None, progress_text=None,
+                 finish_progress=None, ps_session=None, stop_event=None):
+        self.config = config if config is not None else load_config()
+        self.repo_path = self.config.get("repo_path", REPO_DIR)
+        os.makedirs(self.repo_path, exist_ok=True)
+        self.pswindowsupdate_available = False
+        
+        self._log = log or self._default_log
+        # Front-end callbacks; work under use_reporter() reports elsewhere
+        self._reporter = ProgressReporter(progress or (lambda value: None),
+                                          progress_text, finish_progress)
+        self.stop_event = stop_event or threading.Event()
+        
+        # One PowerShell host serves every backend command
+        self.ps_session = ps_session or PowerShellSession()
+        # DISM runner used by install_offline (FakeDism can stand in for it)
+        self.dism_runner = run_streaming
+        self.scan_cache = ScanCache(self.repo_path, self.config.get("scan_cache_ttl", 1800))
+        self.store = UpdateStore(self.repo_path, log=self.log)
+        self._open_history(self.repo_path)
+        self.verify_cache = VerifyCache(self.repo_path)
+        # Phase timings, written to metrics.jsonl in the repo
+        self.telemetry = Telemetry(os.path.join(self.repo_path, METRICS_FILE),
+                                   store=self.history)
+        self.downloader = PackageDownloader(
+            connections_per_host=self.config.get("download_connections", 4),
+            stop_event=self.stop_event
+        )
+        self.capabilities = CapabilityProbe(self.repo_path, self.run_powershell)
+        self.peer_server = None
+        self._peer_client = None
+
+    @staticmethod
+    def _default_log(message, level="info"):
+        import logging
+        logging.getLogger("samsoft.update").log(
+            logging.ERROR if level == "error" else
+            logging.WARNING if level == "warning" else logging.INFO,
+            message
+        )
+
+    def log(self, message, level="info"):
+        self._log(message, level)
+
+    def progress(self, value):
+        (current_reporter() or self._reporter).progress(value)
+
+    def progress_text(self, text):
+        (current_reporter() or self._reporter).progress_text(text)
+
+    def finish_progress(self):
+        (current_reporter() or self._reporter).finish_progress()
+
+    def set_repo_path(self, path):
+        """Point the engine at another repository"""
+        os.makedirs(path, exist_ok=True)
+        self.repo_path = path
+        self.config["repo_path"] = path
+        self.scan_cache = ScanCache(path, self.config.get("scan_cache_ttl", 1800))
+        self.store = UpdateStore(path, log=self.log)
+        on_change = self.history.on_change
+        self.history.close()
+        self._open_history(path)
+        self.history.on_change = on_change
+        self.verify_cache = VerifyCache(path)
+        self.telemetry = Telemetry(os.path.join(path, METRICS_FILE),
+                                   on_phase=self.telemetry.on_phase, store=self.history)
+        self.capabilities = CapabilityProbe(path, self.run_powershell)
+        if self.peer_server is not None:
+            self.peer_server.store = self.store
+
+    def _open_history(self, path):
+        # Every manifest state change also lands in the SQLite history
+        self.history = UpdateHistory(os.path.join(path, HISTORY_DB_FILE),
+                                     seed=lambda: self.manifest.history())
+        self.manifest = UpdateManifest(path, on_events=self.history.add_outcomes)
+
+    def close(self):
+        self.stop_event.set()
+        self.stop_serving()
+        self.ps_session.close()
+        self.history.close()
+
+    # ---------- Command Execution ----------
+
+    def run_powershell(self, command, capture_output=True, timeout=3600, on_line=None):
+        """Run PowerShell command in the persistent host session
+        
+        With capture_output=False each line is passed to on_line (the log by
+        default) as it arrives and only the last STREAM_TAIL_LINES lines are
+        returned.
+        """
+        if capture_output:
+            return self.ps_session.execute(command, timeout=timeout)
+        return self.ps_session.execute(command, timeout=timeout,
+                                       on_line=on_line or self.log_output_line,
+                                       tail_lines=STREAM_TAIL_LINES)
+
+    def log_output_line(self, stream, text):
+        """Forward one line of command output to the log"""
+        if text.strip():
+            self.log(text, classify_output_line(text, stream))
+
+    def kb_progress_watcher(self, updates, verb, report):
+        """on_line callback that logs output and reports (done, total) as
+        lines containing verb mention each update's KB for the first time"""
+        pending = {u.kb for u in updates or []} - {None}
+        total = len(pending)
+        
+        def on_line(stream, text):
+            self.log_output_line(stream, text)
+            if stream != "stdout" or verb.lower() not in text.lower():
+                return
+            upper = text.upper()
+            for kb in [kb for kb in pending if kb in upper]:
+                pending.discard(kb)
+                report(total - len(pending), total)
+        
+        return on_line
+
+    # ---------- PSWindowsUpdate Module ----------
+
+    def check_pswindowsupdate(self):
+        """Check if PSWindowsUpdate module is available"""
+        self.log("Checking for PSWindowsUpdate module...")
+        capabilities = self.capabilities.get() or {}
+        module = capabilities.get("PSWindowsUpdate")
+        
+        if not module:
+            self.log("PSWindowsUpdate module not found")
+            self.pswindowsupdate_available = False
+        else:
+            self.pswindowsupdate_available = True
+            self.log(f"PSWindowsUpdate module is available (version {module.get('Version')})")
+        return self.pswindowsupdate_available
+
+    def ensure_module(self):
+        """Ensure PSWindowsUpdate module is installed"""
+        if self.pswindowsupdate_available:
+            return True
+        
+        cached = self.capabilities.cached() or {}
+        if cached.get("PSWindowsUpdate"):
+            self.pswindowsupdate_available = True
+            return True
+        return self._provision_module()
+
+    @timed_phase("ensure_module", ok=bool)
+    def _provision_module(self):
+        """Probe for PSWindowsUpdate and install it if it is missing"""
+        # A negative cached result may be out of date; probe before installing
+        capabilities = self.capabilities.probe() or {}
+        if capabilities.get("PSWindowsUpdate"):
+            self.pswindowsupdate_available = True
+            return True
+        
+        self.log("Installing PSWindowsUpdate module...")
+        
+        # Trust PSGallery, add NuGet only if the probe did not find it, then
+        # install the module, all in one request
+        nuget_cmd = "" if capabilities.get("NuGet") else \
+            "Install-PackageProvider -Name NuGet -MinimumVersion 2.8.5.201 -Force -ErrorAction SilentlyContinue | Out-Null"
+        install_cmd = textwrap.dedent(f"""
+            Set-PSRepository -Name PSGallery -InstallationPolicy Trusted -ErrorAction SilentlyContinue
+            {nuget_cmd}
+            $ErrorActionPreference = 'Stop'
+            try {{
+                Install-Module PSWindowsUpdate -Force -Scope AllUsers -AllowClobber
+                Write-Output "PSWindowsUpdate installed successfully"
+            }} catch {{
+                Write-Error $_.Exception.Message
+                exit 1
+            }}
+        """)
+        
+        out, err, code = self.run_powershell(install_cmd)
+        
+        if out:
+            self.log(out)
+        
+        if code != 0 or (err and "error" in err.lower()):
+            self.log(f"Failed to install module: {err if err else 'Unknown error'}", "error")
+            return False
+        
+        self.capabilities.refresh_async()
+        self.pswindowsupdate_available = True
+        self.log("PSWindowsUpdate module installed successfully")
+        return True
+
+    # ---------- Scanning ----------
+
+    def scan_updates(self, category="all", force=False, source="MicrosoftUpdate", on_record=None):
+        """Return (updates, err, code), reusing a fresh cached scan unless forced
+        
+        updates is a list of UpdateRecords, or None when the scan output could
+        not be parsed. on_record(record) is called for each update as the scan
+        streams it in (cached results are replayed through it too).
+        """
+        if not force:
+            cached = self.scan_cache.get(source, category)
+            if cached is not None:
+                age = int(self.scan_cache.age(source, category) or 0)
+                self.log(f"Using scan results from {age // 60} min ago")
+                for record in cached if on_record else ():
+                    on_record(record)
+                return cached, "", 0
+        
+        if category != "all":
+            matches = SCAN_CATEGORY_FILTERS[category]
+            forward = on_record and (lambda record: matches(record) and on_record(record))
+            updates, err, code = self.scan_updates(force=force, source=source, on_record=forward)
+            if updates is None:
+                return updates, err, code
+            updates = [u for u in updates if matches(u)]
+            self.scan_cache.put(source, category, updates)
+            return updates, err, code
+        
+        cmd = textwrap.dedent(f"""
+            $ErrorActionPreference = 'Continue'
+        
+            try {{
+                Get-WindowsUpdate -{source} | {SCAN_PROJECTION}
+            }} catch {{
+                Write-Error $_.Exception.Message
+                exit 1
+            }}
+        """)
+        
+        parser = ScanStreamParser(on_record)
+        with self.telemetry.phase("scan", source=source) as phase:
+            out, err, code = self.run_powershell(cmd, capture_output=False, on_line=parser)
+            phase.ok = code == 0
+            phase.fields["updates"] = len(parser.records)
+        if code != 0 or (err and "error" in err.lower() and "0x80240024" not in err):
+            return [], err, code or 1
+        
+        updates = parser.records
+        if not updates and parser.skipped:
+            return None, err, code
+        
+        self.scan_cache.put(source, "all", updates)
+        self.manifest.record("discovered", updates)
+        return updates, err, code
+
+    @timed_phase("check", ok=lambda result: result[2] == 0)
+    def check_updates(self, on_record=None):
+        """Scan for updates and log a summary; returns (updates, err, code)
+        
+        on_record(record) sees each UpdateRecord as the scan streams it in.
+        """
+        self.progress_text("Checking for updates...")
+        self.log("Checking for updates online...")
+        self.progress(10)
+        
+        if not self.ensure_module():
+            self.progress(0)
+            return [], "Failed to load update module", 1
+        
+        self.progress(30)
+        
+        # An explicit check always refreshes the cached scan
+        updates, err, code = self.scan_updates(force=True, on_record=on_record)
+        
+        self.progress(90)
+        
+        if code != 0:
+            self.log(f"Error checking updates: {err}", "error")
+        elif updates is None:
+            self.log("Found updates but couldn't parse details")
+        elif not updates:
+            self.log("Your device is up to date")
+        else:
+            self.log(f"Found {len(updates)} available updates")
+        
+            # Log update details
+            for update in updates[:10]:  # Show first 10
+                self.log(f"  - {update.title or 'Unknown'} ({update.kb or 'KB N/A'})")
+        
+        self.finish_progress()
+        return updates, err, code
+
+    # ---------- Downloading ----------
+
+    @timed_phase("download")
+    def download_updates(self):
+        """Download updates to repository; returns True on success"""
+        self.log(f"Downloading updates to {self.repo_path}...")
+        self.progress(10)
+        
+        if not self.ensure_module():
+            self.progress(0)
+            return False
+        
+        download_dir = os.path.join(self.repo_path, "Downloads")
+        os.makedirs(download_dir, exist_ok=True)
+        
+        self.progress(30)
+        self.progress_text("Downloading updates...")
+        
+        # Reuse the last scan instead of querying the update service again
+        updates, err, code = self.scan_updates()
+        if code != 0:
+            self.log(f"Download error: {err}", "error")
+            self.progress(0)
+            return False
+        if updates == []:
+            self.log("No updates available to download")
+            self.progress(0)
+            return True
+        
+        if updates:
+            stored = [u for u in updates if self.store.has_kb(u.kb)]
+            for update in stored:
+                self.log(f"Already in repo: {update.title or 'Unknown'}")
+            updates = [u for u in updates if u not in stored]
+            if not updates:
+                self.log("All available updates are already in the repository")
+                self.progress(0)
+                return True
+        
+        # A peer on the LAN that already has a package saves going upstream
+        if updates and self.peer_client():
+            self.fetch_from_peer({u.kb for u in updates if u.kb})
+            updates = [u for u in updates if not self.store.has_kb(u.kb)]
+            if not updates:
+                self.finish_progress()
+                return True
+        
+        # Updates with direct .msu links are fetched by the native downloader
+        if updates:
+            direct = [u for u in updates if self._msu_urls(u)]
+            if direct:
+                self.download_direct(direct, download_dir)
+                updates = [u for u in updates if u not in direct]
+            if not updates:
+                self.finish_progress()
+                return True
+        
+        update_filter = self._update_filter(updates)
+        if update_filter is None:
+            self.log("Some updates have neither an UpdateID nor a KB; check for updates again", "error")
+            self.progress(0)
+            return False
+        for update in updates or []:
+            self.log(f"Downloading: {update.title or 'Unknown'}")
+        
+        cmd = textwrap.dedent(f"""
+            $ErrorActionPreference = 'Continue'
+        
+            try {{
+                Get-WindowsUpdate -MicrosoftUpdate {update_filter} -Download -AcceptAll -Verbose
+                Write-Output "Download completed successfully"
+            }} catch {{
+                Write-Error $_.Exception.Message
+                exit 1
+            }}
+        """)
+        
+        self.progress(50)
+        watcher = self.kb_progress_watcher(updates, "Downloaded",
+                                           progress_span(self.progress, 50, 90))
+        out, err, code = self.run_powershell(cmd, capture_output=False, on_line=watcher)
+        
+        self.progress(90)
+        
+        ok = not (err and "error" in err.lower())
+        if not ok:
+            self.log(f"Download error: {err}", "error")
+        else:
+            self.log("Updates downloaded successfully")
+            titles = {u.kb: u.title for u in updates or []}
+            added, duplicates = self.store.ingest_directory(download_dir, titles)
+            if added or duplicates:
+                self.log(f"Stored {added} new packages ({duplicates} duplicates skipped)")
+            self.manifest.record("downloaded", [
+                {"KB": u.kb, "Title": u.title, "Sha256": self.store.get(u.kb)["sha256"]}
+                for u in updates or [] if self.store.has_kb(u.kb)
+            ])
+        
+        self.finish_progress()
+        return ok
+
+    def _msu_urls(self, update):
+        return [u for u in update.download_urls if urllib.parse.urlsplit(u).path.lower().endswith('.msu')]
+
+    def download_direct(self, updates, download_dir):
+        """Fetch .msu packages over HTTP and add them to the store"""
+        jobs = []
+        for update in updates:
+            for url in self._msu_urls(update):
+                jobs.append((update, url))
+        totals = {}
+        totals_lock = threading.Lock()
+        
+        overall = progress_span(self.progress, 30, 90)
+        
+        def report(url, done, total):
+            with totals_lock:
+                totals[url] = (done, total or 0)
+                done_all = sum(d for d, _ in totals.values())
+                total_all = sum(t for _, t in totals.values())
+            overall(done_all, total_all)
+        
+        def fetch(job):
+            update, url = job
+            name = os.path.basename(urllib.parse.urlsplit(url).path)
+            self.log(f"Downloading: {update.title or name}")
+            expected, hash_name = catalog_expected_hash(url)
+            result = self.downloader.download(
+                url, os.path.join(download_dir, name),
+                expected_hash=expected, hash_name=hash_name,
+                progress=lambda done, total: report(url, done, total)
+            )
+            entry, added = self.store.add_file(
+                result["path"], kb=update.kb, title=update.title,
+                sha256=result["sha256"]
+            )
+            fields = {"KB": update.kb, "Title": update.title, "Sha256": entry["sha256"]}
+            self.manifest.record("downloaded", [fields])
+            if expected:
+                # The downloader already checked the catalog hash
+                self.manifest.record("verified", [fields])
+            resumed = " (resumed)" if result["resumed"] else ""
+            self.log(f"Stored {name}{resumed}" if added else f"{name} already stored")
+        
+        succeeded = 0
+        with ThreadPoolExecutor(max_workers=self.downloader.connections_per_host) as pool:
+            futures = {pool.submit(bind_token(fetch), job): job for job in jobs}
+            for future in futures:
+                try:
+                    future.result()
+                    succeeded += 1
+                except (DownloadError, OSError) as e:
+                    self.log(f"Download error: {e}", "error")
+                    self.manifest.record("failed", [futures[future][0]], error=str(e))
+        self.log(f"Downloaded {succeeded} of {len(jobs)} packages")
+        return succeeded
+
+    def _update_filter(self, updates):
+        """-UpdateID or -KBArticleID argument restricting a cmdlet to updates
+        
+        The scan's UpdateIDs name every update, KB or not; KBs cover records
+        cached before UpdateIDs were kept. "" (every update) for updates=None,
+        and None if some update can be named neither way.
+        """
+        if updates is None:
+            return ""
+        ids = [u.update_id for u in updates]
+        if ids and all(ids):
+            return f"-UpdateID {','.join(ids)}"
+        kbs = [u.kb for u in updates]
+        if kbs and all(kbs):
+            return f"-KBArticleID {','.join(kbs)}"
+        return None
+
+    # ---------- Peer Cache ----------
+
+    def peer_client(self):
+        """Client for the configured peer_cache_url, or None"""
+        url = self.config.get("peer_cache_url")
+        if not url:
+            return None
+        if self._peer_client is None or self._peer_client.base_url != url.rstrip("/"):
+            self._peer_client = PeerCacheClient(url, self.downloader)
+        return self._peer_client
+
+    def fetch_from_peer(self, kbs):
+        """Copy packages for kbs that the peer has and the store lacks; returns the KBs fetched
+        
+        Only KBs this machine's own scans asked for are fetched, so packages
+        for other builds or architectures on the peer are left alone. Titles
+        come from the local manifest rather than the peer's listing, and the
+        packages are recorded as downloaded; install_offline verifies them.
+        """
+        kbs = {normalize_kb(kb) for kb in kbs} - {None}
+        peer = self.peer_client() if kbs else None
+        packages = peer.packages() if peer else None
+        if packages is None:
+            if peer:
+                self.log(f"Peer cache {peer.base_url} is unreachable, using upstream", "warning")
+            return set()
+        wanted = [p for p in packages
+                  if p["sha256"] not in self.store.by_hash
+                  and normalize_kb(p.get("kb")) in kbs]
+        if not wanted:
+            return set()
+        metadata = self.manifest.metadata()
+        
+        download_dir = os.path.join(self.repo_path, "Downloads")
+        os.makedirs(download_dir, exist_ok=True)
+        self.log(f"Fetching {len(wanted)} packages from peer {peer.base_url}...")
+        
+        def fetch(package):
+            # The peer's file name is only trusted as a base name
+            name = os.path.basename(package.get("name") or "") or f"{package['sha256']}.msu"
+            kb = normalize_kb(package.get("kb"))
+            title = (metadata.get(kb) or {}).get("Title") or name
+            result = peer.fetch(package, os.path.join(download_dir, name))
+            self.store.add_file(result["path"], kb=kb, title=title, sha256=result["sha256"])
+            # The advertised hash is only the peer's word, so this is not recorded as verified
+            self.manifest.record("downloaded", [{"KB": kb, "Title": title,
+                                                 "Sha256": result["sha256"]}])
+            return kb
+        
+        fetched = set()
+        with ThreadPoolExecutor(max_workers=self.downloader.connections_per_host) as pool:
+            futures = {pool.submit(bind_token(fetch), p): p for p in wanted}
+            for future, package in futures.items():
+                try:
+                    fetched.add(future.result())
+                except (DownloadError, OSError) as e:
+                    self.log(f"Peer download of {package.get('name')} failed: {e}", "warning")
+        self.log(f"Fetched {len(fetched)} of {len(wanted)} packages from peer")
+        return fetched
+
+    def serve_repo(self, host="", port=None):
+        """Share the repository with peers over HTTP; returns the PeerCacheServer
+        
+        Raises OSError if the port cannot be bound.
+        """
+        if self.peer_server is None:
+            download_dir = os.path.join(self.repo_path, "Downloads")
+            if os.path.isdir(download_dir):
+                self.store.ingest_directory(download_dir)
+            if port is None:
+                port = self.config.get("peer_cache_port", PEER_CACHE_PORT)
+            self.peer_server = PeerCacheServer(self.store, host, port).start()
+            self.log(f"Sharing repository at {self.peer_server.url}")
+        return self.peer_server
+
+    def stop_serving(self):
+        if self.peer_server is not None:
+            self.peer_server.stop()
+            self.peer_server = None
+            self.log("Stopped sharing repository")
+
+    # ---------- Installing ----------
+
+    @timed_phase("install")
+    def install_updates(self, updates=None, allow_reboot=True):
+        """Install updates online; returns True on success
+        
+        updates restricts the install to those UpdateRecords (default: the
+        latest scan). allow_reboot=False suppresses the auto_reboot setting,
+        for callers that still have other work running.
+        """
+        self.log("Installing updates...")
+        self.progress_text("Installing updates...")
+        self.progress(10)
+        
+        if not self.ensure_module():
+            self.progress(0)
+            return False
+        
+        self.progress(30)
+        
+        if updates is None:
+            updates_list, err, code = self.scan_updates()
+        else:
+            updates_list, err, code = updates, "", 0
+        if code != 0 or updates_list is None:
+            self.log(f"Failed to check updates: {err if err else 'Unknown error'}", "error")
+            self.progress(0)
+            return False
+        if not updates_list:
+            self.log("No updates available")
+            self.progress(0)
+            return True
+        
+        update_filter = self._update_filter(updates)
+        if update_filter is None:
+            # Without a filter the cmdlet would install every update, including
+            # ones the caller meant to leave to another lane
+            self.log("Some updates have neither an UpdateID nor a KB; check for updates again", "error")
+            self.progress(0)
+            return False
+        
+        update_count = len(updates_list)
+        self.log(f"Installing {update_count} updates...")
+        self.progress(50)
+        
+        # Use correct cmdlet and parameters
+        auto_reboot = allow_reboot and self.config.get("auto_reboot", False)
+        reboot_param = "-AutoReboot" if auto_reboot else "-IgnoreReboot"
+        
+        # Proper PowerShell command with error handling
+        cmd = textwrap.dedent(f"""
+            $ErrorActionPreference = 'Continue'
+        
+            try {{
+                Get-WindowsUpdate -MicrosoftUpdate {update_filter} -Install -AcceptAll {reboot_param} -Verbose
+                Write-Output "Installation completed"
+            }} catch {{
+                Write-Error $_.Exception.Message
+                exit 1
+            }}
+        """)
+        
+        self.log("Running Windows Update installation...")
+        watcher = self.kb_progress_watcher(updates_list, "Installed",
+                                           progress_span(self.progress, 50, 90))
+        out, err, code = self.run_powershell(cmd, capture_output=False, on_line=watcher)
+        
+        # Installed updates drop out of the next scan
+        self.scan_cache.invalidate()
+        self.progress(90)
+        
+        ok = not (code != 0 or (err and "error" in err.lower()))
+        if not ok:
+            self.log(f"Installation failed: {err if err else 'Unknown error'}", "error")
+            self.manifest.record("failed", updates_list, error=err or "Installation failed")
+        else:
+            self.log("Updates installed successfully")
+            self.manifest.record("installed", updates_list)
+        
+        self.finish_progress()
+        return ok
+
+    @timed_phase("install_offline", ok=lambda result: not result[1])
+    def install_offline(self):
+        """Install updates from offline repository; returns (installed, failed)"""
+        self.log(f"Installing from repository: {self.repo_path}...")
+        self.progress_text("Installing offline updates...")
+        self.progress(10)
+        
+        if self.peer_client():
+            # Only what this machine's scans found and the store lacks
+            self.fetch_from_peer(kb for kb, info in self.manifest.metadata().items()
+                                 if info.get("State") not in ("installed", "superseded")
+                                 and not self.store.has_kb(kb))
+        
+        # Pick up packages dropped into Downloads by hand or by older versions
+        download_dir = os.path.join(self.repo_path, "Downloads")
+        if os.path.isdir(download_dir):
+            added, duplicates = self.store.ingest_directory(download_dir)
+            if added:
+                self.log(f"Added {added} packages from Downloads to the repository")
+        
+        entries = self.store.entries()
+        if not entries:
+            self.log("No updates found in repository", "error")
+            self.progress(0)
+            return [], []
+        
+        # Packages a newer stored package replaces are left out of the install
+        superseded = self.superseded_packages(entries)
+        if superseded:
+            self.log(f"Skipping {len(superseded)} superseded packages")
+            entries = [e for e in entries if e["sha256"] not in superseded]
+        
+        # So are packages the manifest already has installed
+        metadata = self.manifest.metadata()
+        pending = [e for e in entries
+                   if (metadata.get(e.get("kb")) or {}).get("State") != "installed"]
+        if len(pending) < len(entries):
+            self.log(f"Skipping {len(entries) - len(pending)} packages already installed")
+            entries = pending
+        if not entries:
+            self.log("Every stored update is already installed")
+            self.finish_progress()
+            return [], []
+        
+        self.log(f"Found {len(entries)} update files")
+        self.progress(20)
+        
+        # Damaged packages are dropped here rather than costing a DISM attempt
+        valid, invalid = self.verify_repo(entries)
+        self.progress(30)
+        
+        pipeline = OfflineInstallPipeline(
+            valid,
+            metadata=self.manifest.metadata(),
+            dism_runner=self.dism_runner,
+            log=self.log,
+            on_line=self.log_output_line,
+            stop_event=self.stop_event,
+            verify_cache=self.verify_cache
+        )
+        installed, failed = pipeline.install(
+            progress=progress_span(self.progress, 30, 90)
+        )
+        
+        self.manifest.record("verified", [p for p in pipeline.packages
+                                          if p.valid and p not in installed])
+        self.manifest.record("failed", [p for p in pipeline.packages if not p.valid])
+        self.manifest.record("installed", installed)
+        self.manifest.record("failed", failed, error="DISM could not add the package")
+        self.log(f"Installed {len(installed)} of {len(entries)} updates")
+        if installed:
+            self.scan_cache.invalidate()
+        
+        self.finish_progress()
+        return installed, failed
+
+    # ---------- Repository Maintenance ----------
+
+    def stored_packages(self, entries=None):
+        """MsuPackages for the store's blobs, each expecting its content hash"""
+        entries = self.store.entries() if entries is None else entries
+        return [MsuPackage(self.store.blob_path(e["sha256"]), name=e.get("name"),
+                           kb=e.get("kb"), title=e.get("title"), expected_sha256=e["sha256"])
+                for e in entries]
+
+    @timed_phase("verify", ok=lambda result: not result[1])
+    def verify_repo(self, entries=None):
+        """Hash stored packages concurrently; returns (valid, invalid) MsuPackage lists
+        
+        Unchanged files are answered from the verify cache. Corrupt or
+        truncated packages are removed from the store and marked failed in
+        the manifest, so the next download fetches them again.
+        """
+        pipeline = OfflineInstallPipeline(
+            self.stored_packages(entries),
+            log=self.log,
+            stop_event=self.stop_event,
+            verify_cache=self.verify_cache
+        )
+        valid = pipeline.validate()
+        invalid = [p for p in pipeline.packages if not p.valid]
+        for package in invalid:
+            if package.corrupt:
+                self.store.remove(package.expected_sha256)
+        self.manifest.record("failed", invalid)
+        self.log(f"Verified {len(valid)} packages" +
+                 (f", {len(invalid)} damaged or unreadable" if invalid else ""),
+                 "warning" if invalid else "info")
+        return valid, invalid
+
+    def superseded_packages(self, entries=None):
+        """{sha256: superseding KB} for stored packages that a newer stored package replaces
+        
+        Windows Update's SupersededUpdateIDs are matched to KBs through the
+        UpdateIDs the manifest has seen, so this only covers updates scanned
+        at some point; dated cumulative-update families are matched by title.
+        """
+        entries = self.store.entries() if entries is None else entries
+        metadata = self.manifest.metadata()
+        kb_by_id = {info["UpdateID"]: kb for kb, info in metadata.items() if info.get("UpdateID")}
+        packages = []
+        for entry in entries:
+            info = metadata.get(entry.get("kb")) or {}
+            packages.append({"kb": entry.get("kb"),
+                             "title": info.get("Title") or entry.get("title"),
+                             "supersedes": [kb_by_id[i] for i in info.get("SupersededUpdateIDs") or ()
+                                            if i in kb_by_id]})
+        graph = supersedence_graph(packages)
+        return {e["sha256"]: graph[e["kb"]] for e in entries if e.get("kb") in graph}
+
+    def collect_garbage(self, archive=False, dry_run=False):
+        """Remove superseded packages from the store; returns a report dict
+        
+        With archive=True the packages are moved to the repo's Archive folder
+        instead of deleted. dry_run only reports what would be reclaimed.
+        """
+        entries = self.store.entries()
+        superseded = self.superseded_packages(entries)
+        archive_dir = os.path.join(self.repo_path, "Archive") if archive else None
+        removed = []
+        for entry in entries:
+            superseded_by = superseded.get(entry["sha256"])
+            if not superseded_by:
+                continue
+            if not dry_run and not self.store.remove(entry["sha256"], archive_dir=archive_dir):
+                continue
+            removed.append({"kb": entry.get("kb"), "name": entry.get("name"),
+                            "size": entry.get("size") or 0, "superseded_by": superseded_by})
+            if dry_run:
+                continue
+            self.manifest.record("superseded", [{"KB": entry.get("kb"), "Title": entry.get("title"),
+                                                 "SupersededBy": superseded_by}])
+        if removed and not dry_run:
+            self.store.compact()
+        
+        reclaimed = sum(r["size"] for r in removed)
+        verb = "Would reclaim" if dry_run else "Archived" if archive else "Reclaimed"
+        for r in removed:
+            self.log(f"  {r['kb']} superseded by {r['superseded_by']}")
+        self.log(f"{verb} {reclaimed / (1024 * 1024):.1f} MB from {len(removed)} superseded "
+                 f"packages; {len(entries) - len(removed)} packages kept")
+        return {"removed": removed, "reclaimed": reclaimed,
+                "kept": len(entries) - len(removed), "archived": bool(archive), "dry_run": dry_run}
+
+    # ---------- Other Products ----------
+
+    @timed_phase("office")
+    def update_office(self):
+        """Update Microsoft Office; returns True on success"""
+        self.log("Updating Office (Click-to-Run)...")
+        self.progress_text("Updating Office...")
+        self.progress(30)
+        
+        office_path = None
+        for path in OFFICE_C2R_PATHS:
+            if os.path.exists(path):
+                office_path = path
+                break
+        
+        if not office_path:
+            self.log("Office Click-to-Run not found", "error")
+            self.progress(0)
+            return False
+        
+        self.progress(60)
+        
+        out, err, code = run_streaming(
+            [office_path, "/update", "user"],
+            on_line=self.log_output_line, timeout=1200
+        )
+        
+        self.progress(90)
+        
+        if code == 0:
+            self.log("Office updated successfully")
+        elif err.startswith("Error:"):
+            self.log(f"Office update error: {err[len('Error: '):]}", "error")
+        else:
+            self.log("Office update completed with warnings")
+        
+        self.finish_progress()
+        return not err.startswith("Error:")
+
+    @timed_phase("dotnet")
+    def update_dotnet(self, updates=None):
+        """Update .NET Framework; returns True on success
+        
+        updates is the .NET subset of a scan the caller already ran.
+        """
+        if not self.ensure_module():
+            return False
+        
+        self.log("Updating .NET Framework...")
+        self.progress_text("Updating .NET Framework...")
+        self.progress(30)
+        
+        if updates is None:
+            updates, err, code = self.scan_updates(category="dotnet")
+        else:
+            err, code = "", 0
+        if code != 0:
+            self.log(f".NET update error: {err if err else 'Unknown error'}", "error")
+            self.progress(0)
+            return False
+        if updates == []:
+            self.log("No .NET updates available")
+            self.progress(0)
+            return True
+        dotnet_filter = self._update_filter(updates) or "-Title '\\.NET'"
+        
+        cmd = textwrap.dedent(f"""
+            $ErrorActionPreference = 'Continue'
+        
+            try {{
+                Get-WindowsUpdate -MicrosoftUpdate {dotnet_filter} -Install -AcceptAll -IgnoreReboot -Verbose | Where-Object {{ $_.Title -like '*.NET*' }}
+                Write-Output ".NET Framework updates installed"
+            }} catch {{
+                Write-Error $_.Exception.Message
+                exit 1
+            }}
+        """)
+        
+        out, err, code = self.run_powershell(cmd, capture_output=False)
+        
+        self.scan_cache.invalidate()
+        self.progress(90)
+        
+        if code == 0:
+            self.log(".NET Framework update completed")
+            self.manifest.record("installed", updates or [])
+        else:
+            self.log(f".NET update error: {err if err else 'Unknown error'}", "error")
+            self.manifest.record("failed", updates or [], error=err or ".NET update failed")
+        
+        self.finish_progress()
+        return code == 0
+
+    @timed_phase("vcredist")
+    def update_vcredist(self):
+        """Update Visual C++ Redistributables; returns True on success"""
+        self.log("Updating VC++ Redistributables...")
+        self.progress_text("Updating VC++ Redistributables...")
+        self.progress(30)
+        
+        if self.capabilities.available("Winget"):
+            # Run winget directly rather than in the PowerShell session, so it
+            # does not queue behind a Windows Update install
+            out, err, code = run_streaming(
+                ["winget", "upgrade", "--id", "Microsoft.VCRedist.*",
+                 "--silent", "--accept-package-agreements"],
+                on_line=self.log_output_line, timeout=1800
+            )
+        else:
+            out, err, code = self._install_vcredist_direct()
+        
+        self.progress(90)
+        
+        if code == 0:
+            self.log("VC++ Redistributables updated")
+        else:
+            self.log(f"VC++ update error: {err}", "error")
+        
+        self.finish_progress()
+        return code == 0
+
+    def _install_vcredist_direct(self):
+        """Download the VC++ installers in parallel, then run them in turn"""
+        vc_dir = os.path.join(self.repo_path, "Downloads", "vcredist")
+        results = []
+        with ThreadPoolExecutor(max_workers=len(VCREDIST_URLS)) as pool:
+            futures = [pool.submit(bind_token(self.downloader.download), url,
+                                   os.path.join(vc_dir, os.path.basename(url)))
+                       for url in VCREDIST_URLS]
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except (DownloadError, OSError) as e:
+                    return "", str(e), 1
+        
+        self.progress(60)
+        for result in results:
+            out, err, code = run_streaming(
+                [result["path"], "/install", "/quiet", "/norestart"],
+                on_line=self.log_output_line, timeout=1200
+            )
+            # 3010: installed, restart required
+            if code not in (0, 3010):
+                return out, err or f"{os.path.basename(result['path'])} exited with {code}", code
+        return "", "", 0
+
+    # ---------- Category Orchestration ----------
+
+    @timed_phase("update_all", ok=lambda results: bool(results) and all(results.values()))
+    def update_categories(self, categories=None):
+        """Update every enabled category in one run; returns {category: ok}
+
+        categories defaults to the enabled entries of the update_categories
+        config block. Windows Update and .NET share one scan and run one after
+        the other because both go through the Windows servicing stack; Office
+        and VC++ use their own installers and run alongside them.
+        """
+        if categories is None:
+            enabled = self.config.get("update_categories", {})
+            categories = [c for c in UPDATE_CATEGORIES if enabled.get(c)]
+        categories = [c for c in UPDATE_CATEGORIES if c in categories]
+        if not categories:
+            self.log("No update categories are enabled", "warning")
+            return {}
+
+        self.log(f"Updating: {', '.join(CATEGORY_LABELS[c] for c in categories)}")
+        results = {}
+        lanes = []
+        servicing = [c for c in categories if c in SERVICING_CATEGORIES]
+        if servicing:
+            # Windows and .NET split a single scan between them
+            split = self._split_scan(servicing)
+            if split is None:
+                results.update((c, False) for c in servicing)
+            else:
+                lanes.append([(c, split[c]) for c in servicing])
+        lanes.extend([(c, None)] for c in categories if c not in SERVICING_CATEGORIES)
+
+        # Each category reports 0-100 on its own; the run reports their mean
+        category_progress = {c: 100 if c in results else 0 for c in categories}
+        progress_lock = threading.Lock()
+        # Lanes report under their own reporters; the run's total goes to the caller's
+        report = current_reporter() or self._reporter
+
+        def progress(category, value):
+            with progress_lock:
+                # Operations drop to 0 when they stop early: that category is done
+                category_progress[category] = value or 100
+                overall = sum(category_progress.values()) // len(category_progress)
+            report.progress(max(overall, 1))
+
+        def run_lane(steps):
+            for category, updates in steps:
+                # Only this lane's work reports through the category's reporter
+                reporter = ProgressReporter(
+                    lambda value, category=category: progress(category, value),
+                    finish_progress=lambda category=category: progress(category, 100))
+                with use_reporter(reporter):
+                    try:
+                        results[category] = self._run_category(category, updates)
+                    except Exception as e:
+                        self.log(f"{CATEGORY_LABELS[category]} update error: {e}", "error")
+                        results[category] = False
+                progress(category, 100)
+
+        self.progress_text(f"Updating {len(categories)} categories...")
+        threads = [threading.Thread(target=bind_token(run_lane), args=(steps,), daemon=True)
+                   for steps in lanes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Reboot only once nothing else is still installing
+        if (any(results.get(c) for c in SERVICING_CATEGORIES)
+                and self.config.get("auto_reboot", False)):
+            self.run_powershell("if (Get-WURebootStatus -Silent) { Restart-Computer -Force }")
+
+        failed = [CATEGORY_LABELS[c] for c in categories if not results.get(c)]
+        if failed:
+            self.log(f"Finished with errors in: {', '.join(failed)}", "error")
+        else:
+            self.log("All categories updated")
+        self.finish_progress()
+        return results
+
+    def _split_scan(self, categories):
+        """One scan divided into {category: updates}, or None if it failed"""
+        if not self.ensure_module():
+            return None
+        updates, err, code = self.scan_updates()
+        if code != 0 or updates is None:
+            self.log(f"Failed to check updates: {err if err else 'Unknown error'}", "error")
+            return None
+        is_dotnet = SCAN_CATEGORY_FILTERS["dotnet"]
+        split = {"dotnet": [u for u in updates if is_dotnet(u)]}
+        # With .NET handled separately, Windows Update installs the rest
+        split["windows"] = ([u for u in updates if not is_dotnet(u)]
+                            if "dotnet" in categories else updates)
+        return split
+
+    def _run_category(self, category, updates=None):
+        """Run one category's update inside update_categories"""
+        if category == "windows":
+            return self.install_updates(updates, allow_reboot=False)
+        if category == "dotnet":
+            return self.update_dotnet(updates)
+        if category == "office":
+            return self.update_office()
+        return self.update_vcredist()
+
+# ---------- Maintenance Scheduler ----------
+# Seconds between checks of the maintenance windows
+MAINTENANCE_TICK = 60
+# Seconds before a failed or incomplete background download is retried
+MAINTENANCE_RETRY = 15 * 60
+WINDOW_PATTERN = re.compile(r"^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*$")
+
+
+def parse_window(text):
+    """(start, end) in minutes after midnight of an "HH:MM-HH:MM" window, or None"""
+    match = WINDOW_PATTERN.match(text or "")
+    if not match:
+        return None
+    start_hour, start_minute, end_hour, end_minute = map(int, match.groups())
+    if start_hour > 23 or end_hour > 24 or start_minute > 59 or end_minute > 59:
+        return None
+    return start_hour * 60 + start_minute, end_hour * 60 + end_minute
+
+def in_window(text, now=None):
+    """Whether local time now is inside the window; "22:00-04:00" spans midnight"""
+    window = parse_window(text)
+    if window is None:
+        return False
+    start, end = window
+    local = time.localtime(now)
+    minute = local.tm_hour * 60 + local.tm_min
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+
+class _LastInputInfo(ctypes.Structure):
+    _fields_ = [("cbSize", ctypes.c_uint), ("dwTime", ctypes.c_uint)]
+
+
+def idle_seconds():
+    """Seconds since the last keyboard or mouse input, or None where unknown"""
+    try:
+        info = _LastInputInfo()
+        info.cbSize = ctypes.sizeof(info)
+        if not ctypes.windll.user32.GetLastInputInfo(ctypes.byref(info)):
+            return None
+        # Both counters are 32-bit milliseconds and wrap after 49.7 days
+        return ((ctypes.windll.kernel32.GetTickCount() - info.dwTime) & 0xFFFFFFFF) / 1000.0
+    except (AttributeError, OSError):
+        return None
+
+
+class MaintenanceScheduler:
+    """Scans, pre-downloads and installs updates on their configured windows
+    
+    The engine rescans every scan_interval seconds. Updates not yet in the
+    repository are downloaded inside download_window, or once the machine
+    has been idle for idle_minutes, under a Throttle built from
+    download_rate_limit and cpu_budget. Inside install_window the
+    repository's downloaded packages are installed offline, once per
+    opening of the window, so the disruptive part only replays local files.
+    
+    Given a JobScheduler, each action is queued as a job claiming the same
+    resources as the front-ends' own operations, so it never overlaps them.
+    """
+
+    def __init__(self, engine, jobs=None, tick=MAINTENANCE_TICK):
+        self.engine = engine
+        self.jobs = jobs
+        self.tick = tick
+        # Updates from the last scan that are not in the repository yet
+        self.pending = None
+        self._last_download = None
+        self._install_done = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def config(self):
+        return self.engine.config
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.running:
+            self._stop.clear()
+            self._thread = threading.Thread(target=bind_token(self._loop), daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self):
+        while not self._stop.is_set() and not cancel_requested():
+            try:
+                self.run_due()
+            except Exception as e:
+                self.engine.log(f"Scheduled maintenance failed: {e}", "error")
+            self._stop.wait(self.tick)
+
+    def throttle(self):
+        return Throttle(self.config.get("download_rate_limit", 0),
+                        self.config.get("cpu_budget", 0))
+
+    def idle(self):
+        idle = idle_seconds()
+        return idle is not None and idle >= self.config.get("idle_minutes", 15) * 60
+
+    def _not_stored(self, updates):
+        return [u for u in updates or [] if not self.engine.store.has_kb(u.kb)]
+
+    def installable(self):
+        """Whether the repository holds packages whose latest state is downloaded or verified
+        
+        Superseded packages are not counted, since install_offline skips them.
+        """
+        entries = self.engine.store.entries()
+        superseded = self.engine.superseded_packages(entries)
+        metadata = self.engine.manifest.metadata()
+        return any((metadata.get(e.get("kb")) or {}).get("State") in ("downloaded", "verified")
+                   for e in entries if e["sha256"] not in superseded)
+
+    def due(self, now=None):
+        """Names of the actions to run now, in scan, download, install order"""
+        now = time.time() if now is None else now
+        actions = []
+        age = self.engine.scan_cache.age("MicrosoftUpdate")
+        if age is None or age >= self.config.get("scan_interval", 6 * 60 * 60):
+            actions.append("scan")
+        elif self.pending is None:
+            # A fresh scan from before a restart still says what is missing
+            self.pending = self._not_stored(self.engine.scan_cache.get("MicrosoftUpdate"))
+        
+        retry_due = (self._last_download is None
+                     or now - self._last_download >= MAINTENANCE_RETRY)
+        if (self.pending and retry_due
+                and (in_window(self.config.get("download_window"), now) or self.idle())):
+            actions.append("download")
+        
+        if not in_window(self.config.get("install_window"), now):
+            self._install_done = False
+        elif not self._install_done and self.installable():
+            actions.append("install")
+        return actions
+
+    def run_due(self, now=None):
+        """Start the actions due now; returns their names"""
+        actions = self.due(now)
+        for action in actions:
+            if action == "download":
+                self._last_download = time.time() if now is None else now
+            elif action == "install":
+                self._install_done = True
+            self._run(action)
+        return actions
+
+    def _run(self, action):
+        func, name, resources = {
+            "scan": (self.scan, "Scheduled scan", ()),
+            "download": (self.download, "Scheduled download", [RESOURCE_REPO]),
+            "install": (self.install, "Scheduled install", [RESOURCE_SERVICING, RESOURCE_REPO])
+        }[action]
+        if self.jobs is not None:
+            self.jobs.submit(name, func, resources)
+        else:
+            func()
+
+    def scan(self):
+        updates, err, code = self.engine.check_updates()
+        if code == 0 and updates is not None:
+            self.pending = self._not_stored(updates)
+        return code == 0
+
+    def download(self):
+        """Pre-download pending updates within the bandwidth and CPU budget"""
+        self.engine.log(f"Pre-downloading {len(self.pending or [])} updates in the background")
+        with use_throttle(self.throttle()):
+            ok = self.engine.download_updates()
+        self.pending = self._not_stored(self.pending)
+        return ok
+
+    def install(self):
+        self.engine.log("Maintenance window open, installing from the repository")
+        installed, failed = self.engine.install_offline()
+        return not failed
@@ -0,0 +1,56 @@
+"""Tests for the JSON CLI, run against the fake PowerShell and DISM backends"""
+
+import json
+
+from samsoft_update_core import FakePowerShellHost, PowerShellSession, UpdateEngine
+from samsoft_update_cli import FAKE_UPDATES, fake_powershell_handler, main
+
+
+def run_cli(capsys, *argv):
+    """Exit code and the emitted events of one CLI run"""
+    code = main(list(argv))
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    return code, events
+
+
+def test_check_streams_each_update_then_the_result(tmp_path, capsys):
+    code, events = run_cli(capsys, "--repo", str(tmp_path), "--fake", "check")
+    assert code == 0
+    streamed = [e["KB"] for e in events if e["event"] == "update"]
+    assert streamed == [u["KB"] for u in FAKE_UPDATES]
+    result = events[-1]
+    assert result["event"] == "result" and result["ok"]
+    assert [u["UpdateID"] for u in result["updates"]] == [u["UpdateID"] for u in FAKE_UPDATES]
+
+
+def test_install_offline_fails_on_an_empty_repository(tmp_path, capsys):
+    code, events = run_cli(capsys, "--repo", str(tmp_path), "--fake", "install-offline")
+    assert code == 1
+    assert events[-1]["ok"] is False
+    assert events[-1]["error"] == "No updates found in repository"
+
+
+def test_update_all_splits_one_scan_between_windows_and_dotnet(tmp_path):
+    commands = []
+
+    def handler(command):
+        commands.append(command)
+        return fake_powershell_handler(command)
+
+    engine = UpdateEngine(
+        {"repo_path": str(tmp_path), "auto_reboot": True,
+         "update_categories": {"windows": True, "dotnet": True}},
+        ps_session=PowerShellSession(host_factory=lambda: FakePowerShellHost(handler)))
+    try:
+        assert engine.update_categories(["dotnet"]) == {"dotnet": True}
+        assert any("Restart-Computer" in c for c in commands)
+        commands.clear()
+        assert engine.update_categories() == {"windows": True, "dotnet": True}
+    finally:
+        engine.close()
+    installs = [c for c in commands if "-Install" in c]
+    ids = {u["KB"]: u["UpdateID"] for u in FAKE_UPDATES}
+    windows = next(c for c in installs if ids["KB5034123"] in c)
+    dotnet = next(c for c in installs if ids["KB5033920"] in c)
+    assert ids["KB5033920"] not in windows
+    assert ids["KB5034123"] not in dotnet
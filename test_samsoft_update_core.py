@@ -0,0 +1,428 @@
+"""Tests for the headless update engine, run off Windows with its stand-ins"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import samsoft_update_core
+from samsoft_update_core import (
+    CancelToken, FakePowerShellHost, PowerShellSession, use_token,
+    MsuPackage, order_packages, FakeDism, OfflineInstallPipeline, UpdateStore,
+    PackageDownloader, PeerCacheServer, ScanStreamParser,
+    DEFAULT_CONFIG, ConfigStore, validate_config,
+    MANIFEST_FILE, MANIFEST_JOURNAL_FILE, UpdateManifest, parse_range,
+    supersedence_graph, VerifyCache, inspect_package,
+    MaintenanceScheduler, UpdateEngine, in_window, parse_window
+)
+
+
+def write_cab(path, size=1000):
+    """Write a minimal cabinet whose header records its own size; returns the bytes"""
+    data = b"MSCF" + bytes(4) + (size + 12).to_bytes(4, "little") + os.urandom(size)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+
+# ---------- PowerShell Host Session ----------
+
+def make_session(handler):
+    return PowerShellSession(host_factory=lambda: FakePowerShellHost(handler))
+
+
+def test_session_streams_output_and_exit_code():
+    session = make_session(lambda command: (["one", "two"], ["oops"], 3))
+    lines = []
+    out, err, code = session.execute("anything", on_line=lambda stream, text: lines.append((stream, text)))
+    assert (out, err, code) == ("one\ntwo", "oops", 3)
+    assert lines == [("stdout", "one"), ("stdout", "two"), ("stderr", "oops")]
+
+
+def test_session_replaces_a_host_that_died():
+    def handler(command):
+        if command == "die":
+            raise SystemExit
+        return [command], [], 0
+
+    session = make_session(handler)
+    assert session.execute("first")[0] == "first"
+    assert session.execute("die")[2] == 1
+    assert session.execute("again") == ("again", "", 0)
+    assert session.restarts == 1
+
+
+def test_waiting_for_a_busy_host_can_be_cancelled():
+    release = threading.Event()
+
+    def handler(command):
+        if command == "slow":
+            release.wait(10)
+        return [command], [], 0
+
+    session = make_session(handler)
+    slow = threading.Thread(target=session.execute, args=("slow",))
+    slow.start()
+    time.sleep(0.2)
+    token = CancelToken()
+    threading.Timer(0.3, token.cancel).start()
+    started = time.monotonic()
+    with use_token(token):
+        assert session.execute("quick") == ("", "Cancelled", 1)
+    assert time.monotonic() - started < 5
+    assert session.execute("quick", timeout=0.3)[1].startswith("Command timed out")
+    release.set()
+    slow.join()
+    assert session.execute("quick") == ("quick", "", 0)
+
+
+# ---------- Offline Install Pipeline ----------
+
+def test_servicing_stack_updates_get_their_own_leading_layers():
+    packages = [MsuPackage(f"/repo/windows11-kb{kb}-x64.msu") for kb in (5000003, 5000001, 5000002)]
+    metadata = {"KB5000002": {"Title": "2024-01 Servicing Stack Update for Windows 11 (KB5000002)"}}
+    layers = order_packages(packages, metadata)
+    assert [[p.kb for p in layer] for layer in layers] == [["KB5000002"], ["KB5000001", "KB5000003"]]
+
+
+def stored_packages(store):
+    return [MsuPackage(store.blob_path(e["sha256"]), name=e["name"], kb=e["kb"],
+                       expected_sha256=e["sha256"]) for e in store.entries()]
+
+
+def test_failed_batch_is_retried_one_package_at_a_time(tmp_path):
+    store = UpdateStore(str(tmp_path))
+    for kb in (5000001, 5000002, 5000003):
+        path = tmp_path / f"windows11-kb{kb}-x64.msu"
+        write_cab(path)
+        store.add_file(str(path))
+    dism = FakeDism(fail=("KB5000002",), store=store)
+    pipeline = OfflineInstallPipeline(stored_packages(store), dism_runner=dism)
+    installed, failed = pipeline.install()
+    assert sorted(p.kb for p in installed) == ["KB5000001", "KB5000003"]
+    assert [p.kb for p in failed] == ["KB5000002"]
+    # One batch of three, then each package alone
+    assert [len(call) for call in dism.calls] == [3, 1, 1, 1]
+
+
+# ---------- Package Downloader ----------
+
+def test_download_resumes_with_the_missing_chunks(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    store = UpdateStore(str(source))
+    path = source / "windows11-kb5000001-x64.msu"
+    data = write_cab(path, 5000)
+    entry, _ = store.add_file(str(path))
+    server = PeerCacheServer(store, host="127.0.0.1", port=0).start()
+    try:
+        url = f"{server.url}/blobs/{entry['sha256']}"
+        dest = str(tmp_path / "out.msu")
+        # An earlier run got the first two 1 KB chunks
+        with open(dest + ".part", 'wb') as f:
+            f.write(data[:2048].ljust(len(data), b"\0"))
+        with open(dest + ".part.json", 'w') as f:
+            json.dump({"url": url, "size": len(data), "etag": f'"{entry["sha256"]}"',
+                       "chunk_size": 1024, "done": [0, 1]}, f)
+        result = PackageDownloader(chunk_size=1024).download(url, dest)
+        assert result["resumed"]
+        assert result["sha256"] == hashlib.sha256(data).hexdigest()
+        with open(dest, 'rb') as f:
+            assert f.read() == data
+        assert not os.path.exists(dest + ".part.json")
+        # The probe's single byte plus the three chunks still missing
+        assert server.bytes_served == 1 + len(data) - 2048
+    finally:
+        server.stop()
+
+
+# ---------- Scan Records ----------
+
+def test_scan_parser_turns_json_lines_into_records():
+    seen = []
+    parser = ScanStreamParser(seen.append)
+    parser("stdout", '{"Title": "Update (KB5000001)", "KB": "5000001", "Size": 10,'
+                     ' "DownloadUrls": "http://x/a.msu", "SupersededUpdateIDs": "old-id"}')
+    parser("stdout", "WARNING: not JSON")
+    parser("stdout", "   ")
+    parser("stderr", '{"Title": "ignored"}')
+    parser("stdout", '["not", "an", "object"]')
+    assert [r.kb for r in seen] == ["KB5000001"]
+    assert parser.records == seen
+    assert parser.skipped == 2
+    record = seen[0]
+    assert record.download_urls == ("http://x/a.msu",)
+    assert record.superseded_ids == ("old-id",)
+    assert record.to_dict()["DownloadUrls"] == ["http://x/a.msu"]
+
+
+# ---------- Configuration ----------
+
+@pytest.mark.parametrize("key, value, expected", [
+    ("cpu_budget", 0, 0),
+    ("cpu_budget", 100, 100),
+    ("cpu_budget", 101, DEFAULT_CONFIG["cpu_budget"]),
+    ("scan_cache_ttl", 0, 0),
+    ("download_rate_limit", -1, DEFAULT_CONFIG["download_rate_limit"]),
+    ("peer_cache_port", 65535, 65535),
+    ("peer_cache_port", 70000, DEFAULT_CONFIG["peer_cache_port"]),
+    ("peer_cache_port", 0, DEFAULT_CONFIG["peer_cache_port"]),
+    ("idle_minutes", 0, DEFAULT_CONFIG["idle_minutes"]),
+    ("download_connections", True, DEFAULT_CONFIG["download_connections"]),
+    ("auto_reboot", 1, DEFAULT_CONFIG["auto_reboot"]),
+])
+def test_validate_config_checks_types_and_ranges(key, value, expected):
+    assert validate_config({key: value})[key] == expected
+
+
+def test_validate_config_keeps_unknown_keys_and_checks_categories():
+    config = validate_config({"future_setting": [1], "update_categories": {"office": False, "windows": "no"}})
+    assert config["future_setting"] == [1]
+    assert config["update_categories"]["office"] is False
+    assert config["update_categories"]["windows"] is True
+
+
+def test_config_store_rejects_invalid_values_and_saves_valid_ones(tmp_path):
+    path = str(tmp_path / "config.json")
+    store = ConfigStore(path, delay=60)
+    store.set("cpu_budget", 0)
+    with pytest.raises(ValueError):
+        store.set("peer_cache_port", 70000)
+    store.flush()
+    with open(path) as f:
+        saved = json.load(f)
+    assert saved["cpu_budget"] == 0
+    assert saved["peer_cache_port"] == DEFAULT_CONFIG["peer_cache_port"]
+
+
+# ---------- Update Manifest Journal ----------
+
+def journal_lines(repo):
+    with open(os.path.join(repo, MANIFEST_JOURNAL_FILE)) as f:
+        return f.readlines()
+
+
+def test_manifest_journals_only_real_state_changes(tmp_path):
+    repo = str(tmp_path)
+    manifest = UpdateManifest(repo)
+    update = {"KB": "5000001", "Title": "Update"}
+    assert manifest.record("discovered", [update]) == 1
+    assert manifest.record("discovered", [update]) == 0
+    assert manifest.record("downloaded", [update]) == 1
+    # A rescan still offering a downloaded update is not news
+    assert manifest.record("discovered", [update]) == 0
+    assert len(journal_lines(repo)) == 2
+    entry = UpdateManifest(repo).get("KB5000001")
+    assert entry["State"] == "downloaded"
+    assert set(entry["States"]) == {"discovered", "downloaded"}
+
+
+def test_manifest_compacts_and_skips_lines_the_snapshot_covers(tmp_path):
+    repo = str(tmp_path)
+    manifest = UpdateManifest(repo)
+    for i in range(40):
+        manifest.record("downloaded", [{"KB": "5000001", "Title": f"Update {i}"}])
+        manifest.record("failed", [{"KB": "5000001", "Title": f"Update {i}"}], error="boom")
+    assert len(journal_lines(repo)) < 80
+    assert os.path.exists(os.path.join(repo, MANIFEST_FILE))
+    # A crash after the snapshot was written but before the journal was truncated
+    manifest.compact()
+    with open(os.path.join(repo, MANIFEST_JOURNAL_FILE), 'w') as f:
+        f.write(json.dumps({"KB": "KB5000001", "Title": "stale", "seq": 1,
+                            "state": "installed", "time": "2024-01-01T00:00:00"}) + "\n")
+    entry = UpdateManifest(repo).get("KB5000001")
+    assert entry["State"] == "failed"
+    assert entry["Title"] == "Update 39"
+    assert entry["Error"] == "boom"
+
+
+# ---------- Peer Cache ----------
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-9", (0, 9)),
+    ("bytes=90-", (90, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+    ("bytes=50-500", (50, 99)),
+    ("bytes=100-", "invalid"),
+    ("bytes=-0", "invalid"),
+    # Not one well-formed range: served whole, as RFC 9110 allows
+    ("bytes=0-1,5-6", None),
+    ("items=0-9", None),
+    ("bytes=9-3", None),
+    ("bytes=-", None),
+    ("garbage", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+def test_peer_server_answers_ranges(tmp_path):
+    store = UpdateStore(str(tmp_path))
+    path = tmp_path / "windows11-kb5000001-x64.msu"
+    data = write_cab(path, 100)
+    entry, _ = store.add_file(str(path))
+    server = PeerCacheServer(store, host="127.0.0.1", port=0).start()
+    url = f"{server.url}/blobs/{entry['sha256']}"
+
+    def get(range_header):
+        request = urllib.request.Request(url, headers={"Range": range_header})
+        with urllib.request.urlopen(request, timeout=10) as resp:
+            return resp.status, resp.read()
+
+    try:
+        assert get("bytes=0-3") == (206, b"MSCF")
+        assert get("bytes=0-1,4-5") == (200, data)
+        with pytest.raises(urllib.error.HTTPError) as error:
+            get(f"bytes={len(data)}-")
+        assert error.value.code == 416
+    finally:
+        server.stop()
+
+
+# ---------- Supersedence ----------
+
+def cumulative(kb, month):
+    return {"kb": kb, "title": f"2024-{month} Cumulative Update for Windows 11 Version 23H2"
+                               f" for x64-based Systems ({kb})"}
+
+
+def test_supersedence_follows_families_and_explicit_lists():
+    graph = supersedence_graph([
+        cumulative("KB5000001", "01"),
+        cumulative("KB5000002", "02"),
+        cumulative("KB5000003", "03"),
+        {"kb": "KB6000001", "title": "Driver A"},
+        {"kb": "KB6000002", "title": "Driver B", "supersedes": ["KB6000001", "KB9999999"]},
+        # A cycle leaves its members alone
+        {"kb": "KB7000001", "title": "x", "supersedes": ["KB7000002"]},
+        {"kb": "KB7000002", "title": "y", "supersedes": ["KB7000001"]},
+    ])
+    assert graph == {"KB5000001": "KB5000003", "KB5000002": "KB5000003",
+                     "KB6000001": "KB6000002"}
+
+
+def test_store_keeps_entries_whose_blob_cannot_be_removed(tmp_path, monkeypatch):
+    messages = []
+    store = UpdateStore(str(tmp_path), log=lambda message, level="info": messages.append(level))
+    path = tmp_path / "windows11-kb5000001-x64.msu"
+    write_cab(path)
+    entry, _ = store.add_file(str(path))
+
+    def denied(path):
+        raise PermissionError(13, "Access is denied", path)
+
+    monkeypatch.setattr(os, "remove", denied)
+    assert store.remove(entry["sha256"]) is False
+    assert messages == ["error"]
+    assert store.has_kb("KB5000001")
+    monkeypatch.undo()
+    assert store.remove(entry["sha256"]) is True
+    assert not store.has_kb("KB5000001")
+    assert not os.path.exists(store.blob_path(entry["sha256"]))
+    assert not UpdateStore(str(tmp_path)).has_kb("KB5000001")
+
+
+# ---------- Package Verification ----------
+
+def test_inspect_package_catches_damaged_packages(tmp_path):
+    good = tmp_path / "windows11-kb5000001-x64.msu"
+    data = write_cab(good)
+    assert inspect_package(str(good)).valid
+    assert inspect_package(str(good)).sha256 == hashlib.sha256(data).hexdigest()
+
+    truncated = tmp_path / "windows11-kb5000002-x64.msu"
+    truncated.write_bytes(data[:500])
+    package = inspect_package(str(truncated))
+    assert package.corrupt and "cabinet header says" in package.error
+
+    junk = tmp_path / "windows11-kb5000003-x64.msu"
+    junk.write_bytes(b"<html>Not found</html>")
+    assert "bad cabinet header" in inspect_package(str(junk)).error
+
+    package = inspect_package(MsuPackage(str(good), expected_sha256="0" * 64))
+    assert package.corrupt and "repository manifest" in package.error
+
+
+def test_inspect_package_checks_the_catalog_sha1(tmp_path):
+    data = write_cab(tmp_path / "scratch.msu")
+    sha1 = hashlib.sha1(data).hexdigest()
+    right = tmp_path / f"windows11-kb5000001-x64_{sha1}.msu"
+    wrong = tmp_path / f"windows11-kb5000001-x64_{'0' * 40}.msu"
+    right.write_bytes(data)
+    wrong.write_bytes(data)
+    assert inspect_package(str(right)).valid
+    assert "catalog" in inspect_package(str(wrong)).error
+
+
+def test_verify_cache_skips_hashing_unchanged_files(tmp_path, monkeypatch):
+    path = tmp_path / "windows11-kb5000001-x64.msu"
+    write_cab(path)
+    hashed = []
+    real_digests = samsoft_update_core.file_digests
+    monkeypatch.setattr(samsoft_update_core, "file_digests",
+                        lambda path, names: hashed.append(path) or real_digests(path, names))
+    cache = VerifyCache(str(tmp_path))
+    first = inspect_package(str(path), cache)
+    cache.save()
+    second = inspect_package(str(path), VerifyCache(str(tmp_path)))
+    assert len(hashed) == 1
+    assert second.valid and second.sha256 == first.sha256
+    # A changed file is hashed again, and its truncation is noticed
+    path.write_bytes(path.read_bytes()[:-1])
+    assert inspect_package(str(path), VerifyCache(str(tmp_path))).corrupt
+
+
+# ---------- Maintenance Scheduler ----------
+
+@pytest.mark.parametrize("text, expected", [
+    ("22:00-04:00", (1320, 240)),
+    (" 9:30 - 17:00 ", (570, 1020)),
+    ("00:00-24:00", (0, 1440)),
+    ("25:00-01:00", None),
+    ("10:60-11:00", None),
+    ("", None),
+    ("nightly", None),
+])
+def test_parse_window(text, expected):
+    assert parse_window(text) == expected
+
+
+@pytest.mark.parametrize("text, hour, inside", [
+    ("22:00-04:00", 23, True),
+    ("22:00-04:00", 3, True),
+    ("22:00-04:00", 12, False),
+    ("01:00-05:00", 5, False),
+    ("", 12, False),
+])
+def test_in_window(text, hour, inside):
+    now = time.mktime((2024, 1, 15, hour, 0, 0, 0, 0, -1))
+    assert in_window(text, now) is inside
+
+
+def test_installed_packages_are_not_installed_again(tmp_path):
+    engine = UpdateEngine({"repo_path": str(tmp_path), "install_window": "00:00-24:00"},
+                          ps_session=make_session(lambda command: ([], [], 0)))
+    try:
+        engine.dism_runner = FakeDism(store=engine.store)
+        for kb in (5000001, 5000002):
+            path = tmp_path / f"windows11-kb{kb}-x64.msu"
+            write_cab(path)
+            engine.store.add_file(str(path), kb=str(kb))
+            engine.manifest.record("downloaded", [{"KB": str(kb), "Title": f"Update {kb}"}])
+        scheduler = MaintenanceScheduler(engine)
+        assert scheduler.installable()
+        installed, failed = engine.install_offline()
+        assert len(installed) == 2 and not failed
+        assert not scheduler.installable()
+        calls = len(engine.dism_runner.calls)
+        assert engine.install_offline() == ([], [])
+        assert len(engine.dism_runner.calls) == calls
+    finally:
+        engine.close()